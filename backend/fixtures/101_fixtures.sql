@@ -4,7 +4,7 @@ do $$DECLARE
  row_count integer;
 BEGIN
  SELECT COUNT(*) INTO row_count FROM "schema_migrations"
- WHERE "version" = 100 AND "dirty" IS FALSE;
+ WHERE "version" = 101 AND "dirty" IS FALSE;
  ASSERT row_count = 1, 'The version of the database conflicts with the version of the fixtures';
 END$$;
 
@@ -92,16 +92,16 @@ INSERT INTO "property" ("id", "class_name", "name", "dtype", "dtype_meta", "requ
 (25,	'Phenotype',	'Country',	'Text',	'{}',	'0', '0');
 
 
-INSERT INTO "codelist" ("id", "name", "description", "transient_commit_id", "reference_id") VALUES
-('00000000-0000-0000-0004-000000000001',	'Coronary Artery Disease',	'Imported ''Coronary Artery Disease'' from file ''init.csv'' with 146 codes from 2 ontologies (ICD-10-CM: 79/79, ICD-9-CM: 67/67).',	NULL,	NULL),
-('00000000-0000-0000-0004-000000000002',	'Atherosclerosis',	'Imported ''Atherosclerosis'' from file ''init.csv'' with 29 codes from 2 ontologies (ICD-10-CM: 15/15, ICD-9-CM: 14/14).',	NULL,	NULL),
-('00000000-0000-0000-0004-000000000003',	'Angina',	'Imported ''Angina'' from file ''init.csv'' with 9 codes from 2 ontologies (ICD-10-CM: 5/5, ICD-9-CM: 4/4).',	NULL,	NULL),
-('00000000-0000-0000-0004-000000000004',	'Coronary Artery Disease',	'Imported ''Coronary Artery Disease'' from file ''init.csv'' with 89 codes from 2 ontologies (ICD-10-CM: 65/65, ICD-9-CM: 24/24).',	NULL,	NULL),
-('00000000-0000-0000-0004-000000000005',	'Coronary Artery Disease',	'Imported ''Coronary Artery Disease'' from file ''init.csv'' with 146 codes from 2 ontologies (ICD-10-CM: 79/79, ICD-9-CM: 67/67).',	NULL,	NULL),
-('00000000-0000-0000-0004-000000000006',	'Atherosclerosis',	'Imported ''Atherosclerosis'' from file ''init.csv'' with 29 codes from 2 ontologies (ICD-10-CM: 15/15, ICD-9-CM: 14/14).',	NULL,	NULL),
-('00000000-0000-0000-0004-000000000007',	'Angina',	'Imported ''Angina'' from file ''init.csv'' with 9 codes from 2 ontologies (ICD-10-CM: 5/5, ICD-9-CM: 4/4).',	NULL,	NULL),
-('00000000-0000-0000-0004-000000000008',	'Coronary Artery Disease',	'Imported ''Coronary Artery Disease'' from file ''init.csv'' with 89 codes from 2 ontologies (ICD-10-CM: 65/65, ICD-9-CM: 24/24).',	NULL,	NULL),
-('00000000-0000-0000-0004-000000000009',	'Coronary Artery Disease',	'Imported ''Coronary Artery Disease'' from file ''init.csv'' with 89 codes from 2 ontologies (ICD-10-CM: 65/65, ICD-9-CM: 24/24).',	NULL,	'00000000-0000-0000-0004-000000000008');
+INSERT INTO "codelist" ("id", "name", "description", "transient_commit_id", "reference_id", "head_codesets", "head_version") VALUES
+('00000000-0000-0000-0004-000000000001',	'Coronary Artery Disease',	'Imported ''Coronary Artery Disease'' from file ''init.csv'' with 146 codes from 2 ontologies (ICD-10-CM: 79/79, ICD-9-CM: 67/67).',	NULL,	NULL,	'[["ICD-10-CM",[34554,34555,34556,34557,34560,34561,34562,34564,34565,34567,34568,34569,34570,34576,34577,34578,34579,34580,34582,34583,34584,34585,34586,34587,34588,34589,34590,34592,34593,34594,34598,34600,34601,34602,34603,34604,34605,34607,34608,34609,34610,34613,34614,34615,34616,34618,34619,34620,34621,34623,34624,34625,34626,34628,34629,34630,34631,34633,34634,34635,34636,34638,34639,34640,34641,34643,34644,34645,34646,34649,34650,34651,34652,34653,34654,34655,34656,119021,119112]],["ICD-9-CM",[315805,315806,315807,315808,315809,315810,315811,315812,315813,315814,315815,315816,315817,315818,315819,315820,315821,315822,315823,315824,315825,315826,315827,315828,315829,315830,315831,315832,315833,315834,315835,315836,315837,315838,315839,315840,315841,315842,315843,315844,315846,315847,315848,315849,315850,315851,315853,315854,315855,315858,315859,315860,315861,315862,315863,315864,315865,315867,315868,315869,315870,315871,315872,315873,315874,315875,331821]]]',	2),
+('00000000-0000-0000-0004-000000000002',	'Atherosclerosis',	'Imported ''Atherosclerosis'' from file ''init.csv'' with 29 codes from 2 ontologies (ICD-10-CM: 15/15, ICD-9-CM: 14/14).',	NULL,	NULL,	'[["ICD-10-CM",[35365,35366,35373,35379,35385,35402,35408,35414,35462,35510,35558,35655,35657,35658,35659]],["ICD-9-CM",[316113,316114,316116,316117,316118,316119,316120,316121,316123,316124,316125,316126,316127,316128]]]',	2),
+('00000000-0000-0000-0004-000000000003',	'Angina',	'Imported ''Angina'' from file ''init.csv'' with 9 codes from 2 ontologies (ICD-10-CM: 5/5, ICD-9-CM: 4/4).',	NULL,	NULL,	'[["ICD-10-CM",[34553,34554,34555,34556,34557]],["ICD-9-CM",[315847,315853,315854,315855]]]',	2),
+('00000000-0000-0000-0004-000000000004',	'Coronary Artery Disease',	'Imported ''Coronary Artery Disease'' from file ''init.csv'' with 89 codes from 2 ontologies (ICD-10-CM: 65/65, ICD-9-CM: 24/24).',	NULL,	NULL,	'[["ICD-10-CM",[34553,34554,34555,34556,34557,34597,34598,34599,34600,34601,34602,34603,34606,34607,34608,34609,34610,34611,34612,34613,34614,34615,34616,34617,34618,34619,34620,34621,34622,34623,34624,34625,34626,34627,34628,34629,34630,34631,34632,34633,34634,34635,34636,34637,34638,34639,34640,34641,34642,34643,34644,34645,34646,34647,34648,34649,34650,34651,34652,34653,34654,34655,34656,119021,119112]],["ICD-9-CM",[315847,315848,315849,315850,315852,315854,315855,315856,315859,315860,315861,315862,315863,315864,315865,315866,315868,315869,315870,315871,315872,315873,315874,315875]]]',	2),
+('00000000-0000-0000-0004-000000000005',	'Coronary Artery Disease',	'Imported ''Coronary Artery Disease'' from file ''init.csv'' with 146 codes from 2 ontologies (ICD-10-CM: 79/79, ICD-9-CM: 67/67).',	NULL,	NULL,	'[["ICD-10-CM",[34554,34555,34556,34557,34560,34561,34562,34564,34565,34567,34568,34569,34570,34576,34577,34578,34579,34580,34582,34583,34584,34585,34586,34587,34588,34589,34590,34592,34593,34594,34598,34600,34601,34602,34603,34604,34605,34607,34608,34609,34610,34613,34614,34615,34616,34618,34619,34620,34621,34623,34624,34625,34626,34628,34629,34630,34631,34633,34634,34635,34636,34638,34639,34640,34641,34643,34644,34645,34646,34649,34650,34651,34652,34653,34654,34655,34656,119021,119112]],["ICD-9-CM",[315805,315806,315807,315808,315809,315810,315811,315812,315813,315814,315815,315816,315817,315818,315819,315820,315821,315822,315823,315824,315825,315826,315827,315828,315829,315830,315831,315832,315833,315834,315835,315836,315837,315838,315839,315840,315841,315842,315843,315844,315846,315847,315848,315849,315850,315851,315853,315854,315855,315858,315859,315860,315861,315862,315863,315864,315865,315867,315868,315869,315870,315871,315872,315873,315874,315875,331821]]]',	2),
+('00000000-0000-0000-0004-000000000006',	'Atherosclerosis',	'Imported ''Atherosclerosis'' from file ''init.csv'' with 29 codes from 2 ontologies (ICD-10-CM: 15/15, ICD-9-CM: 14/14).',	NULL,	NULL,	'[["ICD-10-CM",[35365,35366,35373,35379,35385,35402,35408,35414,35462,35510,35558,35655,35657,35658,35659]],["ICD-9-CM",[316113,316114,316116,316117,316118,316119,316120,316121,316123,316124,316125,316126,316127,316128]]]',	2),
+('00000000-0000-0000-0004-000000000007',	'Angina',	'Imported ''Angina'' from file ''init.csv'' with 9 codes from 2 ontologies (ICD-10-CM: 5/5, ICD-9-CM: 4/4).',	NULL,	NULL,	'[["ICD-10-CM",[34553,34554,34555,34556,34557]],["ICD-9-CM",[315847,315853,315854,315855]]]',	2),
+('00000000-0000-0000-0004-000000000008',	'Coronary Artery Disease',	'Imported ''Coronary Artery Disease'' from file ''init.csv'' with 89 codes from 2 ontologies (ICD-10-CM: 65/65, ICD-9-CM: 24/24).',	NULL,	NULL,	'[["ICD-10-CM",[34553,34554,34555,34556,34557,34597,34598,34599,34600,34601,34602,34603,34606,34607,34608,34609,34610,34611,34612,34613,34614,34615,34616,34617,34618,34619,34620,34621,34622,34623,34624,34625,34626,34627,34628,34629,34630,34631,34632,34633,34634,34635,34636,34637,34638,34639,34640,34641,34642,34643,34644,34645,34646,34647,34648,34649,34650,34651,34652,34653,34654,34655,34656,119021,119112]],["ICD-9-CM",[315847,315848,315849,315850,315852,315854,315855,315856,315859,315860,315861,315862,315863,315864,315865,315866,315868,315869,315870,315871,315872,315873,315874,315875]]]',	2),
+('00000000-0000-0000-0004-000000000009',	'Coronary Artery Disease',	'Imported ''Coronary Artery Disease'' from file ''init.csv'' with 89 codes from 2 ontologies (ICD-10-CM: 65/65, ICD-9-CM: 24/24).',	NULL,	'00000000-0000-0000-0004-000000000008',	'[["ICD-10-CM",[34553,34554,34555,34556,34557,34597,34598,34599,34600,34601,34602,34603,34606,34607,34608,34609,34610,34611,34612,34613,34614,34615,34616,34617,34618,34619,34620,34621,34622,34623,34624,34625,34626,34627,34628,34629,34630,34631,34632,34633,34634,34635,34636,34637,34638,34639,34640,34641,34642,34643,34644,34645,34646,34647,34648,34649,34650,34651,34652,34653,34654,34655,34656,119021,119112]],["ICD-9-CM",[315847,315848,315849,315850,315852,315854,315855,315856,315859,315860,315861,315862,315863,315864,315865,315866,315868,315869,315870,315871,315872,315873,315874,315875]]]',	2);
 
 
 INSERT INTO "commit" ("id", "codelist_id", "author_id", "created_at", "message", "position") VALUES
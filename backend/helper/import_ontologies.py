@@ -5,7 +5,10 @@ As input it takes the tables code_new and ontology_new,
 as converted from the target table from the UMLS pipeline.
 This data has not correctly ordered IDs.
 
-It writes to the tables code and ontology.
+It writes to the tables code and ontology and (re-)creates the trigram
+indexes of the code table that are used by the code search. The content
+hash of the new data is stamped as data version into ontology_meta, so
+the caches of the codes get rebuilt.
 
 It does not change any data in the code sets.
 """
@@ -24,16 +27,22 @@ from sqlalchemy import (
     text,
 )
 from sqlalchemy.dialects.postgresql import ARRAY, array_agg
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.future import select
 from sqlalchemy.orm import Session
-from sqlalchemy.schema import CreateTable, DropTable
+from sqlalchemy.schema import CreateIndex, CreateTable, DropTable
 
 # from medconb.types import Session
 import medconb.domain as d
 from medconb.persistence.sqlalchemy import create_sessionmaker
+from medconb.persistence.sqlalchemy.cache import (
+    DATA_VERSION_KEY,
+    ontology_content_hash,
+)
 from medconb.persistence.sqlalchemy.ontology_orm import code as code_table
 from medconb.persistence.sqlalchemy.ontology_orm import mapper_registry
 from medconb.persistence.sqlalchemy.ontology_orm import ontology as ontology_table
+from medconb.persistence.sqlalchemy.ontology_orm import ontology_meta as meta_table
 
 code_new_tbl = Table(
     "code_new",
@@ -227,10 +236,30 @@ def _main(session: Session):
     exec(session, CreateTable(code_table))
     exec(session, insert_codes_stmt)
 
+    # building the indexes after the bulk insert is a lot faster than
+    # maintaining them while inserting
+    print("Create search indexes ...")
+    exec_text(session, "CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for index in code_table.indexes:
+        exec(session, CreateIndex(index))
+    exec_text(session, "ANALYZE code")
+
     exec(session, DropTable(ontology_table, if_exists=True))
     exec(session, CreateTable(ontology_table))
     exec(session, insert_ontologies_stmt)
 
+    print("Stamp data version ...")
+    exec(session, CreateTable(meta_table, if_not_exists=True))
+    stamp_stmt = pg_insert(meta_table).values(
+        key=DATA_VERSION_KEY, value=ontology_content_hash(session)
+    )
+    exec(
+        session,
+        stamp_stmt.on_conflict_do_update(
+            index_elements=[meta_table.c.key], set_={"value": stamp_stmt.excluded.value}
+        ),
+    )
+
     session.commit()
 
 
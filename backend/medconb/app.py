@@ -2,6 +2,7 @@ from typing import TYPE_CHECKING, Callable
 
 import confuse  # type: ignore
 import redis
+import redis.asyncio
 from sqlalchemy import create_engine
 
 from . import server
@@ -29,8 +30,10 @@ def _create_sessionmaker(
     db_type = config["database"]["type"].get()
 
     if db_type == "sqlalchemy":
-        cache_client = _create_cache_client(config["cache"])
-        return _create_sqlalchemy_sessionmaker(config["database"], cache_client)
+        cache_client, async_cache_client = _create_cache_clients(config["cache"])
+        return _create_sqlalchemy_sessionmaker(
+            config["database"], config["cache"], cache_client, async_cache_client
+        )
     elif db_type == "inmemory":
         raise NotImplementedError("inmemory database type was deprecated")
     else:
@@ -40,7 +43,7 @@ def _create_sessionmaker(
 
 
 def _create_sqlalchemy_sessionmaker(
-    db_config, cache_client
+    db_config, cache_config, cache_client, async_cache_client=None
 ) -> tuple["sessionmaker", list[Callable]]:  # pragma: no cover
     engine_medconb = create_engine(
         url=db_config["medconb"]["url"].get(str),
@@ -56,10 +59,60 @@ def _create_sqlalchemy_sessionmaker(
         pool_pre_ping=True,
     )
 
-    return create_sqlalchemy_sessionmaker(engine_medconb, engine_ontology, cache_client)
+    return create_sqlalchemy_sessionmaker(
+        engine_medconb,
+        engine_ontology,
+        cache_client,
+        code_lru_size=cache_config["lruSize"].get(confuse.Optional(int, default=50000)),
+        async_cache_client=async_cache_client,
+        code_snapshot_dir=db_config["ontologies"]["snapshotDir"].get(
+            confuse.Optional(str)
+        ),
+        search_cache_size=cache_config["searchSize"].get(
+            confuse.Optional(int, default=1000)
+        ),
+        search_cache_ttl=cache_config["searchTTL"].get(
+            confuse.Optional(int, default=600)
+        ),
+        code_search_index=cache_config["searchIndex"].get(
+            confuse.Optional(bool, default=False)
+        ),
+    )
+
 
+def _create_cache_clients(
+    cache_config,
+) -> tuple[redis.Redis | None, redis.asyncio.Redis | None]:  # pragma: no cover
+    """
+    Creates a sync and an asyncio redis client. Both use their own
+    connection pool, configured from the same settings.
+    """
+    if not cache_config["enabled"].get(bool):
+        return None, None
+
+    socket = cache_config["socket"].get(confuse.Optional(str))
+    if socket:
+        url = f"unix://{socket}?db=0"
+    else:
+        host = cache_config["host"].get(str)
+        port = cache_config["port"].get(confuse.Optional(int, default=6379))
+        url = f"redis://{host}:{port}/0"
 
-def _create_cache_client(cache_config) -> redis.Redis | None:  # pragma: no cover
-    if cache_config["enabled"].get(bool):
-        return redis.StrictRedis(host=cache_config["host"].get(str), port=6379, db=0)
-    return None
+    pool_kwargs: dict = {
+        "max_connections": cache_config["maxConnections"].get(
+            confuse.Optional(int, default=50)
+        ),
+    }
+    if not socket:
+        pool_kwargs["socket_keepalive"] = cache_config["socketKeepalive"].get(
+            confuse.Optional(bool, default=True)
+        )
+
+    pool = redis.ConnectionPool.from_url(url, **pool_kwargs)
+    async_pool: redis.asyncio.ConnectionPool = redis.asyncio.ConnectionPool.from_url(
+        url, **pool_kwargs
+    )
+    return (
+        redis.Redis(connection_pool=pool),
+        redis.asyncio.Redis(connection_pool=async_pool),
+    )
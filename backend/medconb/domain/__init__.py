@@ -21,7 +21,9 @@ from .codelist import (
     Codeset,
     Codesets,
     Commit,
+    DeltaSetOfCodeIds,
     SetOfCodeIds,
+    count_selected_descendants,
     create_cloned_codelist_name,
     delete_codelist,
     squash_codelist,
@@ -43,7 +45,15 @@ from .container import (
     OrderedContainer,
     add_or_move_item,
 )
-from .ontology import Code, CodeSearchParam, CodeSearchParamType, Ontology, QueryData
+from .ontology import (
+    Code,
+    CodeSearchParam,
+    CodeSearchParamType,
+    FuzzySearchNotSupportedException,
+    FuzzySearchParam,
+    Ontology,
+    QueryData,
+)
 from .phenotype import Phenotype, PhenotypeID
 from .user import CollectionNotInWorkspaceException, User, Workspace
 
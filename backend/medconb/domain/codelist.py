@@ -1,9 +1,11 @@
+from bisect import bisect_left, bisect_right
 from copy import deepcopy
 from dataclasses import dataclass, field
 from datetime import datetime
 from functools import reduce
+from itertools import chain
 from operator import add
-from typing import TYPE_CHECKING, AbstractSet, Iterable
+from typing import TYPE_CHECKING, AbstractSet, Iterable, Iterator
 from uuid import UUID
 
 from .base import WorkspaceID
@@ -13,6 +15,7 @@ from .user import User, Workspace
 if TYPE_CHECKING:
     from .base import UserID
     from .collection import Collection
+    from .ontology import Code
     from .phenotype import Phenotype
 
 
@@ -113,6 +116,84 @@ class Changeset:
         )
 
 
+class DeltaSetOfCodeIds(AbstractSet[int]):
+    """
+    An immutable set of code ids, stored as a base set and the ids added
+    to and removed from it since. Versions derived with `apply` share
+    the base, so applying a changeset copies only the deltas instead of
+    all ids. Once the deltas exceed `COMPACT_RATIO` of the base, they
+    are merged into a new base, which amortizes to constant cost per
+    change.
+
+    The base must not be modified after it was passed in.
+    """
+
+    COMPACT_RATIO = 0.25
+
+    def __init__(
+        self,
+        base: AbstractSet[int] = frozenset(),
+        added: AbstractSet[int] = frozenset(),
+        removed: AbstractSet[int] = frozenset(),
+    ):
+        self._base = base
+        # not in the base
+        self._added = added
+        # in the base
+        self._removed = removed
+
+    @classmethod
+    def of(cls, code_ids: AbstractSet[int]) -> "DeltaSetOfCodeIds":
+        if isinstance(code_ids, cls):
+            return code_ids
+        return cls(code_ids)
+
+    def __contains__(self, code_id: object) -> bool:
+        if code_id in self._added:
+            return True
+        return code_id in self._base and code_id not in self._removed
+
+    def __iter__(self) -> Iterator[int]:
+        yield from (id_ for id_ in self._base if id_ not in self._removed)
+        yield from self._added
+
+    def __len__(self) -> int:
+        return len(self._base) - len(self._removed) + len(self._added)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({set(self)})"
+
+    def apply(self, changeset: Changeset) -> "DeltaSetOfCodeIds":
+        """
+        Returns the set with the codes of `changeset` added and then
+        removed. Like SetOfCodeIds it fails if a code to add already
+        exists or a code to remove does not.
+        """
+        added = set(self._added)
+        removed = set(self._removed)
+
+        for code_id in changeset.code_ids_added:
+            if code_id in self:
+                raise ValueError("Code already exists")
+            if code_id in removed:
+                removed.remove(code_id)
+            else:
+                added.add(code_id)
+
+        for code_id in changeset.code_ids_removed:
+            if code_id in added:
+                added.remove(code_id)
+            elif code_id in self._base and code_id not in removed:
+                removed.add(code_id)
+            else:
+                raise ValueError("Code does not exist")
+
+        res = DeltaSetOfCodeIds(self._base, added, removed)
+        if len(added) + len(removed) > self.COMPACT_RATIO * len(self._base):
+            res = DeltaSetOfCodeIds(frozenset(res))
+        return res
+
+
 @dataclass
 class Author(User):
     @staticmethod
@@ -159,7 +240,7 @@ class Codeset:
     """
 
     ontology_id: str
-    code_ids: SetOfCodeIds
+    code_ids: AbstractSet[int]
 
     @property
     def number_of_codes(self):
@@ -191,28 +272,32 @@ class Codesets(list[Codeset]):
         respective codes to/from the version, while incrementing the
         version number.
 
-        Returns a new object.
+        Returns a new object. It shares the codesets of the ontologies
+        the commit does not change with this one, and the others share
+        their code ids by way of DeltaSetOfCodeIds, so a commit costs
+        O(changes). Codesets must not be modified in place.
 
         TODO: is not a derived class, but a enclosing. refactor!
         """
-        codesets = deepcopy(self)
-
+        codesets = list(self)
         ontology_map: dict[str, int] = {
             cs.ontology_id: idx for idx, cs in enumerate(codesets)
         }
 
         for changeset in commit.changesets:
-            if changeset.ontology_id not in ontology_map:
-                codesets.append(Codeset(changeset.ontology_id, SetOfCodeIds()))
-                ontology_map[changeset.ontology_id] = len(codesets) - 1
-
-            cs = codesets[ontology_map[changeset.ontology_id]]
-            cs.code_ids |= changeset.code_ids_added
-            cs.code_ids -= changeset.code_ids_removed
-
-        codesets = Codesets(filter(lambda cs: cs.number_of_codes > 0, codesets))
-        codesets._version += 1
-        return codesets
+            ontology_id = changeset.ontology_id
+            if ontology_id not in ontology_map:
+                ontology_map[ontology_id] = len(codesets)
+                codesets.append(Codeset(ontology_id, DeltaSetOfCodeIds()))
+
+            idx = ontology_map[ontology_id]
+            code_ids = DeltaSetOfCodeIds.of(codesets[idx].code_ids)
+            codesets[idx] = Codeset(ontology_id, code_ids.apply(changeset))
+
+        return Codesets(
+            filter(lambda cs: cs.number_of_codes > 0, codesets),
+            version=self._version + 1,
+        )
 
     @property
     def version(self):
@@ -231,6 +316,20 @@ class Codelist:
     reference_id: CodelistID | None = None
 
     _codesets: Codesets | None = field(init=False, repr=False, default=None)
+    # The codesets of the head version as (ontology_id, code_ids) pairs.
+    # They are persisted (@see serialize_head) with each commit, so
+    # reading them does not replay the commits.
+    _head_codesets: list[tuple[str, list[int]]] = field(
+        init=False, repr=False, default_factory=list
+    )
+    _head_version: int = field(init=False, repr=False, default=1)
+    # transient commit and codesets the transient codesets were computed from
+    _transient_codesets: tuple[Commit, Codesets, Codesets] | None = field(
+        init=False, repr=False, default=None
+    )
+
+    def __post_init__(self):
+        self._set_head(reduce(add, self.commits, Codesets()))
 
     @property
     def type_(self) -> ItemType:
@@ -239,24 +338,67 @@ class Codelist:
     @property
     def codesets(self) -> Codesets:
         if self._codesets is None:
-            self._codesets = reduce(add, self.commits, Codesets())
+            self._codesets = Codesets(
+                (
+                    Codeset(o, DeltaSetOfCodeIds(frozenset(ids)))
+                    for o, ids in self._head_codesets
+                ),
+                version=self._head_version,
+            )
         return self._codesets
 
     @property
     def version(self) -> int:
         return self.codesets.version
 
+    def codesets_of_version(self, version: int) -> Codesets:
+        """
+        Returns the codesets of a former (or the current) version, i.e.
+        after applying the first `version - 1` commits.
+        """
+        if not 1 <= version <= self.version:
+            raise ValueError(f"Codelist {self.id} has no version {version}")
+        if version == self.version:
+            return self.codesets
+        return reduce(add, self.commits[: version - 1], Codesets())
+
     @property
     def transient_codesets(self) -> Codesets | None:
-        if self.transient_commit:
-            return self.codesets + self.transient_commit
-        return None
+        if not self.transient_commit:
+            return None
+
+        memo = self._transient_codesets
+        if (
+            memo is None
+            or memo[0] is not self.transient_commit
+            or memo[1] is not self.codesets
+        ):
+            memo = (
+                self.transient_commit,
+                self.codesets,
+                self.codesets + self.transient_commit,
+            )
+            self._transient_codesets = memo
+        return memo[2]
 
     def add_commit(self, commit: Commit):
-        self.codesets + commit  # check that the commit is valid to apply
+        codesets = self.codesets + commit  # fails if the commit is invalid
         self.commits.append(commit)
         self.transient_commit = None
-        self._codesets = None
+        self._set_head(codesets)
+
+    def serialize_head(self) -> list[tuple[str, list[int]]]:
+        """
+        Returns the codesets of the head version as they are persisted
+        in `_head_codesets`, i.e. (ontology_id, code_ids) pairs with the
+        ids sorted. It is called when the codelist is written, so a
+        commit itself does not sort all codes.
+        """
+        return [(cs.ontology_id, sorted(cs.code_ids)) for cs in self.codesets]
+
+    def _set_head(self, codesets: Codesets):
+        self._codesets = codesets
+        self._head_version = codesets.version
 
     def __eq__(self, other: object):  # noqa: radon complexity
         if not isinstance(other, Codelist):
@@ -265,6 +407,28 @@ class Codelist:
         return self.id == other.id
 
 
+def count_selected_descendants(
+    codesets: Codesets, codes: Iterable["Code"]
+) -> list[tuple[bool, int]]:
+    """
+    Returns for each code whether it is part of `codesets` and how many
+    of its descendants are.
+
+    The descendants of a code are the ids in the interval
+    (code.id, code.last_descendant_id], so they are counted by binary
+    search in the sorted ids of the codesets instead of loading them.
+    """
+    selected = sorted(chain.from_iterable(cs.code_ids for cs in codesets))
+
+    res = []
+    for code in codes:
+        start = bisect_left(selected, code.id)
+        end = bisect_right(selected, code.last_descendant_id)
+        is_selected = start < end and selected[start] == code.id
+        res.append((is_selected, end - start - int(is_selected)))
+    return res
+
+
 def create_cloned_codelist_name(codelist_name: str, illegal_names: list[str]) -> str:
     if codelist_name not in illegal_names:
         return codelist_name
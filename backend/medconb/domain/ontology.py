@@ -1,7 +1,17 @@
 import json
-from dataclasses import asdict, dataclass
+import struct
+from dataclasses import dataclass
 from enum import IntEnum, auto
-from typing import Optional, Protocol, runtime_checkable
+from typing import Iterable, Optional, Protocol, runtime_checkable
+
+# Binary layout of a serialized Code (all little endian):
+#   header: format version, id, last_descendant_id, the byte lengths of
+#           code, ontology_id and description and the number of path
+#           and children ids
+#   body:   the utf-8 strings followed by the path and children ids as
+#           packed int32 arrays
+CODE_FORMAT_VERSION = 1
+_CODE_HEADER = struct.Struct("<BiiHHIII")
 
 
 @dataclass
@@ -30,12 +40,103 @@ class Code:
             return None
         return self.path[-2]
 
-    def serialize(self):
-        return json.dumps(asdict(self), separators=(",", ":"))
+    def serialize(self) -> bytes:
+        return Code.serialize_fields(
+            self.id,
+            self.code,
+            self.ontology_id,
+            self.description,
+            self.path,
+            self.children_ids,
+            self.last_descendant_id,
+        )
+
+    @staticmethod
+    def serialize_fields(
+        id_: int,
+        code: str,
+        ontology_id: str,
+        description: str,
+        path: list[int],
+        children_ids: list[int],
+        last_descendant_id: int,
+    ) -> bytes:
+        """
+        Serializes the fields of a code (e.g. a database row) without
+        creating a Code.
+        """
+        code_ = code.encode()
+        ontology_id_ = ontology_id.encode()
+        description_ = description.encode()
+
+        return b"".join(
+            [
+                _CODE_HEADER.pack(
+                    CODE_FORMAT_VERSION,
+                    id_,
+                    last_descendant_id,
+                    len(code_),
+                    len(ontology_id_),
+                    len(description_),
+                    len(path),
+                    len(children_ids),
+                ),
+                code_,
+                ontology_id_,
+                description_,
+                struct.pack(f"<{len(path)}i", *path),
+                struct.pack(f"<{len(children_ids)}i", *children_ids),
+            ]
+        )
+
+    @staticmethod
+    def deserialize(data: bytes | str) -> "Code":
+        """
+        Reads a Code written by `serialize`. Codes that were stored as
+        JSON by older versions are still understood.
+        """
+        if isinstance(data, str) or data[:1] == b"{":
+            return Code(**json.loads(data))
+
+        if data[0] != CODE_FORMAT_VERSION:
+            raise ValueError(f"Unknown code serialization format: {data[0]}")
+
+        (
+            _,
+            id_,
+            last_descendant_id,
+            len_code,
+            len_ontology_id,
+            len_description,
+            len_path,
+            len_children,
+        ) = _CODE_HEADER.unpack_from(data)
+
+        pos = _CODE_HEADER.size
+        code = data[pos : pos + len_code].decode()
+        pos += len_code
+        ontology_id = data[pos : pos + len_ontology_id].decode()
+        pos += len_ontology_id
+        description = data[pos : pos + len_description].decode()
+        pos += len_description
+        path = list(struct.unpack_from(f"<{len_path}i", data, pos))
+        pos += 4 * len_path
+        children_ids = list(struct.unpack_from(f"<{len_children}i", data, pos))
+
+        return Code(
+            id=id_,
+            code=code,
+            ontology_id=ontology_id,
+            description=description,
+            path=path,
+            children_ids=children_ids,
+            last_descendant_id=last_descendant_id,
+        )
 
     @staticmethod
-    def deserialize(data: str) -> "Code":
-        return Code(**json.loads(data))
+    def deserialize_many(data: Iterable[bytes | str | None]) -> list["Code"]:
+        """Deserializes e.g. the result of a MGET, skipping missing entries."""
+        return [Code.deserialize(item) for item in data if item]
 
 
 class CodeSearchParamType(IntEnum):
@@ -52,9 +153,32 @@ class CodeSearchParam(Protocol):  # pragma: no cover
     def type(self) -> CodeSearchParamType: ...
 
 
+class FuzzySearchParam(Protocol):  # pragma: no cover
+    @property
+    def threshold(self) -> float: ...
+
+    @property
+    def limit(self) -> int: ...
+
+
+@dataclass(frozen=True)
+class FuzzySearchNotSupportedException(Exception):
+    def __repr__(self) -> str:
+        return (
+            "Fuzzy searches are not supported: the ontology database lacks the"
+            " pg_trgm extension"
+        )
+
+
 class QueryData(Protocol):  # pragma: no cover
     @property
     def code(self) -> Optional[CodeSearchParam]: ...
 
     @property
     def description(self) -> Optional[str]: ...
+
+    @property
+    def fuzzy(self) -> Optional[FuzzySearchParam]: ...
+
+    @property
+    def root_code_id(self) -> Optional[int]: ...
@@ -25,6 +25,8 @@ schema = make_executable_schema(
     query.commit,
     query.changeset,
     query.code,
+    query.code_search_results,
+    query.ontology_code_search_results,
     query.container_item,
     query.container_spec,
     query.search_result_item,
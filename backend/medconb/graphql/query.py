@@ -1,3 +1,4 @@
+from bisect import bisect_left
 from typing import Callable, Iterable, Literal, Optional, Sequence, cast
 
 from ariadne import UnionType
@@ -8,7 +9,11 @@ from medconb.types import Session
 
 from .helper import InteractorResolver, get_sub_fields
 from .objects import ObjectType, QueryType
-from .types import PagedCodesDto
+from .types import (
+    OntologyCodeSearchResultsDto,
+    PagedCodesDto,
+    SearchResultsResponseDto,
+)
 
 query = QueryType()
 user = ObjectType("User")
@@ -22,6 +27,8 @@ codeset = ObjectType("Codeset")
 commit = ObjectType("Commit")
 changeset = ObjectType("Changeset")
 code = ObjectType("Code")
+code_search_results = ObjectType("CodeSearchResults")
+ontology_code_search_results = ObjectType("OntologyCodeSearchResults")
 container_spec = ObjectType("ContainerSpec", d.ContainerSpec)
 
 container_item = UnionType("ContainerItem")
@@ -106,8 +113,16 @@ query.set_field("properties", InteractorResolver(interactors.Properties))
 query.set_field("collection", InteractorResolver(interactors.Collection))
 query.set_field("phenotype", InteractorResolver(interactors.Phenotype))
 query.set_field("codelist", InteractorResolver(interactors.Codelist))
+query.set_field(
+    "codelistDescendantCounts", InteractorResolver(interactors.CodelistDescendantCounts)
+)
 
+query.set_field("subtreeCodeIds", InteractorResolver(interactors.SubtreeCodeIds))
 query.set_field("searchCodes", InteractorResolver(interactors.SearchCodes))
+query.set_field("searchCodesPaged", InteractorResolver(interactors.SearchCodesPaged))
+query.set_field(
+    "searchCodesByOntology", InteractorResolver(interactors.SearchCodesByOntology)
+)
 query.set_field("users", InteractorResolver(interactors.Users))
 
 query.set_field("searchEntities", InteractorResolver(interactors.SearchEntities))
@@ -157,7 +172,7 @@ def resolve_ontology(o: d.Codeset | d.Changeset, info) -> d.Ontology:
 
 @ontology.field("rootCodes")
 @code.field("children")
-def resolve_paged_codes(o: d.Ontology | d.Code, info, **kwargs) -> list[d.Code]:
+async def resolve_paged_codes(o: d.Ontology | d.Code, info, **kwargs) -> list[d.Code]:
     session: Session = info.context["request"].scope["db_session"]
 
     # If you only request the ids, you can set the page_size to -1
@@ -178,23 +193,65 @@ def resolve_paged_codes(o: d.Ontology | d.Code, info, **kwargs) -> list[d.Code]:
             code_ids = o.children_ids
 
     if return_all_ids:
-        return session.code_repository.get_all(code_ids)
-
-    start_idx = 0
-    if dto.start_cursor:
-        start_idx = code_ids.index(dto.start_cursor) + 1
+        return await session.async_code_repository.get_all(code_ids)
 
+    start_idx = _page_start(code_ids, dto.start_cursor)
     end_idx = start_idx + dto.page_size
-    paged_code_ids = code_ids[start_idx:end_idx]
+    paged_code_ids = set(code_ids[start_idx:end_idx])
+
+    # With an in-process code cache the next page is read in the same
+    # batch, so that it is cached when the client asks for it.
+    repository = session.async_code_repository
+    if repository.caches_codes():
+        end_idx += dto.page_size
+
+    codes = await repository.get_all(code_ids[start_idx:end_idx])
+    return [c for c in codes if c.id in paged_code_ids]
+
 
-    return session.code_repository.get_all(paged_code_ids)
+def _page_start(code_ids: list[int], start_cursor: int | None) -> int:
+    """
+    Returns the offset of the page after `start_cursor`, the id of the
+    last code of the previous page. Root codes, children and descendants
+    are numbered depth-first, i.e. in ascending order, so the cursor is
+    found by bisection. A cursor that is not one of `code_ids` is rejected.
+    """
+    if not start_cursor:
+        return 0
+
+    idx = bisect_left(code_ids, start_cursor)
+    if idx == len(code_ids) or code_ids[idx] != start_cursor:
+        raise ValueError(f"Code {start_cursor} is not part of the paged codes")
+    return idx + 1
+
+
+@code.field("descendants")
+async def resolve_descendants(
+    code: d.Code, info, **kwargs
+) -> Sequence[d.Code | dict[Literal["id"], int]]:
+    session: Session = info.context["request"].scope["db_session"]
+
+    # The subtree is one id interval (@see CodeRepository.get_subtree_ids),
+    # ordered depth-first. Like for children, all ids are returned
+    # without pagination if only they are requested with a page_size of -1.
+    subtree_ids = await session.async_code_repository.get_subtree_ids([code.id])
+    descendant_ids = [id_ for id_ in subtree_ids if id_ != code.id]
+
+    if get_sub_fields(info) == ["id"] and kwargs.get("page_size") == -1:
+        return [{"id": id_} for id_ in descendant_ids]
+
+    dto = PagedCodesDto(**kwargs)
+
+    start_idx = _page_start(descendant_ids, dto.start_cursor)
+    paged_ids = descendant_ids[start_idx : start_idx + dto.page_size]
+    return await session.async_code_repository.get_all(paged_ids)
 
 
 @code.field("path")
 @codeset.field("codes")
 @changeset.field("added")
 @changeset.field("removed")
-def resolve_codes(
+async def resolve_codes(
     o: d.Code | d.Codeset | d.Changeset, info
 ) -> Sequence[d.Code | dict[Literal["id"], int]]:
     session: Session = info.context["request"].scope["db_session"]
@@ -220,11 +277,32 @@ def resolve_codes(
     if sub_fields == ["id"]:
         return [{"id": id_} for id_ in sorted(code_ids)]
 
-    codes = session.code_repository.get_all(code_ids)
+    codes = await session.async_code_repository.get_all(code_ids)
     codes.sort(key=lambda x: code_ids.index(x.id))
     return codes
 
 
+@code_search_results.field("ancestors")
+@ontology_code_search_results.field("ancestors")
+async def resolve_ancestors(
+    results: SearchResultsResponseDto | OntologyCodeSearchResultsDto, info
+) -> Sequence[d.Code | dict[Literal["id"], int]]:
+    session: Session = info.context["request"].scope["db_session"]
+
+    item_ids = {c.id for c in results.items}
+    ancestor_ids = sorted(
+        {id_ for c in results.items for id_ in c.path[:-1]} - item_ids
+    )
+
+    # If only the id is requested, return a list of ids
+    if get_sub_fields(info) == ["id"]:
+        return [{"id": id_} for id_ in ancestor_ids]
+
+    codes = await session.async_code_repository.get_all(ancestor_ids)
+    codes.sort(key=lambda x: x.id)
+    return codes
+
+
 @commit.field("author")
 def resolve_commit_author(commit: d.Commit, info) -> d.Author:
     session: Session = info.context["request"].scope["db_session"]
@@ -247,12 +325,12 @@ def resolve_commit_created_at(commit: d.Commit, info) -> str:
 
 
 @code.field("parent")
-def resolve_parent(code: d.Code, info) -> Optional[d.Code]:
+async def resolve_parent(code: d.Code, info) -> Optional[d.Code]:
     session: Session = info.context["request"].scope["db_session"]
 
     if code.parent_id is None:
         return None
-    return session.code_repository.get(code.parent_id)
+    return await session.async_code_repository.get(code.parent_id)
 
 
 @code.field("numberOfChildren")
@@ -60,9 +60,16 @@ class CodeSearchParam(BaseModel):
         return bool(self.value)
 
 
+class FuzzySearchParam(BaseModel):
+    threshold: float = Field(gt=0, le=1, default=0.3)
+    limit: int = Field(gt=0, le=1000, default=50)
+
+
 class QueryData(BaseModel):
     code: Optional[CodeSearchParam] = None
     description: Optional[str] = None
+    fuzzy: Optional[FuzzySearchParam] = None
+    root_code_id: Optional[PositiveInt] = None
 
     @model_validator(mode="after")  # type: ignore
     def has_data(cls, m: "QueryData") -> "QueryData":
@@ -70,6 +77,12 @@ class QueryData(BaseModel):
             raise ValueError("At least one of 'code' and 'description' must be given")
         return m
 
+    @model_validator(mode="after")  # type: ignore
+    def fuzzy_has_description(cls, m: "QueryData") -> "QueryData":
+        if m.fuzzy is not None and not bool(m.description):
+            raise ValueError("A fuzzy search needs a 'description'")
+        return m
+
 
 class UsersRequestDto(BaseModel):
     ids: Optional[list[UserID]] = None
@@ -80,6 +93,24 @@ class SearchCodesRequestDto(BaseModel):
     query: QueryData
 
 
+class SearchCodesPagedRequestDto(SearchCodesRequestDto):
+    page_size: int = Field(gt=0, le=1000, default=100)
+    start_cursor: PositiveInt | None = None
+
+
+class SearchCodesByOntologyRequestDto(BaseModel):
+    ontology_ids: Optional[list[str]] = None
+    query: QueryData
+    page_size: int = Field(gt=0, le=1000, default=100)
+
+
+@dataclass
+class OntologyCodeSearchResultsDto:
+    ontology_id: str
+    items: list[d.Code]
+    total: int
+
+
 class PropertiesRequestDto(BaseModel):
     clazz: Optional[d.PropertyClass] = None
 
@@ -141,6 +172,29 @@ class CodelistRequestDto(BaseModel):
     codelist_id: CodelistID
 
 
+class CodelistDescendantCountsRequestDto(BaseModel):
+    codelist_id: CodelistID
+    code_ids: list[int]
+    version: PositiveInt | None = None
+    transient: bool = False
+
+    @model_validator(mode="after")  # type: ignore
+    def version_or_transient(
+        cls, m: "CodelistDescendantCountsRequestDto"
+    ) -> "CodelistDescendantCountsRequestDto":
+        if m.version is not None and m.transient:
+            raise ValueError("Only one of 'version' and 'transient' can be given")
+        return m
+
+
+@dataclass
+class CodeDescendantCountsDto:
+    code_id: int
+    selected: bool
+    number_of_descendants: int
+    number_of_selected_descendants: int
+
+
 class UpdateMeRequestDto(BaseModel):
     tutorial_state: str
 
@@ -2,6 +2,7 @@ from .base import (
     CodelistNotExistsException,
     CollectionNotExistsException,
     ContainerNotExistsException,
+    FuzzySearchNotAvailableException,
     InteractorException,
     ItemNotExistsException,
     UserNotExistsException,
@@ -28,6 +29,7 @@ from .property import PropertyOptions, ResolveProperties
 from .query import (
     Code,
     Codelist,
+    CodelistDescendantCounts,
     Codes,
     Collection,
     Ontologies,
@@ -35,7 +37,10 @@ from .query import (
     Phenotype,
     Properties,
     SearchCodes,
+    SearchCodesByOntology,
+    SearchCodesPaged,
     SearchEntities,
+    SubtreeCodeIds,
     Users,
 )
 from .user import UpdateMe
@@ -283,6 +283,12 @@ class CodelistNotExistsException(InteractorException):
         )
 
 
+@dataclass(frozen=True)
+class FuzzySearchNotAvailableException(InteractorException):
+    def __repr__(self) -> str:
+        return "Fuzzy searches are not available, search without `fuzzy`"
+
+
 @dataclass(frozen=True)
 class PhenotypeNotExistsException(InteractorException):
     phenotype_id: "d.PhenotypeID"
@@ -333,11 +333,13 @@ class ImportCodelists(BaseCodelistInteractor):  # noqa R901 - too complex
     ) -> tuple[dict[str, importer.ValidatedCodeset], list[str]]:
         validated_cs: dict[str, importer.ValidatedCodeset | None] = {}
 
+        # resolve the codes of all ontologies at once
+        found_codes = self.session.code_repository.find_codes_by_ontology(
+            {cs.ontology_id: [c.strip() for c in cs.codes] for cs in codesets}
+        )
+
         for codeset in codesets:
-            cleaned_codes = [c.strip() for c in codeset.codes]
-            codes = self.session.code_repository.find_codes(
-                cleaned_codes, codeset.ontology_id
-            )
+            codes = found_codes[codeset.ontology_id]
 
             valid_codes = [c for c, id_ in codes.items() if id_]
             valid_code_ids = [id_ for id_ in codes.values() if id_]
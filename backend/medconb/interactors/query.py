@@ -5,7 +5,11 @@ from plyse import GrammarFactory, QueryParser
 import medconb.domain as d
 import medconb.graphql.types as gql
 
-from .base import BaseInteractor, CollectionNotExistsException
+from .base import (
+    BaseInteractor,
+    CollectionNotExistsException,
+    FuzzySearchNotAvailableException,
+)
 from .codelist import CodelistNotExistsException
 from .phenotype import PhenotypeNotExistsException
 
@@ -30,9 +34,52 @@ class Codes(BaseInteractor):
         return self.code_repository.get_all(dto.ids)
 
 
+class SubtreeCodeIds(BaseInteractor):
+    def __call__(self, dto: gql.CodesRequestDto) -> list[int]:
+        return self.code_repository.get_subtree_ids(dto.ids)
+
+
 class SearchCodes(BaseInteractor):
     def __call__(self, dto: gql.SearchCodesRequestDto) -> list[d.Code]:
-        return self.code_repository.search_codes(dto.query, dto.ontology_id)
+        try:
+            return self.code_repository.search_codes(dto.query, dto.ontology_id)
+        except d.FuzzySearchNotSupportedException:
+            raise FuzzySearchNotAvailableException()
+
+
+class SearchCodesPaged(BaseInteractor):
+    def __call__(
+        self, dto: gql.SearchCodesPagedRequestDto
+    ) -> gql.SearchResultsResponseDto:
+        try:
+            codes, num_total = self.code_repository.search_codes_paged(
+                dto.query, dto.ontology_id, dto.page_size, dto.start_cursor
+            )
+        except d.FuzzySearchNotSupportedException:
+            raise FuzzySearchNotAvailableException()
+        return gql.SearchResultsResponseDto(items=codes, total=num_total)
+
+
+class SearchCodesByOntology(BaseInteractor):
+    def __call__(
+        self, dto: gql.SearchCodesByOntologyRequestDto
+    ) -> list[gql.OntologyCodeSearchResultsDto]:
+        ontology_ids = dto.ontology_ids
+        if ontology_ids is None:
+            ontology_ids = [o.id for o in self.ontology_repository.get_all()]
+
+        try:
+            results = self.code_repository.search_codes_by_ontology(
+                dto.query, ontology_ids, dto.page_size
+            )
+        except d.FuzzySearchNotSupportedException:
+            raise FuzzySearchNotAvailableException()
+        return [
+            gql.OntologyCodeSearchResultsDto(
+                ontology_id=ontology_id, items=codes, total=num_total
+            )
+            for ontology_id, (codes, num_total) in results.items()
+        ]
 
 
 class SearchEntities(BaseInteractor):
@@ -114,6 +161,40 @@ class Codelist(BaseInteractor):
         raise CodelistNotExistsException(dto.codelist_id)
 
 
+class CodelistDescendantCounts(BaseInteractor):
+    def __call__(
+        self, dto: gql.CodelistDescendantCountsRequestDto
+    ) -> list[gql.CodeDescendantCountsDto]:
+        codelist = self.codelist_repository.get(dto.codelist_id)
+
+        if not codelist or not self.is_readable_by_current_user(codelist):
+            raise CodelistNotExistsException(dto.codelist_id)
+
+        codesets = _codesets_of(codelist, dto)
+        codes_by_id = {c.id: c for c in self.code_repository.get_all(dto.code_ids)}
+        codes = [codes_by_id[id_] for id_ in dto.code_ids if id_ in codes_by_id]
+        counts = d.count_selected_descendants(codesets, codes)
+
+        return [
+            gql.CodeDescendantCountsDto(
+                code_id=code.id,
+                selected=selected,
+                number_of_descendants=code.last_descendant_id - code.id,
+                number_of_selected_descendants=num_selected,
+            )
+            for code, (selected, num_selected) in zip(codes, counts)
+        ]
+
+
+def _codesets_of(
+    codelist: d.Codelist, dto: gql.CodelistDescendantCountsRequestDto
+) -> d.Codesets:
+    """Returns the codesets of the requested version of the codelist."""
+    if dto.transient:
+        return codelist.transient_codesets or codelist.codesets
+    return codelist.codesets_of_version(dto.version or codelist.version)
+
+
 class Users(BaseInteractor):
     def __call__(self, dto: gql.UsersRequestDto) -> list[d.User]:
         return [
@@ -0,0 +1,145 @@
+"""
+In-process metrics (counters, histograms and gauges) of a worker. They
+are served in the Prometheus text format at `/metrics`.
+
+Every worker process has its own registry, so a scrape only reports the
+worker that answered it.
+"""
+
+import math
+import threading
+from bisect import bisect_left
+from typing import Callable
+
+Labels = tuple[tuple[str, str], ...]
+
+# upper bounds in seconds
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _labels(labels: dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_value(value: float) -> str:
+    """
+    Formats a sample value without losing precision: integers as such
+    and floats by their shortest exact representation.
+    """
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _format(name: str, labels: Labels, value: float) -> str:
+    if labels:
+        label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+        name = f"{name}{{{label_str}}}"
+    return f"{name} {_format_value(value)}"
+
+
+class _Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters: dict[str, dict[Labels, float]] = {}
+        self._histograms: dict[str, dict[Labels, _Histogram]] = {}
+        self._callbacks: dict[str, tuple[str, dict[Labels, Callable[[], float]]]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """Increases the counter `name` by `value`."""
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Records `value` (e.g. a duration in seconds) in a histogram."""
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = _Histogram(self.buckets)
+            series[key].observe(value)
+
+    def register(
+        self, name: str, func: Callable[[], float], kind: str = "gauge", **labels: str
+    ) -> None:
+        """
+        Registers a value that is read via `func` when the metrics are
+        rendered, e.g. the size of a cache. A later registration with the
+        same name and labels replaces the former.
+        """
+        with self._lock:
+            _, series = self._callbacks.setdefault(name, (kind, {}))
+            series[_labels(labels)] = func
+
+    def value(self, name: str, **labels: str) -> float:
+        """Returns the current value of a counter (0 if never increased)."""
+        with self._lock:
+            return self._counters.get(name, {}).get(_labels(labels), 0)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        with self._lock:
+            for name, counters in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(counters.items()):
+                    lines.append(_format(name, labels, value))
+
+            for name, histograms in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, hist in sorted(histograms.items()):
+                    cumulative = 0
+                    bounds = [_format_value(float(b)) for b in hist.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, hist.counts):
+                        cumulative += count
+                        lines.append(
+                            _format(
+                                f"{name}_bucket", labels + (("le", bound),), cumulative
+                            )
+                        )
+                    lines.append(_format(f"{name}_sum", labels, hist.sum))
+                    lines.append(_format(f"{name}_count", labels, cumulative))
+
+            callbacks = sorted(self._callbacks.items())
+
+        for name, (kind, funcs) in callbacks:
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, func in sorted(funcs.items(), key=lambda x: x[0]):
+                lines.append(_format(name, labels, func()))
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Registry()
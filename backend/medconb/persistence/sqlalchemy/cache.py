@@ -1,21 +1,360 @@
-import os
+import asyncio
+import hashlib
+import logging
+import threading
 import time
-from typing import TYPE_CHECKING, Optional, cast
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import suppress
+from itertools import chain
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Generic,
+    Hashable,
+    Iterator,
+    Optional,
+    Sequence,
+    TypeVar,
+    cast,
+)
 
+from redis.exceptions import LockError, RedisError
 from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError, ProgrammingError
+from sqlalchemy.schema import CreateTable
 
 import medconb.domain as d
+from medconb.domain.ontology import CODE_FORMAT_VERSION
+from medconb.metrics import metrics
 
 from . import ontology_orm as t_o
 from .repositories import CodeRepository
+from .search_index import CodeSearchIndex
 
 if TYPE_CHECKING:  # pragma: no cover
     from redis import Redis as Client
+    from redis.asyncio import Redis as AsyncClient
+    from redis.lock import Lock
     from sqlalchemy.orm import Session, sessionmaker
 
+logger = logging.getLogger(__name__)
+
+# key of the version stamp of the ontology data in `ontology_meta`
+DATA_VERSION_KEY = "data_version"
+# key of the advisory lock held while the ontology data is stamped
+STAMP_LOCK_KEY = 0x6D6564636F6E62
+
+
+def _code_key(version: str | None, code_id: int) -> str:
+    return f"v|{version}|c|{code_id}"
+
+
+def _lookup_key(version: str | None, ontology_id: str, code: str) -> str:
+    return f"v|{version}|l|{ontology_id}|{code.lower()}"
+
+
+def _group_lookups(
+    codes: dict[str, list[str]], keys: list[tuple[str, str]], data: list[Any]
+) -> dict[str, dict[str, int | None]]:
+    res: dict[str, dict[str, int | None]] = {o: {} for o in codes}
+    for (o, code), id_ in zip(keys, data):
+        res[o][code] = int(id_) if id_ else None
+    return res
+
+
+def _first_found(
+    codes: list[str],
+    ontology_ids: list[str],
+    found: dict[str, dict[str, int | None]],
+) -> dict[str, int | None]:
+    res: dict[str, int | None] = {code: None for code in codes}
+    for o in ontology_ids:
+        for code, id_ in found[o].items():
+            res[code] = res[code] or id_
+    return res
+
+
+def _subtree_ids(roots: list[d.Code]) -> list[int]:
+    """
+    Returns the ids of the subtrees of `roots` (including themselves)
+    ordered by id. The codes are numbered depth-first, so a subtree is
+    the id interval from its root to the root's last descendant and no
+    codes need to be read apart from the roots.
+    """
+    ids: list[int] = []
+    for root in sorted(roots, key=lambda c: c.id):
+        start = max(root.id, ids[-1] + 1) if ids else root.id
+        ids.extend(range(start, root.last_descendant_id + 1))
+    return ids
+
+
+def _log_mget(num_keys: int, num_batches: int, elapsed: float) -> None:
+    logger.debug(
+        "Fetched %d keys in %d batches (%.3fms total, %.3fms per batch)",
+        num_keys,
+        num_batches,
+        elapsed * 1000,
+        elapsed * 1000 / num_batches,
+    )
+
+
+def _record_lookup(
+    op: str, num_keys: int, lru_hits: int, data: list[Any], start: float
+) -> None:
+    """
+    Records a lookup of `num_keys` keys started at `start`, of which
+    `lru_hits` were answered in-process and the rest were fetched from
+    redis as `data`.
+    """
+    found = [item for item in data if item]
+    metrics.inc("medconb_code_cache_keys_total", num_keys, op=op)
+    metrics.inc("medconb_code_cache_hits_total", lru_hits, op=op, tier="lru")
+    metrics.inc("medconb_code_cache_hits_total", len(found), op=op, tier="redis")
+    metrics.inc("medconb_code_cache_misses_total", len(data) - len(found), op=op)
+    metrics.inc(
+        "medconb_code_cache_bytes_total", sum(len(item) for item in found), op=op
+    )
+    metrics.observe("medconb_code_cache_seconds", time.perf_counter() - start, op=op)
+
+
+def _register_cache_metrics(name: str, cache: "LRUCache") -> None:
+    metrics.register(f"medconb_{name}_size", lambda: len(cache))
+    metrics.register(f"medconb_{name}_hits_total", lambda: cache.hits, "counter")
+    metrics.register(f"medconb_{name}_misses_total", lambda: cache.misses, "counter")
+
+
+def ontology_content_hash(session: "Session") -> str:
+    """
+    Returns the MD5 hash of all codes and ontologies. It is stamped as
+    data version when the ontologies are imported.
+    """
+    digest = hashlib.md5()
+    for table in (t_o.code, t_o.ontology):
+        stmt = (
+            select(table)
+            .order_by(table.c.id)
+            .execution_options(yield_per=CachedCodeRepository.WARMUP_BATCH_SIZE)
+        )
+        for row in session.execute(stmt):
+            digest.update(repr(tuple(row)).encode())
+    return digest.hexdigest()
+
+
+def ontology_data_version(session: "Session", *salt: Any) -> str:
+    """
+    Returns the version of the ontology data (combined with `salt`, e.g.
+    the format of the cached codes), so that caches of the data get
+    rebuilt whenever different data is imported.
+
+    The version is the content hash that helper/import_ontologies.py
+    stamps into `ontology_meta`. Data without a stamp is stamped once
+    (@see stamp_ontology_data).
+    """
+    try:
+        stamp = session.scalar(_select_stamp())
+    except ProgrammingError:  # the table does not exist
+        session.rollback()
+        stamp = None
+
+    if stamp is None:
+        stamp = stamp_ontology_data(session)
+
+    return hashlib.sha1(repr((salt, stamp)).encode()).hexdigest()[:16]
+
+
+def stamp_ontology_data(session: "Session") -> str:
+    """
+    Stamps the content hash of the ontology data into `ontology_meta`,
+    unless it is stamped already, and returns the stamp.
+
+    Processes starting at the same time are serialized by an advisory
+    lock, so only the first one reads all codes and the others use its
+    stamp. If the stamp can't be written (e.g. the database user may
+    only read), the hash is returned anyway and computed again on the
+    next start.
+    """
+    bind_arguments = {"mapper": d.Code}
+    stamp = None
+    try:
+        # before creating the table, which is not safe to do concurrently
+        session.execute(
+            select(func.pg_advisory_xact_lock(STAMP_LOCK_KEY)),
+            bind_arguments=bind_arguments,
+        )
+        session.execute(
+            CreateTable(t_o.ontology_meta, if_not_exists=True),
+            bind_arguments=bind_arguments,
+        )
+        stamp = session.scalar(_select_stamp())
+        if stamp is None:
+            logger.warning("The ontology data has no version stamp, stamping it")
+            stamp = ontology_content_hash(session)
+            session.execute(
+                pg_insert(t_o.ontology_meta)
+                .values(key=DATA_VERSION_KEY, value=stamp)
+                .on_conflict_do_nothing(),
+                bind_arguments=bind_arguments,
+            )
+        session.commit()
+    except DBAPIError:
+        session.rollback()
+        logger.warning(
+            "Could not stamp the ontology data, run helper/upgrade_ontology_db.py",
+            exc_info=True,
+        )
+
+    return stamp if stamp is not None else ontology_content_hash(session)
+
+
+def _select_stamp():
+    return select(t_o.ontology_meta.c.value).where(
+        t_o.ontology_meta.c.key == DATA_VERSION_KEY
+    )
+
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """
+    A size bounded, thread safe least-recently-used mapping that counts
+    its hits and misses. If `ttl` is given, entries expire that many
+    seconds after they were put.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, V] = OrderedDict()
+        self._expires_at: dict[K, float] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            return self._get(key)
+
+    def get_many(self, keys: list[K]) -> dict[K, V]:
+        """Returns the cached values of `keys`, omitting missing ones."""
+        res: dict[K, V] = {}
+        with self._lock:
+            for key in keys:
+                value = self._get(key)
+                if value is not None:
+                    res[key] = value
+        return res
+
+    def put(self, key: K, value: V) -> None:
+        with self._lock:
+            self._put(key, value)
+
+    def put_many(self, items: dict[K, V]) -> None:
+        with self._lock:
+            for key, value in items.items():
+                self._put(key, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._expires_at.clear()
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _get(self, key: K) -> Optional[V]:
+        value = self._data.get(key)
+        if value is not None and self.ttl is not None:
+            if self._expires_at[key] <= time.monotonic():
+                self._pop(key)
+                value = None
+
+        if value is None:
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def _put(self, key: K, value: V) -> None:
+        if self.maxsize <= 0:
+            return
+
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if self.ttl is not None:
+            self._expires_at[key] = time.monotonic() + self.ttl
+
+        while len(self._data) > self.maxsize:
+            self._pop(next(iter(self._data)))
+
+    def _pop(self, key: K) -> None:
+        del self._data[key]
+        self._expires_at.pop(key, None)
+
+
+def _search_key(
+    query_data: d.QueryData, ontology_id: str, version: str | None = None
+) -> tuple:
+    """
+    Normalizes a code search to a cache key. ILIKE patterns are case
+    insensitive, so they are lower cased; POSIX patterns are kept as is.
+    """
+    description = query_data.description.lower() if query_data.description else None
+
+    code: tuple | None = None
+    if query_data.code is not None:
+        value = query_data.code.value
+        if query_data.code.type == d.CodeSearchParamType.ILIKE:
+            value = value.lower()
+        code = (int(query_data.code.type), value)
+
+    fuzzy: tuple | None = None
+    if query_data.fuzzy is not None:
+        fuzzy = (query_data.fuzzy.threshold, query_data.fuzzy.limit)
+
+    return (version, ontology_id, description, code, fuzzy, query_data.root_code_id)
+
 
 class CachedCodeRepository:  # pragma: no cover
-    def __init__(self, sm: "sessionmaker", client: "Client"):
+    MGET_BATCH_SIZE = 10000
+    WARMUP_BATCH_SIZE = 10000
+    WARMUP_MAX_PENDING_BATCHES = 2
+    # seconds until the warmup lock expires if it is not renewed
+    WARMUP_LEASE_TIMEOUT = 60
+    WARMUP_POLL_INTERVAL = 3
+    # upper bound of the backoff between failed warmups in seconds
+    WARMUP_RETRY_MAX_DELAY = 60
+    # how long a process trusts the active cache version before it
+    # checks redis again
+    VERSION_CHECK_INTERVAL = 5
+    # number of cache versions kept in redis (the active and previous)
+    KEEP_VERSIONS = 2
+    # larger search results are not cached
+    SEARCH_CACHE_MAX_RESULTS = 5000
+
+    def __init__(
+        self,
+        sm: "sessionmaker",
+        client: "Client",
+        lru_size: int = 50000,
+        search_cache_size: int = 1000,
+        search_cache_ttl: float = 600,
+        search_index: bool = False,
+    ):
         """
         CachedCodeRepository is different to the other repositories as
         it does not get created per request and session but just once.
@@ -27,9 +366,35 @@ class CachedCodeRepository:  # pragma: no cover
         satisfies the way repositories are created (called/initialized
         with the current session), the __call__ method of this class
         serves as the entry point for request scoped use.
+
+        Deserialized codes are additionally kept in a per-process LRU
+        cache of size `lru_size`. It is cleared whenever the active
+        cache version in redis changes (i.e. after the cache was
+        rebuilt).
+
+        Results of `search_codes` are kept in a per-process cache of
+        `search_cache_size` searches for `search_cache_ttl` seconds.
+
+        With `search_index` each process additionally builds an
+        in-memory CodeSearchIndex of the active cache version after the
+        warmup (and again whenever the version changes) to answer
+        searches without SQL.
         """
         self._client = client
         self._sm = sm
+        self._lru: LRUCache[int, d.Code] = LRUCache(lru_size)
+        self._search_cache: LRUCache[tuple, list[d.Code]] = LRUCache(
+            search_cache_size, ttl=search_cache_ttl
+        )
+        _register_cache_metrics("code_lru", self._lru)
+        _register_cache_metrics("search_cache", self._search_cache)
+        self._search_index_enabled = search_index
+        self._search_index: tuple[str | None, CodeSearchIndex] | None = None
+        self._search_index_lock = threading.Lock()
+        self._version: str | None = None
+        self._version_checked_at = 0.0
+        self._is_warm = False
+        self._warmup_task: asyncio.Task | None = None
         with sm() as session:
             session = cast(Session, session) if TYPE_CHECKING else session
             self._ontologies = session.scalars(select(t_o.ontology.c.id)).all()
@@ -44,76 +409,633 @@ class CachedCodeRepository:  # pragma: no cover
         return self
 
     async def warmup(self) -> None:
+        """
+        Starts warming up the cache in the background, so the service
+        can already answer liveness probes. `is_ready` reports when the
+        cache can be used.
+        """
+        self._warmup_task = asyncio.create_task(self._warmup())
+
+    async def _warmup(self) -> None:
+        """
+        Makes sure the cache holds the current version of the ontology
+        data (see `_build_or_wait`). Failures (e.g. while redis or the
+        database is unavailable) are retried with exponential backoff,
+        so the process becomes ready once they are resolved.
+        """
+        delay = self.WARMUP_POLL_INTERVAL
         while True:
             try:
-                with open("/tmp/medconb.lock.warmup", "x"):
-                    # # to not constantly warming up the cache in development
-                    # self._client.set("is_hot", 1, ex=1)
-                    if self._client.get("is_hot"):
-                        print(f"[{os.getpid()}] Cache already warmed up")
-                    else:
-                        print(f"[{os.getpid()}] Warming up cache")
-                        with self._sm() as session:
-                            self._warmup_cache(session)
-                        self._client.set("is_hot", 1, ex=5 * 60)
-                os.remove("/tmp/medconb.lock.warmup")
+                version = await self._build_or_wait()
                 break
-            except FileExistsError:
-                time.sleep(3)
+            except Exception:
+                logger.exception("Cache warmup failed, retrying in %ds", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.WARMUP_RETRY_MAX_DELAY)
 
-    def _warmup_cache(self, session: "Session"):
-        self._client.flushdb(True)
+        self._is_warm = True
 
-        max_id = session.scalars(select(func.max(t_o.code.c.id))).one()
-        limit = 10000
-        counter = 0
+        if self._search_index_enabled:
+            await asyncio.to_thread(self._build_search_index, version)
+
+    async def _build_or_wait(self) -> str:
+        """
+        Builds the current version of the cache or waits until another
+        process did and returns it.
+
+        All keys are namespaced by the data version (see
+        `_data_version`). A new version is built next to the old one,
+        which keeps serving requests, and is then activated atomically
+        by switching the pointer key `ontology_version`.
+
+        Across all processes and pods that share the redis instance only
+        the one holding the warmup lease lock builds the cache. All
+        others wait without blocking their event loop. If the lease
+        holder dies, its lease expires and another process takes over
+        (resuming from the checkpoint).
+        """
+        lock = self._client.lock(
+            "lock|warmup", timeout=self.WARMUP_LEASE_TIMEOUT, thread_local=False
+        )
+        version = await asyncio.to_thread(self._data_version)
+
+        while await asyncio.to_thread(self._active_version) != version:
+            if await asyncio.to_thread(lock.acquire, blocking=False):
+                try:
+                    # the version might have been built between the check
+                    # and acquiring the lock
+                    if await asyncio.to_thread(self._active_version) != version:
+                        logger.info("Building cache version %s", version)
+                        await asyncio.to_thread(self._build_version, version, lock)
+                finally:
+                    with suppress(LockError):
+                        await asyncio.to_thread(lock.release)
+                return version
+
+            logger.info("Waiting for the cache warmup of another process")
+            await asyncio.sleep(self.WARMUP_POLL_INTERVAL)
 
-        for offset in range(0, max_id, limit):
-            codes: list[d.Code] = list(
-                session.scalars(
-                    select(d.Code).where(
-                        (t_o.code.c.id > offset) & (t_o.code.c.id <= offset + limit)
+        logger.info("Cache version %s is already built", version)
+        return version
+
+    def _build_search_index(self, version: str | None) -> None:
+        """
+        Builds the search index from the ontology database, i.e. the
+        source of cache `version`. It is only used while that version is
+        active. Builds run one after another; a build is skipped if the
+        index of `version` exists or another version became active
+        meanwhile.
+        """
+        with self._search_index_lock:
+            if self._search_index is not None and self._search_index[0] == version:
+                return
+            if self._version is not None and self._version != version:
+                return
+
+            try:
+                with self._sm() as session:
+                    stmt = (
+                        select(
+                            t_o.code.c.id,
+                            t_o.code.c.ontology_id,
+                            t_o.code.c.code,
+                            t_o.code.c.description,
+                            t_o.code.c.last_descendant_id,
+                        )
+                        .order_by(t_o.code.c.id)
+                        .execution_options(yield_per=self.WARMUP_BATCH_SIZE)
                     )
-                ).all()
-            )
+                    index = CodeSearchIndex.build(
+                        (
+                            row.id,
+                            row.ontology_id,
+                            row.code,
+                            row.description,
+                            row.last_descendant_id,
+                        )
+                        for row in session.execute(stmt)
+                    )
+                self._search_index = (version, index)
+            except Exception:
+                logger.exception("Building the code search index failed")
+
+    def _data_version(self) -> str:
+        """@see ontology_data_version"""
+        with self._sm() as session:
+            return ontology_data_version(session, CODE_FORMAT_VERSION)
+
+    def _active_version(self) -> str | None:
+        version = self._client.get("ontology_version")
+        return version.decode() if version else None
+
+    def _build_version(self, version: str, lease: "Lock") -> None:
+        with self._sm() as session:
+            self._warmup_cache(session, version, lease)
 
-            if len(codes) == 0:
-                continue
+        self._activate_version(version)
 
-            self._client.mset({f"c|{c.id}": c.serialize() for c in codes})
-            self._client.mset(
-                {f"l|{c.ontology_id}|{c.code.lower()}": c.id for c in codes}
+    def _activate_version(self, version: str) -> None:
+        """
+        Atomically points all readers to `version` and deletes the
+        versions that are not needed anymore. The previous version is
+        kept, as other processes only pick up the switch after
+        `VERSION_CHECK_INTERVAL`.
+        """
+        pipe = self._client.pipeline(transaction=True)
+        pipe.set("ontology_version", version)
+        pipe.lrem("ontology_versions", 0, version)
+        pipe.lpush("ontology_versions", version)
+        pipe.execute()
+
+        stale_versions = self._client.lrange(
+            "ontology_versions", self.KEEP_VERSIONS, -1
+        )
+        for stale_version in stale_versions:
+            self._delete_keys(f"v|{stale_version.decode()}|*")
+        self._client.ltrim("ontology_versions", 0, self.KEEP_VERSIONS - 1)
+
+        # keys of the unversioned keyspace used by older releases
+        self._delete_keys("c|*")
+        self._delete_keys("l|*")
+        self._client.delete("is_hot", "warmup|checkpoint")
+
+        logger.info(
+            "Activated cache version %s, removed %d stale versions",
+            version,
+            len(stale_versions),
+        )
+
+    def is_ready(self) -> bool:
+        """
+        The cache is ready once this process finished (or waited for)
+        the warmup and a cache version is active in redis.
+        """
+        if not self._is_warm:
+            return False
+
+        try:
+            return bool(self._client.exists("ontology_version"))
+        except RedisError:
+            return False
+
+    def _warmup_cache(
+        self, session: "Session", version: str, lease: Optional["Lock"] = None
+    ):
+        """
+        Streams all codes from the ontology database into the keyspace
+        of `version`.
+
+        Rows are read through a server side cursor in batches of
+        `WARMUP_BATCH_SIZE` while a writer thread pushes the previous
+        batches through a redis pipeline. After each batch the last
+        written code id is stored as checkpoint, so an interrupted
+        warmup continues where it stopped instead of starting over.
+
+        If a `lease` is given, it is renewed after every batch.
+        """
+        checkpoint_key = f"v|{version}|checkpoint"
+        checkpoint = self._client.get(checkpoint_key)
+
+        last_id = 0
+        if checkpoint is not None:
+            last_id = int(checkpoint)
+            logger.info("Resuming cache warmup after code id %d", last_id)
+
+        # plain rows in the field order of Code, they are serialized
+        # without creating (ORM mapped) Code objects
+        stmt = (
+            select(
+                t_o.code.c.id,
+                t_o.code.c.code,
+                t_o.code.c.ontology_id,
+                t_o.code.c.description,
+                t_o.code.c.path,
+                t_o.code.c.children_ids,
+                t_o.code.c.last_descendant_id,
             )
+            .where(t_o.code.c.id > last_id)
+            .order_by(t_o.code.c.id)
+            .execution_options(yield_per=self.WARMUP_BATCH_SIZE)
+        )
 
-            counter += len(codes)
+        counter = 0
+        start = time.perf_counter()
 
-        print("Cached", counter, "codes")
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending: deque[Future] = deque()
+
+            for rows in session.execute(stmt).partitions():
+                pending.append(writer.submit(self._write_warmup_batch, version, rows))
+                counter += len(rows)
+
+                # bound the number of batches held in memory and surface
+                # errors of the writer early
+                while len(pending) > self.WARMUP_MAX_PENDING_BATCHES:
+                    pending.popleft().result()
+
+                if lease:
+                    lease.reacquire()
+
+                logger.debug(
+                    "Warmup read %d codes (%.0f rows/s)",
+                    counter,
+                    counter / (time.perf_counter() - start),
+                )
+
+            for future in pending:
+                future.result()
+
+        self._client.delete(checkpoint_key)
+
+        elapsed = time.perf_counter() - start
+        logger.info(
+            "Cached %d codes in %.1fs (%.0f rows/s)",
+            counter,
+            elapsed,
+            counter / elapsed if elapsed else 0,
+        )
+
+    def _write_warmup_batch(self, version: str, rows: Sequence[Any]) -> None:
+        """Writes the code rows (fields in the order of Code) to `version`."""
+        pipe = self._client.pipeline(transaction=False)
+        pipe.mset({_code_key(version, r.id): d.Code.serialize_fields(*r) for r in rows})
+        pipe.mset({_lookup_key(version, r.ontology_id, r.code): r.id for r in rows})
+        pipe.set(f"v|{version}|checkpoint", rows[-1].id)
+        pipe.execute()
+
+    def _delete_keys(self, pattern: str) -> None:
+        keys = []
+        for key in self._client.scan_iter(match=pattern, count=10000):
+            keys.append(key)
+            if len(keys) >= 10000:
+                self._client.unlink(*keys)
+                keys = []
+        if keys:
+            self._client.unlink(*keys)
 
     def get(self, code_id: int) -> Optional[d.Code]:
-        data = self._client.get(f"c|{code_id}")
-        return d.Code.deserialize(data) if data else None
+        start = time.perf_counter()
+        version = self._sync_version()
+
+        code = self._lru.get(code_id)
+        if code is not None:
+            _record_lookup("get", 1, 1, [], start)
+            return code
+
+        data = self._client.get(_code_key(version, code_id))
+        _record_lookup("get", 1, 0, [data], start)
+        if not data:
+            return None
+
+        code = d.Code.deserialize(data)
+        self._lru.put(code_id, code)
+        return code
 
     def get_all(self, code_ids: list[int]) -> list[d.Code]:
-        data = self._client.mget([f"c|{id_}" for id_ in code_ids])
-        return list(map(d.Code.deserialize, filter(None, data)))
+        start = time.perf_counter()
+        version = self._sync_version()
+
+        codes = self._lru.get_many(code_ids)
+        missing_ids = [id_ for id_ in code_ids if id_ not in codes]
+
+        data = self._mget([_code_key(version, id_) for id_ in missing_ids])
+        _record_lookup("get_all", len(code_ids), len(codes), data, start)
+
+        return self._merge_codes(code_ids, codes, data)
+
+    def get_subtree_ids(self, code_ids: list[int]) -> list[int]:
+        return _subtree_ids(self.get_all(code_ids))
+
+    def _merge_codes(
+        self, code_ids: list[int], cached: dict[int, d.Code], data: list[Any]
+    ) -> list[d.Code]:
+        """
+        Combines the codes found in the in-process cache with the ones
+        fetched from redis (which are then cached) in the order of
+        `code_ids`.
+        """
+        fetched = {c.id: c for c in d.Code.deserialize_many(data)}
+        self._lru.put_many(fetched)
+        codes = cached | fetched
+
+        return [codes[id_] for id_ in code_ids if id_ in codes]
+
+    def lru_stats(self) -> dict[str, float]:
+        return self._lru.stats()
+
+    def search_cache_stats(self) -> dict[str, float]:
+        return self._search_cache.stats()
+
+    def _sync_version(self) -> str | None:
+        """
+        Returns the active cache version. It is re-read from redis at
+        most every `VERSION_CHECK_INTERVAL` seconds. If it changed, the
+        in-process code cache is cleared.
+        """
+        if self._version_is_stale():
+            self._set_version(self._client.get("ontology_version"))
+
+        return self._version
+
+    def _version_is_stale(self) -> bool:
+        now = time.monotonic()
+        if now - self._version_checked_at < self.VERSION_CHECK_INTERVAL:
+            return False
+
+        self._version_checked_at = now
+        return True
+
+    def _set_version(self, raw_version: bytes | None) -> str | None:
+        version = raw_version.decode() if raw_version else None
+
+        if version != self._version:
+            if self._version is not None:
+                logger.info("Cache version changed, clearing code cache")
+            self._lru.clear()
+            self._search_cache.clear()
+
+            rebuild_index = self._search_index_enabled and self._version is not None
+            self._version = version
+
+            if rebuild_index:
+                threading.Thread(
+                    target=self._build_search_index, args=(version,), daemon=True
+                ).start()
+
+        return self._version
 
     def find_codes(
         self, codes: list[str], ontology_id: str | None = None
     ) -> dict[str, int | None]:
-        res = {}
-        for o in self._ontologies:
-            if ontology_id and o != ontology_id:
-                continue
-            for code in codes:
-                data = self._client.get(f"l|{o}|{code.lower()}")
-                res[code] = int(data) if data else None
+        ontology_ids = [ontology_id] if ontology_id else list(self._ontologies)
+        found = self.find_codes_by_ontology({o: codes for o in ontology_ids})
+        return _first_found(codes, ontology_ids, found)
 
-        return res
+    def find_codes_by_ontology(
+        self, codes: dict[str, list[str]]
+    ) -> dict[str, dict[str, int | None]]:
+        start = time.perf_counter()
+        version = self._sync_version()
+        keys = [(o, code) for o, codes_ in codes.items() for code in codes_]
+        data = self._mget([_lookup_key(version, o, code) for o, code in keys])
+        _record_lookup("find_codes", len(keys), 0, data, start)
+        return _group_lookups(codes, keys, data)
+
+    def _mget(self, keys: list[str]) -> list[Any]:
+        """
+        Fetches all `keys` within one round trip. The keys are split
+        into batches of `MGET_BATCH_SIZE` to keep single commands from
+        blocking redis for too long, but all batches are sent through
+        one pipeline.
+        """
+        if not keys:
+            return []
+
+        pipe = self._client.pipeline(transaction=False)
+        for i in range(0, len(keys), self.MGET_BATCH_SIZE):
+            pipe.mget(keys[i : i + self.MGET_BATCH_SIZE])
+
+        start = time.perf_counter()
+        batches = pipe.execute()
+        _log_mget(len(keys), len(batches), time.perf_counter() - start)
+
+        return list(chain.from_iterable(batches))
 
     def search_codes(self, query_data: d.QueryData, ontology_id: str) -> list[d.Code]:
+        """
+        Searches via the search index if it is built for the active
+        cache version, otherwise in SQL. Results of up to
+        `SEARCH_CACHE_MAX_RESULTS` codes are cached in-process per
+        active cache version.
+        """
+        version = self._sync_version()
+        key = _search_key(query_data, ontology_id, version)
+        codes = self._search_cache.get(key)
+        if codes is None:
+            codes = self._search(query_data, ontology_id, version)
+            if len(codes) <= self.SEARCH_CACHE_MAX_RESULTS:
+                self._search_cache.put(key, codes)
+
+        return list(codes)
+
+    def _search(
+        self, query_data: d.QueryData, ontology_id: str, version: str | None
+    ) -> list[d.Code]:
+        code_ids = self._index_search(query_data, ontology_id, version)
+        if code_ids is not None:
+            return self.get_all(code_ids)
+
         assert self.session is not None
         return CodeRepository(self.session).search_codes(query_data, ontology_id)
 
+    def _index_search(
+        self, query_data: d.QueryData, ontology_id: str, version: str | None
+    ) -> list[int] | None:
+        """
+        Returns the ids of the matching codes from the search index, or
+        None if it isn't built for `version` or can't answer the query.
+        """
+        if self._search_index is None:
+            return None
+
+        index_version, index = self._search_index
+        if index_version != version:
+            return None
+
+        return index.search(query_data, ontology_id)
+
+    def search_codes_by_ontology(
+        self, query_data: d.QueryData, ontology_ids: list[str], page_size: int = 100
+    ) -> dict[str, tuple[list[d.Code], int]]:
+        """
+        Answers what it can from the search index and searches the other
+        ontologies concurrently in SQL.
+        """
+        version = self._sync_version()
+        res: dict[str, tuple[list[d.Code], int]] = {}
+        for ontology_id in ontology_ids:
+            page = self._index_search_page(query_data, ontology_id, page_size, version)
+            if page is not None:
+                res[ontology_id] = page
+
+        missing = [o for o in ontology_ids if o not in res]
+        if missing:
+            assert self.session is not None
+            res |= CodeRepository(self.session).search_codes_by_ontology(
+                query_data, missing, page_size
+            )
+
+        return {o: res[o] for o in ontology_ids}
+
+    def iter_all(self, code_ids: list[int]) -> Iterator[d.Code]:
+        for start in range(0, len(code_ids), CodeRepository.STREAM_BATCH_SIZE):
+            batch = code_ids[start : start + CodeRepository.STREAM_BATCH_SIZE]
+            yield from self.get_all(batch)
+
+    def iter_search_codes(
+        self, query_data: d.QueryData, ontology_id: str
+    ) -> Iterator[d.Code]:
+        """
+        Streams from the search index (reading the codes in batches from
+        the cache) if it is built for the active cache version, otherwise
+        from SQL. The results are not cached.
+        """
+        version = self._sync_version()
+        code_ids = self._index_search(query_data, ontology_id, version)
+        if code_ids is not None:
+            return self.iter_all(code_ids)
+
+        assert self.session is not None
+        return CodeRepository(self.session).iter_search_codes(query_data, ontology_id)
+
+    def search_codes_paged(
+        self,
+        query_data: d.QueryData,
+        ontology_id: str,
+        page_size: int = 100,
+        start_cursor: int | None = None,
+    ) -> tuple[list[d.Code], int]:
+        """
+        Pages via the search index if it is built for the active cache
+        version (with an exact total), otherwise in SQL. Pages are not
+        cached, as they are bounded anyway.
+        """
+        version = self._sync_version()
+        page = self._index_search_page(
+            query_data, ontology_id, page_size, version, start_cursor
+        )
+        if page is not None:
+            return page
+
+        assert self.session is not None
+        return CodeRepository(self.session).search_codes_paged(
+            query_data, ontology_id, page_size, start_cursor
+        )
+
+    def _index_search_page(
+        self,
+        query_data: d.QueryData,
+        ontology_id: str,
+        page_size: int,
+        version: str | None,
+        start_cursor: int | None = None,
+    ) -> tuple[list[d.Code], int] | None:
+        """@see _index_search"""
+        if self._search_index is None:
+            return None
+
+        index_version, index = self._search_index
+        if index_version != version:
+            return None
+
+        page = index.search_page(query_data, ontology_id, page_size, start_cursor)
+        if page is None:
+            return None
+
+        return self.get_all(page[0]), page[1]
+
+
+class AsyncCachedCodeRepository:  # pragma: no cover
+    def __init__(self, repository: CachedCodeRepository, client: "AsyncClient"):
+        """
+        AsyncCachedCodeRepository is the asyncio variant of the lookups
+        of CachedCodeRepository. It reads the same keyspace and shares
+        the in-process code cache and active version of `repository`,
+        but awaits redis instead of blocking the event loop, so that
+        concurrent requests overlap their cache I/O.
+
+        Searching is done in SQL and thus not part of this repository.
+        """
+        self._repository = repository
+        self._client = client
+
+    def __call__(self, session: "Session") -> "AsyncCachedCodeRepository":
+        """
+        Nothing is request scoped, but it keeps the interface of the
+        other repositories.
+        """
+        return self
+
+    async def get(self, code_id: int) -> Optional[d.Code]:
+        start = time.perf_counter()
+        version = await self._sync_version()
+
+        code = self._repository._lru.get(code_id)
+        if code is not None:
+            _record_lookup("get", 1, 1, [], start)
+            return code
+
+        data = await self._client.get(_code_key(version, code_id))
+        _record_lookup("get", 1, 0, [data], start)
+        if not data:
+            return None
+
+        code = d.Code.deserialize(data)
+        self._repository._lru.put(code_id, code)
+        return code
+
+    async def get_all(self, code_ids: list[int]) -> list[d.Code]:
+        start = time.perf_counter()
+        version = await self._sync_version()
+
+        codes = self._repository._lru.get_many(code_ids)
+        missing_ids = [id_ for id_ in code_ids if id_ not in codes]
+
+        data = await self._mget([_code_key(version, id_) for id_ in missing_ids])
+        _record_lookup("get_all", len(code_ids), len(codes), data, start)
+
+        return self._repository._merge_codes(code_ids, codes, data)
+
+    async def get_subtree_ids(self, code_ids: list[int]) -> list[int]:
+        return _subtree_ids(await self.get_all(code_ids))
+
+    async def find_codes(
+        self, codes: list[str], ontology_id: str | None = None
+    ) -> dict[str, int | None]:
+        ontology_ids = (
+            [ontology_id] if ontology_id else list(self._repository._ontologies)
+        )
+        found = await self.find_codes_by_ontology({o: codes for o in ontology_ids})
+        return _first_found(codes, ontology_ids, found)
+
+    async def find_codes_by_ontology(
+        self, codes: dict[str, list[str]]
+    ) -> dict[str, dict[str, int | None]]:
+        start = time.perf_counter()
+        version = await self._sync_version()
+        keys = [(o, code) for o, codes_ in codes.items() for code in codes_]
+        data = await self._mget([_lookup_key(version, o, code) for o, code in keys])
+        _record_lookup("find_codes", len(keys), 0, data, start)
+        return _group_lookups(codes, keys, data)
+
+    def caches_codes(self) -> bool:
+        return self._repository._lru.maxsize > 0
+
+    async def _sync_version(self) -> str | None:
+        if self._repository._version_is_stale():
+            return self._repository._set_version(
+                await self._client.get("ontology_version")
+            )
+
+        return self._repository._version
+
+    async def _mget(self, keys: list[str]) -> list[Any]:
+        """@see CachedCodeRepository._mget"""
+        if not keys:
+            return []
+
+        batch_size = self._repository.MGET_BATCH_SIZE
+
+        async with self._client.pipeline(transaction=False) as pipe:
+            for i in range(0, len(keys), batch_size):
+                pipe.mget(keys[i : i + batch_size])
+
+            start = time.perf_counter()
+            batches = await pipe.execute()
+            _log_mget(len(keys), len(batches), time.perf_counter() - start)
+
+        return list(chain.from_iterable(batches))
+
 
 class CachedPropertyRepository:
     def __init__(self, sm: "sessionmaker"):
@@ -126,6 +1048,7 @@ class CachedPropertyRepository:
             self._refresh_cache()
 
         self.session = None
+        metrics.register("medconb_property_cache_size", lambda: len(self._properties))
 
     def __call__(self, session: "Session") -> "CachedPropertyRepository":
         """
@@ -137,6 +1060,7 @@ class CachedPropertyRepository:
 
     def _refresh_cache(self) -> None:
         assert self.session is not None
+        start = time.perf_counter()
 
         self._properties: list[d.Property] = list(
             map(
@@ -154,9 +1078,15 @@ class CachedPropertyRepository:
         )
         self._property_map = {p.id: p for p in self._properties}
         self._expires_at = time.time() + 60 * 10  # 10min
-        print(
-            f"Cached {len(self._properties)} properties: "
-            + str([p.name for p in self._properties])
+
+        metrics.inc("medconb_property_cache_refreshes_total")
+        metrics.observe(
+            "medconb_property_cache_refresh_seconds", time.perf_counter() - start
+        )
+        logger.info(
+            "Cached %d properties: %s",
+            len(self._properties),
+            [p.name for p in self._properties],
         )
 
     def _cache_is_expired(self) -> bool:
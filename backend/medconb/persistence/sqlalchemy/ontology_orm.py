@@ -1,6 +1,16 @@
 from typing import Any
 
-from sqlalchemy import Column, Integer, String, Table, UniqueConstraint, inspect
+from sqlalchemy import (
+    DDL,
+    Column,
+    Index,
+    Integer,
+    String,
+    Table,
+    UniqueConstraint,
+    event,
+    inspect,
+)
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import registry
 
@@ -28,8 +38,34 @@ code = Table(
     Column("children_ids", ARRAY(Integer), nullable=False),
     Column("last_descendant_id", Integer, nullable=False),
     UniqueConstraint("ontology_id", "code"),
+    # trigram indexes, so that code searches (ILIKE '%...%' and regular
+    # expressions, see CodeRepository.search_codes) don't need to scan
+    # the whole table
+    Index(
+        "ix_code_code_trgm",
+        "code",
+        postgresql_using="gin",
+        postgresql_ops={"code": "gin_trgm_ops"},
+    ),
+    Index(
+        "ix_code_description_trgm",
+        "description",
+        postgresql_using="gin",
+        postgresql_ops={"description": "gin_trgm_ops"},
+    ),
 )
 
+# key value pairs describing the imported ontology data, e.g. its version
+# (see helper/import_ontologies.py)
+ontology_meta = Table(
+    "ontology_meta",
+    mapper_registry.metadata,
+    Column("key", String, primary_key=True),
+    Column("value", String, nullable=False),
+)
+
+event.listen(code, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
 
 def start_mappers() -> list[Any]:
     mappers = []
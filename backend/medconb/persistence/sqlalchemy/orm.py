@@ -13,6 +13,7 @@ from sqlalchemy import (
     Table,
     TypeDecorator,
     UniqueConstraint,
+    event,
     inspect,
     select,
     util,
@@ -31,6 +32,7 @@ from sqlalchemy.ext.mutable import MutableDict, MutableList, MutableSet
 from sqlalchemy.ext.orderinglist import ordering_list
 from sqlalchemy.orm import (
     Mapped,
+    attributes,
     column_property,
     composite,
     foreign,
@@ -230,6 +232,8 @@ codelist = Table(
     Column("description", String, nullable=False),
     Column("reference_id", ForeignKey("codelist.id"), nullable=True),
     Column("transient_commit_id", ForeignKey("commit.id"), nullable=True),
+    Column("head_codesets", JSONB, nullable=False),
+    Column("head_version", Integer, nullable=False),
 )
 
 commit = Table(
@@ -407,9 +411,20 @@ def start_mappers() -> list[Any]:
                 lazy="joined",
                 cascade="all, delete-orphan",
             ),
+            "_head_codesets": codelist.c.head_codesets,
+            "_head_version": codelist.c.head_version,
         },
+        # Concurrent commits would overwrite each other's head. The
+        # version is set by Codelist.add_commit and each update or delete
+        # of a codelist is conditional on the version it was loaded
+        # with, so it fails with a StaleDataError if another transaction
+        # committed in the meantime.
+        version_id_col=codelist.c.head_version,
+        version_id_generator=False,
     )
     mappers.append(mapper)
+    listen_once(d.Codelist, "before_insert", serialize_codelist_head)
+    listen_once(d.Codelist, "before_update", serialize_codelist_head)
 
     mapper = inspect(d.Commit, False) or mapper_registry.map_imperatively(
         d.Commit,
@@ -433,6 +448,21 @@ def start_mappers() -> list[Any]:
     return mappers
 
 
+def listen_once(target: Any, identifier: str, fn: Any) -> None:
+    if not event.contains(target, identifier, fn):
+        event.listen(target, identifier, fn)
+
+
+def serialize_codelist_head(mapper: Any, connection: Any, target: d.Codelist) -> None:
+    """
+    Writes the head codesets of a codelist that is inserted or got a new
+    commit. The domain only keeps them as sets, so they are sorted once
+    per flush instead of once per commit.
+    """
+    if attributes.get_history(target, "_head_version").has_changes():
+        target._head_codesets = target.serialize_head()
+
+
 @runtime_checkable
 class MappedCodelist(Protocol):
     _container_item: AssociationProxy["ContainerItem"]
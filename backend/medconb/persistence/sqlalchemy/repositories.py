@@ -1,24 +1,66 @@
+import logging
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import TYPE_CHECKING, Any, Generic, Optional, Type, TypeVar, cast
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Generic,
+    Iterator,
+    Optional,
+    Sequence,
+    Type,
+    TypeVar,
+    cast,
+)
 
 from plyse.query_tree import Not, Operand
 from plyse.term_parser import Term
-from sqlalchemy import Column, Select, and_, func, literal, not_, or_, select, text
+from sqlalchemy import (
+    Column,
+    ColumnElement,
+    Select,
+    and_,
+    case,
+    func,
+    literal,
+    not_,
+    or_,
+    select,
+    text,
+    tuple_,
+)
 from sqlalchemy.dialects.postgresql.base import PGCompiler
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import Session as SQLSession
 from sqlalchemy.sql.expression import ClauseElement, Executable
 
 import medconb.domain as d
 
 from . import ontology_orm as t_o
 from . import orm as t
+from .search_terms import exact_code, page_after, whole_word_term
 
 if TYPE_CHECKING:  # pragma: no cover
     from plyse import Query
-    from sqlalchemy.orm import Session
+    from sqlalchemy.orm import Session, sessionmaker
+
+    from medconb.types import CodeRepository as SyncCodeRepository
+
+logger = logging.getLogger(__name__)
+
+# characters with a special meaning in PostgreSQL regular expressions
+_POSIX_SPECIAL = re.compile(r"[.^$|?*+()\[\]{}]")
+
+# SQLSTATE of statements cancelled e.g. by the statement_timeout
+_QUERY_CANCELED = "57014"
+
+
+# runs the per ontology queries of CodeRepository.search_codes_by_ontology
+_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="code-search")
 
 
 class Explain(Executable, ClauseElement):
@@ -39,6 +81,39 @@ def pg_explain(element, compiler: PGCompiler, **kw):
     return text
 
 
+def estimate_number_of_results(
+    session: "Session", stmt: Select, bind_arguments: dict[str, Any] | None = None
+) -> int:
+    """
+    Returns the planner's estimate of the number of rows of `stmt`, or
+    the exact number if the estimate is below 1000.
+
+    The EXPLAIN statement has no mapper to resolve the bind from, so
+    statements of another database than the default one need
+    `bind_arguments`.
+    """
+    explain_res: str = session.scalar(Explain(stmt), bind_arguments=bind_arguments)
+    match = re.search(r"rows=(\d+)", explain_res)
+
+    if match is None:
+        raise ValueError("Could not get total number of results")
+
+    count_estimated = int(match.group(1))
+
+    if count_estimated >= 1000:
+        return count_estimated
+
+    count_exact = cast(
+        int,
+        session.scalar(
+            select(func.count()).select_from(stmt.subquery()),
+            bind_arguments=bind_arguments,
+        ),
+    )
+
+    return count_exact
+
+
 class UserRepository:
     def __init__(self, session: "Session"):
         self.session = session
@@ -354,22 +429,7 @@ class SearchQueryBuilderMixin(Generic[T]):
         ] or [SearchResultVisibility.PUBLIC]
 
     def estimate_number_of_results(self, stmt: Select) -> int:
-        explain_res: str = self.session.scalar(Explain(stmt))
-        match = re.search(r"rows=(\d+)", explain_res)
-
-        if match is None:
-            raise ValueError("Could not get total number of results")
-
-        count_estimated = int(match.group(1))
-
-        if count_estimated >= 1000:
-            return count_estimated
-
-        count_exact = cast(
-            int, self.session.scalar(select(func.count()).select_from(stmt.subquery()))
-        )
-
-        return count_exact
+        return estimate_number_of_results(self.session, stmt)
 
 
 class CollectionRepository(SearchQueryBuilderMixin[d.Collection]):
@@ -602,9 +662,42 @@ class OntologyRepository:
 
 
 class CodeRepository:
+    # number of codes read at once by the iter_* methods
+    STREAM_BATCH_SIZE = 1000
+    # latency budget of a fuzzy search in SQL in milliseconds
+    FUZZY_SEARCH_TIMEOUT_MS = 2000
+    # whether the ontology database has the pg_trgm extension, which
+    # fuzzy searches need (@see check_fuzzy_search_support)
+    fuzzy_search_supported = True
+
     def __init__(self, session: "Session"):
         self.session = session
 
+    @classmethod
+    def check_fuzzy_search_support(cls, sm: "sessionmaker") -> None:
+        """
+        Checks at startup whether the ontology database has pg_trgm. If
+        not, fuzzy searches fail with FuzzySearchNotSupportedException
+        instead of a database error. helper/upgrade_ontology_db.py
+        creates the extension.
+        """
+        with sm() as session:
+            cls.fuzzy_search_supported = bool(
+                session.scalar(
+                    text(
+                        "SELECT EXISTS"
+                        " (SELECT FROM pg_extension WHERE extname = 'pg_trgm')"
+                    ),
+                    bind_arguments={"mapper": d.Code},
+                )
+            )
+
+        if not cls.fuzzy_search_supported:
+            logger.warning(
+                "The ontology database lacks the pg_trgm extension, fuzzy"
+                " searches are rejected"
+            )
+
     def get(self, code_id: int) -> Optional[d.Code]:  # pragma: no cover
         return self.session.get(d.Code, code_id)
 
@@ -615,6 +708,26 @@ class CodeRepository:
             ).all()
         )
 
+    def get_subtree_ids(self, code_ids: list[int]) -> list[int]:
+        """
+        Selects the subtrees in one query: the codes are numbered
+        depth-first (see helper/import_ontologies.py), so a subtree is the
+        id interval from its root to the root's last descendant, which the
+        primary key serves as range scan.
+        """
+        if not code_ids:
+            return []
+
+        root = t_o.code.alias("root_code")
+        stmt = (
+            select(t_o.code.c.id)
+            .join(root, t_o.code.c.id.between(root.c.id, root.c.last_descendant_id))
+            .where(root.c.id.in_(code_ids))
+            .distinct()
+            .order_by(t_o.code.c.id)
+        )
+        return list(self.session.execute(stmt).scalars())
+
     def find_codes(
         self, codes: list[str], ontology_id: str | None = None
     ) -> dict[str, int | None]:
@@ -633,45 +746,309 @@ class CodeRepository:
 
         return {r.code: r.id for r in res}
 
-    def search_codes(  # noqa R901 - too complex
+    def find_codes_by_ontology(
+        self, codes: dict[str, list[str]]
+    ) -> dict[str, dict[str, int | None]]:
+        res: dict[str, dict[str, int | None]] = {o: {} for o in codes}
+
+        in_ontology_ids = [o for o, cs in codes.items() for _ in cs]
+        in_codes_ = [c for cs in codes.values() for c in cs]
+
+        if not in_codes_:
+            return res
+
+        in_codes = func.unnest(in_ontology_ids, in_codes_).table_valued(
+            "ontology_id", "code"
+        )
+        rows = self.session.execute(
+            select(in_codes.c.ontology_id, in_codes.c.code, t_o.code.c.id).join(
+                t_o.code,
+                isouter=True,
+                onclause=(in_codes.c.ontology_id == t_o.code.c.ontology_id)
+                & (in_codes.c.code == t_o.code.c.code),
+            )
+        ).all()
+
+        for r in rows:
+            res[r.ontology_id][r.code] = r.id
+
+        return res
+
+    def search_codes(self, query_data: d.QueryData, ontology_id: str) -> list[d.Code]:
+        filters = self._search_filters(query_data)
+        if not filters:
+            return []
+
+        stmt = self._search_query(ontology_id, filters)
+        if query_data.fuzzy is not None:
+            rows = self._fuzzy_search(stmt, query_data, query_data.fuzzy)
+        else:
+            rows = self.session.execute(stmt.order_by(t_o.code.c.id)).all()
+
+        # I use this hack (instead of getting Code objects directly),
+        # so it is assured that the objects are read only.
+        # There might be a better way within sqlalchemy.
+        return [d.Code(**row._mapping) for row in rows]
+
+    def iter_all(self, code_ids: list[int]) -> Iterator[d.Code]:
+        for start in range(0, len(code_ids), self.STREAM_BATCH_SIZE):
+            yield from self.get_all(code_ids[start : start + self.STREAM_BATCH_SIZE])
+
+    def iter_search_codes(
         self, query_data: d.QueryData, ontology_id: str
-    ) -> list[d.Code]:
-        assert isinstance(d.Code.id, Mapped)
-        assert isinstance(d.Code.path, Mapped)
-        assert isinstance(d.Code.description, Mapped)
+    ) -> Iterator[d.Code]:
+        if query_data.fuzzy is not None:
+            # bounded by the limit of the fuzzy search anyway
+            yield from self.search_codes(query_data, ontology_id)
+            return
+
+        filters = self._search_filters(query_data)
+        if not filters:
+            return
+
+        stmt = (
+            self._search_query(ontology_id, filters)
+            .order_by(t_o.code.c.id)
+            .execution_options(yield_per=self.STREAM_BATCH_SIZE)
+        )
+
+        for row in self.session.execute(stmt):
+            yield d.Code(**row._mapping)
+
+    def search_codes_paged(
+        self,
+        query_data: d.QueryData,
+        ontology_id: str,
+        page_size: int = 100,
+        start_cursor: int | None = None,
+    ) -> tuple[list[d.Code], int]:
+        if query_data.fuzzy is not None:
+            codes = self.search_codes(query_data, ontology_id)
+            page = page_after(codes, lambda c: c.id, page_size, start_cursor)
+            return page, len(codes)
+
+        filters = self._search_filters(query_data)
+        if not filters:
+            return [], 0
+
+        stmt = self._search_query(ontology_id, filters)
+        rank = self._search_rank(query_data, t_o.code)
+        cursor = t_o.code.alias("cursor_code")
+        cursor_rank = self._search_rank(query_data, cursor)
+
+        if rank is None or cursor_rank is None:
+            paged = stmt.order_by(t_o.code.c.id)
+            if start_cursor is not None:
+                paged = paged.where(t_o.code.c.id > start_cursor)
+        else:
+            paged = stmt.order_by(rank, t_o.code.c.id)
+            if start_cursor is not None:
+                # keyset pagination: continue after (rank, id) of the cursor
+                cursor_key = (
+                    select(cursor_rank)
+                    .where(cursor.c.id == start_cursor)
+                    .scalar_subquery()
+                )
+                paged = paged.where(
+                    tuple_(rank, t_o.code.c.id)
+                    > tuple_(cursor_key, literal(start_cursor))
+                )
+
+        paged = paged.limit(page_size)
+
+        codes = [d.Code(**row._mapping) for row in self.session.execute(paged).all()]
+        return codes, estimate_number_of_results(
+            self.session, stmt, bind_arguments={"mapper": d.Code}
+        )
+
+    def search_codes_by_ontology(
+        self, query_data: d.QueryData, ontology_ids: list[str], page_size: int = 100
+    ) -> dict[str, tuple[list[d.Code], int]]:
+        """
+        Every ontology is searched in its own session (and thus database
+        connection) on a thread pool, so the latency is the one of the
+        slowest ontology rather than the sum.
+        """
+        bind = self.session.get_bind(mapper=d.Code)
+
+        def search(ontology_id: str) -> tuple[list[d.Code], int]:
+            with SQLSession(bind) as session:
+                return CodeRepository(session).search_codes_paged(
+                    query_data, ontology_id, page_size
+                )
+
+        futures = {o: _search_executor.submit(search, o) for o in ontology_ids}
+        return {o: future.result() for o, future in futures.items()}
+
+    @staticmethod
+    def _search_filters(query_data: d.QueryData) -> list[ColumnElement[bool]]:
         assert isinstance(d.Code.code, Mapped)
 
+        # ILIKE and ~ (regexp_match) are both supported by the trigram
+        # indexes of the code table (see ontology_orm), so they must not
+        # be wrapped in functions like lower().
         filters = []
         if query_data.description:
-            if any(c in query_data.description for c in ["%", "?"]):
-                filters.append(d.Code.description.ilike(query_data.description))
-            else:
-                filters.append(d.Code.description.ilike(f"%{query_data.description}%"))
+            filters.append(
+                CodeRepository._description_filter(
+                    query_data.description, query_data.fuzzy
+                )
+            )
         match query_data.code:
             case d.CodeSearchParam(type=d.CodeSearchParamType.ILIKE):
                 filters.append(d.Code.code.ilike(query_data.code.value))
             case d.CodeSearchParam(type=d.CodeSearchParamType.POSIX):
                 filters.append(d.Code.code.regexp_match(query_data.code.value))
 
-        if not filters:
+        if filters and query_data.root_code_id is not None:
+            filters.append(CodeRepository._subtree_filter(query_data.root_code_id))
+
+        return filters
+
+    @staticmethod
+    def _description_filter(
+        description: str, fuzzy: d.FuzzySearchParam | None
+    ) -> ColumnElement[bool]:
+        column = t_o.code.c.description
+        if fuzzy is not None:
+            return literal(description).op("<%")(column)
+        if any(c in description for c in ["%", "?"]):
+            return column.ilike(description)
+        return column.ilike(f"%{description}%")
+
+    @staticmethod
+    def _subtree_filter(root_code_id: int) -> ColumnElement[bool]:
+        """
+        Restricts a search to the subtree of a code, i.e. to the id
+        interval from the code to its last descendant (the codes are
+        numbered depth-first, see helper/import_ontologies.py). The
+        primary key serves the interval as range scan, so only the
+        subtree is matched against the other filters.
+        """
+        root = t_o.code.alias("root_code")
+        last_descendant_id = (
+            select(root.c.last_descendant_id)
+            .where(root.c.id == root_code_id)
+            .scalar_subquery()
+        )
+        return t_o.code.c.id.between(root_code_id, last_descendant_id)
+
+    def _fuzzy_search(
+        self, stmt: Select, query_data: d.QueryData, fuzzy: d.FuzzySearchParam
+    ) -> Sequence[Any]:
+        """
+        Orders a fuzzy search by the word similarity (pg_trgm) of the
+        descriptions to the searched one and limits it to the best
+        `fuzzy.limit`.
+
+        The threshold of the `<%` filter, which is served by the trigram
+        index of the descriptions, and a statement timeout of
+        `FUZZY_SEARCH_TIMEOUT_MS` are set within a savepoint, which is
+        rolled back afterwards. A search that exceeds the timeout finds
+        nothing instead of failing the request.
+        """
+        if not self.fuzzy_search_supported:
+            raise d.FuzzySearchNotSupportedException()
+
+        similarity = func.word_similarity(
+            query_data.description, t_o.code.c.description
+        )
+        stmt = stmt.order_by(similarity.desc(), t_o.code.c.id).limit(fuzzy.limit)
+
+        savepoint = self.session.begin_nested()
+        try:
+            self._set_local("pg_trgm.word_similarity_threshold", str(fuzzy.threshold))
+            self._set_local("statement_timeout", str(self.FUZZY_SEARCH_TIMEOUT_MS))
+            return self.session.execute(stmt).all()
+        except OperationalError as e:
+            if getattr(e.orig, "pgcode", None) != _QUERY_CANCELED:
+                raise
+            logger.warning(
+                "Fuzzy search for %r exceeded %dms",
+                query_data.description,
+                self.FUZZY_SEARCH_TIMEOUT_MS,
+            )
             return []
+        finally:
+            savepoint.rollback()
 
-        stmt = (
+    def _set_local(self, name: str, value: str) -> None:
+        """Sets a setting of the ontology database for the transaction."""
+        self.session.execute(
+            select(func.set_config(name, value, True)),
+            bind_arguments={"mapper": d.Code},
+        )
+
+    @staticmethod
+    def _search_query(ontology_id: str, filters: list[ColumnElement[bool]]) -> Select:
+        return (
             select(
-                d.Code.id,
-                d.Code.code,
-                d.Code.ontology_id,
-                d.Code.description,
-                d.Code.path,
-                d.Code.children_ids,
-                d.Code.last_descendant_id,
+                t_o.code.c.id,
+                t_o.code.c.code,
+                t_o.code.c.ontology_id,
+                t_o.code.c.description,
+                t_o.code.c.path,
+                t_o.code.c.children_ids,
+                t_o.code.c.last_descendant_id,
             )
-            .where(d.Code.ontology_id == ontology_id)
+            .where(t_o.code.c.ontology_id == ontology_id)
             .where(*filters)
-            .order_by(d.Code.id)
         )
 
-        # I use this hack (instead of getting Code objects directly),
-        # so it is assured that the objects are read only.
-        # There might be a better way within sqlalchemy.
-        return [d.Code(**row._mapping) for row in self.session.execute(stmt).all()]
+    @staticmethod
+    def _search_rank(query_data: d.QueryData, table: Any) -> ColumnElement[int] | None:
+        """
+        Ranks the results of a search (lower is better): 0 for exact code
+        matches, 1 for descriptions that contain the searched term as
+        whole word(s), 2 for the rest. None if all results rank the same.
+        """
+        whens: list[tuple[ColumnElement[bool], int]] = []
+
+        exact = exact_code(query_data)
+        if exact is not None:
+            whens.append((func.lower(table.c.code) == exact.lower(), 0))
+
+        term = whole_word_term(query_data)
+        if term is not None:
+            pattern = r"\m" + _POSIX_SPECIAL.sub(r"\\\g<0>", term) + r"\M"
+            whens.append((table.c.description.regexp_match(pattern, flags="i"), 1))
+
+        if not whens:
+            return None
+        return case(*whens, else_=2)
+
+    def is_ready(self) -> bool:
+        return True
+
+
+class AsyncCodeRepositoryAdapter:
+    """
+    Provides the AsyncCodeRepository interface for a synchronous
+    CodeRepository, e.g. when no async cache is configured. The calls
+    still block.
+    """
+
+    def __init__(self, repository: "SyncCodeRepository"):
+        self._repository = repository
+
+    async def get(self, code_id: int) -> Optional[d.Code]:
+        return self._repository.get(code_id)
+
+    async def get_all(self, code_ids: list[int]) -> list[d.Code]:
+        return self._repository.get_all(code_ids)
+
+    async def get_subtree_ids(self, code_ids: list[int]) -> list[int]:
+        return self._repository.get_subtree_ids(code_ids)
+
+    async def find_codes(
+        self, codes: list[str], ontology_id: str | None = None
+    ) -> dict[str, int | None]:
+        return self._repository.find_codes(codes, ontology_id)
+
+    async def find_codes_by_ontology(
+        self, codes: dict[str, list[str]]
+    ) -> dict[str, dict[str, int | None]]:
+        return self._repository.find_codes_by_ontology(codes)
+
+    def caches_codes(self) -> bool:
+        return False
@@ -0,0 +1,576 @@
+import heapq
+import logging
+import re
+import time
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from functools import lru_cache
+from typing import Callable, Iterable
+
+import numpy as np
+
+import medconb.domain as d
+
+from .search_terms import exact_code, page_after, parse_like, whole_word_term
+
+logger = logging.getLogger(__name__)
+
+# words of the indexed texts: runs of letters and digits
+_TOKEN = re.compile(r"[^\W_]+")
+
+# syntax of PostgreSQL regular expressions that python doesn't support or
+# interprets differently, e.g. [[:digit:]], \m, \y or embedded options
+_POSTGRES_ONLY_REGEX = re.compile(r"\[[:=.]|\\[mMyYZ]|\(\?|^\*\*\*")
+
+
+def _like_matcher(pattern: str) -> Callable[[str], bool]:
+    """Returns a function that tells whether a text matches the ILIKE pattern."""
+    regex = "".join(
+        ".*" if part is None else "." if part == "" else re.escape(part)
+        for part in parse_like(pattern)
+    )
+    compiled = re.compile(regex, re.DOTALL | re.IGNORECASE)
+    return lambda text: compiled.fullmatch(text) is not None
+
+
+def _description_pattern(description: str) -> str:
+    """@see CodeRepository.search_codes"""
+    if any(c in description for c in ["%", "?"]):
+        return description
+    return f"%{description}%"
+
+
+def _intersect(a: np.ndarray | None, b: np.ndarray | None) -> np.ndarray | None:
+    """Intersects sorted candidate rows, where None stands for all rows."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return np.intersect1d(a, b, assume_unique=True)
+
+
+def _search_ranker(query_data: d.QueryData) -> Callable[[str, str], int]:
+    """
+    Returns a function that ranks a matching code by its code and
+    description (lower is better): 0 for exact code matches, 1 for
+    descriptions that contain the searched term as whole word(s), 2 for
+    the rest. Mirrors CodeRepository._search_rank.
+    """
+    exact = exact_code(query_data)
+    exact = exact.lower() if exact is not None else None
+    term = whole_word_term(query_data)
+    word = (
+        re.compile(rf"(?<!\w){re.escape(term)}(?!\w)", re.IGNORECASE)
+        if term is not None
+        else None
+    )
+
+    def rank(code: str, description: str) -> int:
+        if exact is not None and code.lower() == exact:
+            return 0
+        if word is not None and word.search(description):
+            return 1
+        return 2
+
+    return rank
+
+
+def _after(keys: list[tuple[int, int]], cursor_id: int) -> list[tuple[int, int]]:
+    """
+    Returns the (rank, id) keys after the one of `cursor_id`, or none if
+    the cursor isn't among them.
+    """
+    cursor = next((k for k in keys if k[1] == cursor_id), None)
+    if cursor is None:
+        return []
+    return [k for k in keys if k > cursor]
+
+
+def _trigrams(word: str) -> list[str]:
+    """
+    Returns the trigrams of a (lower cased) word like pg_trgm builds
+    them, i.e. padded with two spaces in front and one at the end.
+    """
+    padded = f"  {word} "
+    return [padded[i : i + 3] for i in range(len(padded) - 2)]
+
+
+def _text_trigrams(text: str) -> list[str]:
+    """Returns the trigrams of the words of `text` in order."""
+    return [t for word in _TOKEN.findall(text.lower()) for t in _trigrams(word)]
+
+
+@lru_cache(maxsize=65536)
+def _similarity(count: int, len1: int, len2: int) -> float:
+    """pg_trgm's CALCSML, which divides in single precision"""
+    return float(np.float32(count / (len1 + len2 - count)))
+
+
+def _word_similarity(query: set[str], text: list[str]) -> float:  # noqa: R901
+    """
+    Returns pg_trgm's `word_similarity` of the trigrams `query` to the
+    (positional) trigrams `text`, i.e. the greatest similarity of the
+    query to an extent of the text, found the way pg_trgm's
+    iterate_word_similarity does.
+    """
+    if not query:
+        return 0.0
+
+    ulen1 = len(query)
+    # last position of each trigram within the current extent
+    lastpos: dict[str, int] = {}
+    ulen2 = count = 0
+    lower = -1
+    best = 0.0
+
+    for i, trigram in enumerate(text):
+        found = trigram in query
+        if lower >= 0 or found:
+            if lastpos.get(trigram, -1) < 0:
+                ulen2 += 1
+                if found:
+                    count += 1
+            lastpos[trigram] = i
+
+        if not found:
+            continue
+
+        upper = i
+        if lower == -1:
+            lower = i
+            ulen2 = 1
+
+        current = _similarity(count, ulen1, ulen2)
+
+        # try to move the lower bound up for a greater similarity
+        tmp_count, tmp_ulen2, prev_lower = count, ulen2, lower
+        for tmp_lower in range(lower, upper + 1):
+            similarity = _similarity(tmp_count, ulen1, tmp_ulen2)
+            if similarity > current:
+                current = similarity
+                ulen2, lower, count = tmp_ulen2, tmp_lower, tmp_count
+
+            if lastpos[text[tmp_lower]] == tmp_lower:
+                tmp_ulen2 -= 1
+                if text[tmp_lower] in query:
+                    tmp_count -= 1
+
+        best = max(best, current)
+
+        for tmp_lower in range(prev_lower, lower):
+            if lastpos[text[tmp_lower]] == tmp_lower:
+                lastpos[text[tmp_lower]] = -1
+
+    return best
+
+
+def _compile_regex(pattern: str) -> re.Pattern | None:
+    if _POSTGRES_ONLY_REGEX.search(pattern):
+        return None
+
+    try:
+        return re.compile(pattern)
+    except re.error:
+        return None
+
+
+class _TokenIndex:
+    # words of a query that match more tokens than this are not used to
+    # narrow down the candidates (as the union of their postings would
+    # be about as large as the ontology anyway)
+    MAX_TOKEN_EXPANSION = 2000
+
+    def __init__(self, values: list[str]):
+        """
+        An inverted index from the lower cased words of `values` to the
+        (sorted) positions of the values containing them.
+        """
+        postings: dict[str, list[int]] = defaultdict(list)
+        for row, value in enumerate(values):
+            for token in set(_TOKEN.findall(value.lower())):
+                postings[token].append(row)
+
+        self._tokens = sorted(postings)
+        self._postings = [np.array(postings[t], dtype=np.int32) for t in self._tokens]
+        self._reversed = sorted(
+            (token[::-1], i) for i, token in enumerate(self._tokens)
+        )
+        self._joined = "\n".join(self._tokens)
+        self._starts = [0]
+        for token in self._tokens:
+            self._starts.append(self._starts[-1] + len(token) + 1)
+
+    def candidates(self, literal: str) -> np.ndarray | None:
+        """
+        Returns the positions of all values that might contain
+        `literal`, or None if the literal doesn't narrow them down.
+
+        The words of the literal that are followed or preceded by other
+        characters within it must be complete (or a prefix or suffix of)
+        tokens of the value, the others can be anywhere within a token.
+        """
+        literal = literal.lower()
+        rows: np.ndarray | None = None
+
+        for match in _TOKEN.finditer(literal):
+            rows = _intersect(
+                rows,
+                self._word_candidates(
+                    match.group(),
+                    left_bounded=match.start() > 0,
+                    right_bounded=match.end() < len(literal),
+                ),
+            )
+            if rows is not None and not len(rows):
+                break
+
+        return rows
+
+    def _word_candidates(
+        self, word: str, left_bounded: bool, right_bounded: bool
+    ) -> np.ndarray | None:
+        if left_bounded and right_bounded:
+            token_ids = self._exact(word)
+        elif left_bounded:
+            token_ids = self._with_prefix(word)
+        elif right_bounded:
+            token_ids = self._with_suffix(word)
+        else:
+            token_ids = self._containing(word)
+
+        if len(token_ids) > self.MAX_TOKEN_EXPANSION:
+            return None
+        if not token_ids:
+            return np.empty(0, dtype=np.int32)
+
+        return np.unique(np.concatenate([self._postings[i] for i in token_ids]))
+
+    def _exact(self, word: str) -> list[int]:
+        i = bisect_left(self._tokens, word)
+        return [i] if i < len(self._tokens) and self._tokens[i] == word else []
+
+    def _with_prefix(self, word: str) -> list[int]:
+        start = bisect_left(self._tokens, word)
+        end = bisect_left(self._tokens, word + "\uffff")
+        return list(range(start, end))
+
+    def _with_suffix(self, word: str) -> list[int]:
+        reversed_word = word[::-1]
+        start = bisect_left(self._reversed, (reversed_word,))
+        end = bisect_left(self._reversed, (reversed_word + "\uffff",))
+        return [i for _, i in self._reversed[start:end]]
+
+    def _containing(self, word: str) -> list[int]:
+        token_ids = {
+            bisect_right(self._starts, m.start()) - 1
+            for m in re.finditer(re.escape(word), self._joined)
+        }
+        return sorted(token_ids)
+
+
+class _TrigramIndex:
+    def __init__(self, token_index: _TokenIndex):
+        """
+        An inverted index from trigrams to the (positions of the) values
+        of `token_index` whose words contain them.
+        """
+        token_ids: dict[str, list[int]] = defaultdict(list)
+        for i, token in enumerate(token_index._tokens):
+            for trigram in set(_trigrams(token)):
+                token_ids[trigram].append(i)
+
+        self._postings = {
+            trigram: np.unique(np.concatenate([token_index._postings[i] for i in ids]))
+            for trigram, ids in token_ids.items()
+        }
+
+    def counts(self, trigrams: set[str], size: int) -> np.ndarray:
+        """
+        Returns the number of the `trigrams` each of the `size` values
+        contains.
+        """
+        hits = [self._postings[t] for t in trigrams if t in self._postings]
+        if not hits:
+            return np.zeros(size, dtype=np.int64)
+        return np.bincount(np.concatenate(hits), minlength=size)
+
+
+class _OntologyIndex:
+    def __init__(
+        self,
+        ids: list[int],
+        codes: list[str],
+        descriptions: list[str],
+        last_descendant_ids: list[int],
+    ):
+        self.ids = ids
+        self.last_descendant_ids = last_descendant_ids
+        self.codes = codes
+        self.descriptions = descriptions
+        self.code_rows: dict[str, list[int]] = defaultdict(list)
+        for row, code in enumerate(codes):
+            self.code_rows[code.lower()].append(row)
+        self.code_index = _TokenIndex(codes)
+        self.description_index = _TokenIndex(descriptions)
+        self.description_trigrams = _TrigramIndex(self.description_index)
+
+
+class CodeSearchIndex:
+    def __init__(self, ontologies: dict[str, _OntologyIndex]):
+        """
+        CodeSearchIndex answers code searches (@see
+        CodeRepository.search_codes) from memory.
+
+        Per ontology it holds an inverted index of the words of the
+        descriptions and codes. They narrow a search down to candidate
+        codes, which are then matched exactly with the semantics of the
+        SQL search (ILIKE for descriptions and codes, POSIX regular
+        expressions for codes).
+
+        Use `build` to create it.
+        """
+        self._ontologies = ontologies
+
+    @classmethod
+    def build(
+        cls, codes: Iterable[tuple[int, str, str, str, int]]
+    ) -> "CodeSearchIndex":
+        """
+        Builds the index from (id, ontology_id, code, description,
+        last_descendant_id) tuples ordered by id.
+        """
+        start = time.perf_counter()
+        columns: dict[str, tuple[list, list, list, list]] = defaultdict(
+            lambda: ([], [], [], [])
+        )
+        for id_, ontology_id, code, description, last_descendant_id in codes:
+            ids, codes_, descriptions, last_descendant_ids = columns[ontology_id]
+            ids.append(id_)
+            codes_.append(code)
+            descriptions.append(description)
+            last_descendant_ids.append(last_descendant_id)
+
+        index = cls({o: _OntologyIndex(*cols) for o, cols in columns.items()})
+        logger.info(
+            "Built code search index of %d codes in %.1fs",
+            sum(len(cols[0]) for cols in columns.values()),
+            time.perf_counter() - start,
+        )
+        return index
+
+    def search(self, query_data: d.QueryData, ontology_id: str) -> list[int] | None:
+        """
+        Returns the ids of the matching codes ordered by id (fuzzy
+        searches: by similarity) or None if the query can't be answered
+        by the index (i.e. the regular expression is not supported by
+        python).
+        """
+        ontology = self._ontologies.get(ontology_id)
+        if ontology is None:
+            return []
+
+        if query_data.fuzzy is not None:
+            rows = self._fuzzy_rows(ontology, query_data, query_data.fuzzy)
+        else:
+            rows = self._search_rows(ontology, query_data)
+        if rows is None:
+            return None
+        return [ontology.ids[row] for row in rows]
+
+    def search_page(
+        self,
+        query_data: d.QueryData,
+        ontology_id: str,
+        page_size: int,
+        start_cursor: int | None = None,
+    ) -> tuple[list[int], int] | None:
+        """
+        Returns a page of the ids of the matching codes ranked like
+        CodeRepository.search_codes_paged and the total number of
+        matches, or None if the query can't be answered by the index.
+        """
+        if query_data.fuzzy is not None:
+            ids = self.search(query_data, ontology_id)
+            if ids is None:
+                return None
+            return page_after(ids, lambda id_: id_, page_size, start_cursor), len(ids)
+
+        ontology = self._ontologies.get(ontology_id)
+        if ontology is None:
+            return [], 0
+
+        rows = self._search_rows(ontology, query_data)
+        if rows is None:
+            return None
+
+        rank = _search_ranker(query_data)
+        keys = [
+            (rank(ontology.codes[row], ontology.descriptions[row]), ontology.ids[row])
+            for row in rows
+        ]
+
+        remaining = keys if start_cursor is None else _after(keys, start_cursor)
+
+        # only the page is sorted, so a broad search isn't slower to page
+        page = heapq.nsmallest(page_size, remaining)
+        return [id_ for _, id_ in page], len(keys)
+
+    def _search_rows(
+        self, ontology: _OntologyIndex, query_data: d.QueryData
+    ) -> list[int] | None:
+        """Returns the matching rows of the ontology (@see search)."""
+        rows: np.ndarray | None = None
+        filters: list[tuple[list[str], Callable[[str], bool]]] = []
+
+        if query_data.description:
+            pattern = _description_pattern(query_data.description)
+            filters.append((ontology.descriptions, _like_matcher(pattern)))
+            rows = self._candidates(ontology.description_index, pattern, rows)
+
+        if isinstance(query_data.code, d.CodeSearchParam):
+            code_filter = self._code_filter(ontology, query_data.code)
+            if code_filter is None:
+                return None
+            filters.append((ontology.codes, code_filter[0]))
+            rows = _intersect(rows, code_filter[1])
+
+        if not filters:
+            return []
+
+        rows = self._in_subtree(ontology, query_data, rows)
+        candidates = range(len(ontology.ids)) if rows is None else rows.tolist()
+        return [
+            row
+            for row in candidates
+            if all(match(values[row]) for values, match in filters)
+        ]
+
+    def _fuzzy_rows(
+        self,
+        ontology: _OntologyIndex,
+        query_data: d.QueryData,
+        fuzzy: d.FuzzySearchParam,
+    ) -> list[int] | None:
+        """
+        Returns the (at most `fuzzy.limit`) rows whose description has a
+        word similarity (as pg_trgm's `word_similarity` and `<%`) of at
+        least `fuzzy.threshold` to the searched one, most similar first
+        and then by id, like CodeRepository._fuzzy_search.
+
+        The similarity is at most the share of the trigrams of the search
+        that a description contains. The candidates are scored in the
+        order of that bound until it is below the similarity of the
+        `fuzzy.limit`th best one.
+        """
+        code_match: Callable[[str], bool] | None = None
+        code_rows: np.ndarray | None = None
+        if isinstance(query_data.code, d.CodeSearchParam):
+            code_filter = self._code_filter(ontology, query_data.code)
+            if code_filter is None:
+                return None
+            code_match, code_rows = code_filter
+
+        query = set(_text_trigrams(query_data.description or ""))
+        if not query:
+            return []
+
+        counts = ontology.description_trigrams.counts(query, len(ontology.ids))
+        bounds = (counts / len(query)).astype(np.float32)
+        rows: np.ndarray = np.flatnonzero(bounds >= fuzzy.threshold)
+        code_rows = self._in_subtree(ontology, query_data, code_rows)
+        if code_rows is not None:
+            rows = np.intersect1d(rows, code_rows, assume_unique=True)
+        if code_match is not None:
+            rows = np.array(
+                [row for row in rows.tolist() if code_match(ontology.codes[row])],
+                dtype=np.int64,
+            )
+
+        return self._most_similar(ontology, query, rows, bounds, fuzzy)
+
+    @staticmethod
+    def _most_similar(
+        ontology: _OntologyIndex,
+        query: set[str],
+        rows: np.ndarray,
+        bounds: np.ndarray,
+        fuzzy: d.FuzzySearchParam,
+    ) -> list[int]:
+        """
+        Returns the (at most `fuzzy.limit`) `rows` whose description has a
+        word similarity of at least `fuzzy.threshold` to the trigrams
+        `query`, most similar first. The rows are scored in the order of
+        their upper `bounds` of the similarity.
+        """
+        # (similarity, -row) of the best rows so far, the worst first
+        best: list[tuple[float, int]] = []
+        for row in rows[np.lexsort((rows, -bounds[rows]))].tolist():
+            # ties are broken by id, i.e. row
+            if len(best) == fuzzy.limit and (float(bounds[row]), -row) < best[0]:
+                break
+
+            text = _text_trigrams(ontology.descriptions[row])
+            similarity = _word_similarity(query, text)
+            if similarity < fuzzy.threshold:
+                continue
+            if len(best) < fuzzy.limit:
+                heapq.heappush(best, (similarity, -row))
+            else:
+                heapq.heappushpop(best, (similarity, -row))
+
+        return [-row for _, row in sorted(best, reverse=True)]
+
+    def _code_filter(
+        self, ontology: _OntologyIndex, code: d.CodeSearchParam
+    ) -> tuple[Callable[[str], bool], np.ndarray | None] | None:
+        """
+        Returns a matcher for the codes and the candidate rows, or None
+        if the filter isn't supported.
+        """
+        if code.type == d.CodeSearchParamType.POSIX:
+            regex = _compile_regex(code.value)
+            if regex is None:
+                return None
+            return (lambda text: regex.search(text) is not None), None
+
+        parts = parse_like(code.value)
+        matcher = _like_matcher(code.value)
+
+        # exact code, e.g. "E11.9"
+        if len(parts) == 1 and parts[0]:
+            exact = ontology.code_rows.get(parts[0].lower(), [])
+            return matcher, np.array(exact, dtype=np.int32)
+
+        return matcher, self._candidates(ontology.code_index, code.value, None)
+
+    @staticmethod
+    def _in_subtree(
+        ontology: _OntologyIndex, query_data: d.QueryData, rows: np.ndarray | None
+    ) -> np.ndarray | None:
+        """
+        Restricts candidate rows to the subtree of `query_data.root_code_id`
+        (including the root), i.e. to the rows of its id interval (@see
+        CodeRepository._subtree_filter).
+        """
+        root_code_id = query_data.root_code_id
+        if root_code_id is None:
+            return rows
+
+        start = bisect_left(ontology.ids, root_code_id)
+        if start == len(ontology.ids) or ontology.ids[start] != root_code_id:
+            return np.empty(0, dtype=np.int32)
+
+        end = bisect_right(ontology.ids, ontology.last_descendant_ids[start])
+        return _intersect(rows, np.arange(start, end, dtype=np.int32))
+
+    @staticmethod
+    def _candidates(
+        index: _TokenIndex, pattern: str, rows: np.ndarray | None
+    ) -> np.ndarray | None:
+        for part in parse_like(pattern):
+            if not part:
+                continue
+
+            rows = _intersect(rows, index.candidates(part))
+
+        return rows
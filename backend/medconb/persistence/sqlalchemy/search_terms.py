@@ -0,0 +1,92 @@
+"""
+Terms of code searches that both the SQL search (CodeRepository) and the
+in-memory search index (CodeSearchIndex) derive from the query, so they
+rank and page results the same way.
+"""
+
+import re
+from typing import Callable, TypeVar
+
+import medconb.domain as d
+
+# word characters as PostgreSQL's \m and \M understand them
+_WORD_CHAR = re.compile(r"\w")
+
+T = TypeVar("T")
+
+
+def parse_like(pattern: str) -> list[str | None]:
+    """
+    Splits a (I)LIKE pattern into its literal parts, "%" wildcards (as
+    None) and "_" wildcards (as empty string). The escape character is
+    PostgreSQL's default, the backslash.
+    """
+    parts: list[str | None] = []
+    literal: list[str] = []
+    chars = iter(pattern)
+
+    for char in chars:
+        if char == "\\":
+            literal.append(next(chars, ""))
+        elif char in ("%", "_"):
+            if literal:
+                parts.append("".join(literal))
+                literal = []
+            parts.append(None if char == "%" else "")
+        else:
+            literal.append(char)
+
+    if literal:
+        parts.append("".join(literal))
+
+    return parts
+
+
+def exact_code(query_data: d.QueryData) -> str | None:
+    """
+    Returns the code searched for, if the ILIKE code has no wildcards
+    apart from leading or trailing "%", e.g. "E11" for "E11%".
+    """
+    if not isinstance(query_data.code, d.CodeSearchParam):
+        return None
+    if query_data.code.type != d.CodeSearchParamType.ILIKE:
+        return None
+
+    parts = parse_like(query_data.code.value)
+    while parts and parts[0] is None:
+        parts.pop(0)
+    while parts and parts[-1] is None:
+        parts.pop()
+
+    if len(parts) == 1 and parts[0]:
+        return parts[0]
+    return None
+
+
+def whole_word_term(query_data: d.QueryData) -> str | None:
+    """
+    Returns the description searched for, if it has no wildcards and
+    starts and ends with a word character, i.e. it can match whole words.
+    """
+    term = query_data.description
+    if not term or any(c in term for c in "%?_\\"):
+        return None
+    if not (_WORD_CHAR.match(term[0]) and _WORD_CHAR.match(term[-1])):
+        return None
+    return term
+
+
+def page_after(
+    items: list[T], id_of: Callable[[T], int], page_size: int, start_cursor: int | None
+) -> list[T]:
+    """
+    Returns the page of a (fully ranked) list of results after the item
+    with the id `start_cursor`, or nothing if it isn't among them.
+    """
+    start = 0
+    if start_cursor is not None:
+        ids = [id_of(item) for item in items]
+        if start_cursor not in ids:
+            return []
+        start = ids.index(start_cursor) + 1
+    return items[start : start + page_size]
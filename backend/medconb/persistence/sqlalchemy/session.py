@@ -1,3 +1,4 @@
+from functools import partial
 from typing import Callable, cast
 
 from sqlalchemy import event
@@ -5,12 +6,16 @@ from sqlalchemy.orm import Session as SQLSession
 from sqlalchemy.orm import sessionmaker as sql_sessionmaker
 
 import medconb.domain as d
-from medconb.types import CodeRepository, sessionmaker
+from medconb.types import AsyncCodeRepository, CodeRepository, sessionmaker
 
 from . import ontology_orm, orm
-from .cache import CachedCodeRepository, CachedPropertyRepository
+from .cache import (
+    AsyncCachedCodeRepository,
+    CachedCodeRepository,
+    CachedPropertyRepository,
+)
 from .orm import MappedCodelist, MappedPhenotype
-from .repositories import CodelistRepository
+from .repositories import AsyncCodeRepositoryAdapter, CodelistRepository
 from .repositories import CodeRepository as PGCodeRepository
 from .repositories import (
     CollectionRepository,
@@ -19,6 +24,7 @@ from .repositories import (
     PropertyRepository,
     UserRepository,
 )
+from .snapshot import SnapshotCodeRepository
 
 
 class Session(SQLSession):
@@ -79,10 +85,12 @@ class Session(SQLSession):
         self,
         code_repository: Callable[..., CodeRepository],
         property_repository: Callable[..., PropertyRepository],
+        async_code_repository: Callable[..., AsyncCodeRepository] | None = None,
         **kw
     ) -> None:
         super().__init__(**kw)
         self._code_repository = code_repository
+        self._async_code_repository = async_code_repository
         self._property_repository = property_repository
 
         event.listen(d.Codelist, "init", self.handle_domain_container_item_init)
@@ -167,36 +175,79 @@ class Session(SQLSession):
     def code_repository(self) -> CodeRepository:
         return self._code_repository(self)
 
+    @property
+    def async_code_repository(self) -> AsyncCodeRepository:
+        if self._async_code_repository is None:
+            return AsyncCodeRepositoryAdapter(self.code_repository)
+        return self._async_code_repository(self)
+
     @property
     def property_repository(self) -> PropertyRepository:
         return self._property_repository(self)
 
 
 def create_sessionmaker(
-    engine_medconb, engine_ontology, cache_client=None
+    engine_medconb,
+    engine_ontology,
+    cache_client=None,
+    code_lru_size: int = 50000,
+    async_cache_client=None,
+    code_snapshot_dir: str | None = None,
+    search_cache_size: int = 1000,
+    search_cache_ttl: float = 600,
+    code_search_index: bool = False,
 ) -> tuple[sessionmaker, list[Callable]]:
     medconb_mappers = orm.start_mappers()
     ontology_mappers = ontology_orm.start_mappers()
 
-    binds = {mp: engine_medconb for mp in medconb_mappers} | {
-        mp: engine_ontology for mp in ontology_mappers
-    }
-
-    startup_hooks: list[Callable] = []
+    binds = (
+        {mp: engine_medconb for mp in medconb_mappers}
+        | {mp: engine_ontology for mp in ontology_mappers}
+        | {ontology_orm.ontology_meta: engine_ontology}
+    )
 
     init_sm = sql_sessionmaker(bind=engine_medconb, binds=binds)
+    startup_hooks: list[Callable] = [
+        partial(PGCodeRepository.check_fuzzy_search_support, init_sm)
+    ]
+
     property_repo = CachedPropertyRepository(sm=init_sm)
     code_repo: Callable[..., CodeRepository] = PGCodeRepository
+    async_code_repo: Callable[..., AsyncCodeRepository] | None = None
+
+    if code_snapshot_dir:
+        snapshot_code_repo = SnapshotCodeRepository(
+            sm=init_sm,
+            directory=code_snapshot_dir,
+            search_cache_size=search_cache_size,
+            search_cache_ttl=search_cache_ttl,
+            search_index=code_search_index,
+        )
+        startup_hooks.append(snapshot_code_repo.warmup)
+        code_repo = snapshot_code_repo
+    elif cache_client:
+        cached_code_repo = CachedCodeRepository(
+            sm=init_sm,
+            client=cache_client,
+            lru_size=code_lru_size,
+            search_cache_size=search_cache_size,
+            search_cache_ttl=search_cache_ttl,
+            search_index=code_search_index,
+        )
+        startup_hooks.append(cached_code_repo.warmup)
+        code_repo = cached_code_repo
 
-    if cache_client:
-        code_repo = CachedCodeRepository(sm=init_sm, client=cache_client)
-        startup_hooks.append(code_repo.warmup)
+        if async_cache_client:
+            async_code_repo = AsyncCachedCodeRepository(
+                cached_code_repo, async_cache_client
+            )
 
     sm = sql_sessionmaker(
         bind=engine_medconb,
         binds=binds,
         class_=Session,
         code_repository=code_repo,
+        async_code_repository=async_code_repo,
         property_repository=property_repo,
     )
 
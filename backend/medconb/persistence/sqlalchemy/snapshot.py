@@ -0,0 +1,516 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+from array import array
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Optional
+
+import numpy as np
+from sqlalchemy import select
+
+import medconb.domain as d
+
+from . import ontology_orm as t_o
+from .cache import (
+    LRUCache,
+    _first_found,
+    _register_cache_metrics,
+    _search_key,
+    ontology_data_version,
+)
+from .repositories import CodeRepository
+from .search_index import CodeSearchIndex
+
+if TYPE_CHECKING:  # pragma: no cover
+    from sqlalchemy.orm import Session, sessionmaker
+
+logger = logging.getLogger(__name__)
+
+# File layout of a snapshot:
+#   magic, the byte length of the header as uint64 (little endian) and
+#   the header as JSON, describing the position of every array,
+#   followed by the arrays, each aligned to _ALIGNMENT bytes.
+SNAPSHOT_FORMAT_VERSION = 1
+_MAGIC = b"MCBSNAP" + bytes([SNAPSHOT_FORMAT_VERSION])
+_ALIGNMENT = 64
+
+
+def _lookup_hash(ontology_id: str, code: str) -> int:
+    key = f"{ontology_id}|{code.lower()}".encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def write_snapshot(path: str | Path, codes: Iterable[d.Code]) -> int:
+    """
+    Writes `codes` (ordered by id) as columnar snapshot to `path` and
+    returns the number of codes written.
+
+    Besides the columns of the code table it contains a lookup index
+    of (ontology, lower case code) hashes, sorted for binary search.
+    """
+    ontologies: dict[str, int] = {}
+    ids, ontology_idx, last_descendant_ids = array("i"), array("H"), array("i")
+    path_offsets, path_values = array("q", [0]), array("i")
+    children_offsets, children_values = array("q", [0]), array("i")
+    code_offsets, code_strings = array("q", [0]), bytearray()
+    description_offsets, description_strings = array("q", [0]), bytearray()
+    lookup_hashes = array("Q")
+
+    for code in codes:
+        ids.append(code.id)
+        ontology_idx.append(ontologies.setdefault(code.ontology_id, len(ontologies)))
+        last_descendant_ids.append(code.last_descendant_id)
+        path_values.extend(code.path)
+        path_offsets.append(len(path_values))
+        children_values.extend(code.children_ids)
+        children_offsets.append(len(children_values))
+        code_strings += code.code.encode()
+        code_offsets.append(len(code_strings))
+        description_strings += code.description.encode()
+        description_offsets.append(len(description_strings))
+        lookup_hashes.append(_lookup_hash(code.ontology_id, code.code))
+
+    hashes = np.frombuffer(lookup_hashes, dtype=np.uint64)
+    lookup_rows = np.argsort(hashes, kind="stable").astype(np.int32)
+
+    arrays: dict[str, np.ndarray] = {
+        "id": np.frombuffer(ids, dtype=np.int32),
+        "ontology": np.frombuffer(ontology_idx, dtype=np.uint16),
+        "last_descendant_id": np.frombuffer(last_descendant_ids, dtype=np.int32),
+        "path_offsets": np.frombuffer(path_offsets, dtype=np.int64),
+        "path_values": np.frombuffer(path_values, dtype=np.int32),
+        "children_offsets": np.frombuffer(children_offsets, dtype=np.int64),
+        "children_values": np.frombuffer(children_values, dtype=np.int32),
+        "code_offsets": np.frombuffer(code_offsets, dtype=np.int64),
+        "code_strings": np.frombuffer(bytes(code_strings), dtype=np.uint8),
+        "description_offsets": np.frombuffer(description_offsets, dtype=np.int64),
+        "description_strings": np.frombuffer(
+            bytes(description_strings), dtype=np.uint8
+        ),
+        "lookup_hashes": hashes[lookup_rows],
+        "lookup_rows": lookup_rows,
+    }
+
+    layout: dict[str, dict[str, Any]] = {}
+    offset = 0
+    for name, arr in arrays.items():
+        layout[name] = {"dtype": arr.dtype.str, "offset": offset, "size": arr.size}
+        offset += -(-arr.nbytes // _ALIGNMENT) * _ALIGNMENT
+
+    header = json.dumps({"ontologies": list(ontologies), "arrays": layout}).encode()
+    data_start = -(-(len(_MAGIC) + 8 + len(header)) // _ALIGNMENT) * _ALIGNMENT
+
+    with open(path, "wb") as f:
+        f.write(_MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for name, arr in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(arr.tobytes())
+        f.truncate(data_start + offset)
+
+    return len(ids)
+
+
+class CodeSnapshot:
+    def __init__(self, path: str | Path):
+        """
+        Opens a snapshot written by `write_snapshot`. The arrays are
+        memory mapped read only, so all processes that open the same
+        file share its pages through the OS page cache.
+        """
+        self.path = Path(path)
+        self._mmap = np.memmap(self.path, dtype=np.uint8, mode="r")
+
+        if bytes(self._mmap[: len(_MAGIC)]) != _MAGIC:
+            raise ValueError(f"{self.path} is not a code snapshot of this version")
+
+        header_len = int.from_bytes(
+            bytes(self._mmap[len(_MAGIC) : len(_MAGIC) + 8]), "little"
+        )
+        header_end = len(_MAGIC) + 8 + header_len
+        header = json.loads(bytes(self._mmap[len(_MAGIC) + 8 : header_end]))
+        data_start = -(-header_end // _ALIGNMENT) * _ALIGNMENT
+
+        self.ontologies: list[str] = header["ontologies"]
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            start = data_start + spec["offset"]
+            end = start + spec["size"] * dtype.itemsize
+            arrays[name] = self._mmap[start:end].view(dtype)
+
+        self._id = arrays["id"]
+        self._ontology = arrays["ontology"]
+        self._last_descendant_id = arrays["last_descendant_id"]
+        self._path_offsets = arrays["path_offsets"]
+        self._path_values = arrays["path_values"]
+        self._children_offsets = arrays["children_offsets"]
+        self._children_values = arrays["children_values"]
+        self._code_offsets = arrays["code_offsets"]
+        self._code_strings = arrays["code_strings"]
+        self._description_offsets = arrays["description_offsets"]
+        self._description_strings = arrays["description_strings"]
+        self._lookup_hashes = arrays["lookup_hashes"]
+        self._lookup_rows = arrays["lookup_rows"]
+
+    def __len__(self) -> int:
+        return len(self._id)
+
+    def get_all(self, code_ids: list[int]) -> list[d.Code]:
+        """
+        Returns the codes with the given ids in the order of `code_ids`.
+        Unknown ids are skipped.
+        """
+        if not code_ids or not len(self):
+            return []
+
+        ids = np.asarray(code_ids, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self._id, ids), len(self) - 1)
+        found = self._id[rows] == ids
+        return [self._code(int(row)) for row in rows[found]]
+
+    def subtree_ids(self, code_ids: list[int]) -> list[int]:
+        """
+        Returns the ids of the subtrees of the codes (including
+        themselves) ordered by id. As the codes are numbered depth-first,
+        a subtree is the slice of the id column from its root up to the
+        root's last descendant. Unknown ids are skipped.
+        """
+        if not code_ids or not len(self):
+            return []
+
+        ids = np.asarray(code_ids, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self._id, ids), len(self) - 1)
+        rows = rows[self._id[rows] == ids]
+        ends = np.searchsorted(self._id, self._last_descendant_id[rows], side="right")
+
+        # nested or repeated subtrees are sliced only once
+        slices = []
+        end = 0
+        for start, stop in sorted(zip(rows.tolist(), ends.tolist())):
+            if stop > end:
+                slices.append(self._id[max(start, end) : stop])
+                end = stop
+
+        return np.concatenate(slices).tolist() if slices else []
+
+    def find_codes(self, ontology_id: str, codes: list[str]) -> dict[str, int | None]:
+        """
+        Returns the ids of `codes` (compared case insensitive) within
+        the ontology.
+        """
+        res: dict[str, int | None] = {code: None for code in codes}
+        if ontology_id not in self.ontologies or not codes:
+            return res
+
+        ontology = self.ontologies.index(ontology_id)
+        hashes = np.array(
+            [_lookup_hash(ontology_id, code) for code in codes], dtype=np.uint64
+        )
+        starts = np.searchsorted(self._lookup_hashes, hashes)
+
+        for code, hash_, i in zip(codes, hashes, starts.tolist()):
+            # equal hashes are adjacent, compare the codes to rule out
+            # collisions
+            while i < len(self) and self._lookup_hashes[i] == hash_:
+                row = int(self._lookup_rows[i])
+                if (
+                    self._ontology[row] == ontology
+                    and self._string(
+                        self._code_offsets, self._code_strings, row
+                    ).lower()
+                    == code.lower()
+                ):
+                    res[code] = int(self._id[row])
+                    break
+                i += 1
+
+        return res
+
+    def search_fields(self) -> Iterator[tuple[int, str, str, str, int]]:
+        """
+        Yields (id, ontology_id, code, description, last_descendant_id)
+        of all codes.
+        """
+        for row in range(len(self)):
+            yield (
+                int(self._id[row]),
+                self.ontologies[self._ontology[row]],
+                self._string(self._code_offsets, self._code_strings, row),
+                self._string(self._description_offsets, self._description_strings, row),
+                int(self._last_descendant_id[row]),
+            )
+
+    def _code(self, row: int) -> d.Code:
+        return d.Code(
+            id=int(self._id[row]),
+            code=self._string(self._code_offsets, self._code_strings, row),
+            ontology_id=self.ontologies[self._ontology[row]],
+            description=self._string(
+                self._description_offsets, self._description_strings, row
+            ),
+            path=self._path_values[
+                self._path_offsets[row] : self._path_offsets[row + 1]
+            ].tolist(),
+            children_ids=self._children_values[
+                self._children_offsets[row] : self._children_offsets[row + 1]
+            ].tolist(),
+            last_descendant_id=int(self._last_descendant_id[row]),
+        )
+
+    @staticmethod
+    def _string(offsets: np.ndarray, strings: np.ndarray, row: int) -> str:
+        return strings[offsets[row] : offsets[row + 1]].tobytes().decode()
+
+
+class SnapshotCodeRepository:  # pragma: no cover
+    WARMUP_BATCH_SIZE = 10000
+    # initial and maximum backoff between failed warmups in seconds
+    WARMUP_RETRY_DELAY = 3
+    WARMUP_RETRY_MAX_DELAY = 60
+    # larger search results are not cached
+    SEARCH_CACHE_MAX_RESULTS = 5000
+
+    def __init__(
+        self,
+        sm: "sessionmaker",
+        directory: str | Path,
+        search_cache_size: int = 1000,
+        search_cache_ttl: float = 600,
+        search_index: bool = False,
+    ):
+        """
+        SnapshotCodeRepository serves the codes from a memory mapped
+        snapshot of the code table in `directory` instead of redis. Like
+        CachedCodeRepository it is created once and the __call__ method
+        serves as the entry point for request scoped use.
+
+        The snapshot is named by the data version of the ontologies
+        (see `ontology_data_version`). At startup the first process
+        builds it (coordinated by a file lock) and all processes map
+        the same file. Until then the codes are read from the database.
+        Searching is done in SQL or, with `search_index`, by a
+        CodeSearchIndex built from the snapshot. Its results are cached
+        as in CachedCodeRepository.
+        """
+        self._sm = sm
+        self._directory = Path(directory)
+        self._snapshot: CodeSnapshot | None = None
+        self._search_cache: LRUCache[tuple, list[d.Code]] = LRUCache(
+            search_cache_size, ttl=search_cache_ttl
+        )
+        _register_cache_metrics("search_cache", self._search_cache)
+        self._search_index_enabled = search_index
+        self._search_index: CodeSearchIndex | None = None
+        self._warmup_task: asyncio.Task | None = None
+        self.session: "Session" | None = None
+
+    def __call__(self, session: "Session") -> "SnapshotCodeRepository":
+        """
+        Is called when this repository is used within a context of a
+        request to set the currently active sql session.
+        """
+        self.session = session
+        return self
+
+    async def warmup(self) -> None:
+        """
+        Loads (or builds) the snapshot in the background, so the service
+        can already answer liveness probes. `is_ready` reports when the
+        snapshot is used.
+        """
+        self._warmup_task = asyncio.create_task(self._warmup())
+
+    async def _warmup(self) -> None:
+        """
+        Loads the snapshot (see `_load`). Failures (e.g. while the
+        database is unavailable) are retried with exponential backoff,
+        so the process becomes ready once they are resolved.
+        """
+        delay = self.WARMUP_RETRY_DELAY
+        while True:
+            try:
+                snapshot = await asyncio.to_thread(self._load)
+                break
+            except Exception:
+                logger.exception(
+                    "Loading the code snapshot failed, retrying in %ds", delay
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.WARMUP_RETRY_MAX_DELAY)
+
+        self._snapshot = snapshot
+
+        if self._search_index_enabled:
+            self._search_index = await asyncio.to_thread(
+                CodeSearchIndex.build, snapshot.search_fields()
+            )
+
+    def _load(self) -> CodeSnapshot:
+        with self._sm() as session:
+            version = ontology_data_version(session, SNAPSHOT_FORMAT_VERSION)
+
+        self._directory.mkdir(parents=True, exist_ok=True)
+        path = self._directory / f"codes-{version}.snapshot"
+
+        with open(self._directory / "codes.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not path.exists():
+                self._build(path)
+                self._remove_stale_snapshots(keep=path)
+
+        logger.info("Using code snapshot %s", path)
+        return CodeSnapshot(path)
+
+    def _build(self, path: Path) -> None:
+        """
+        Streams all codes into a temporary file that is then moved into
+        place, so no process can open an incomplete snapshot.
+        """
+        logger.info("Building code snapshot %s", path)
+        start = time.perf_counter()
+        tmp_path = path.with_suffix(".tmp")
+
+        with self._sm() as session:
+            stmt = (
+                select(t_o.code)
+                .order_by(t_o.code.c.id)
+                .execution_options(yield_per=self.WARMUP_BATCH_SIZE)
+            )
+            num_codes = write_snapshot(
+                tmp_path,
+                (d.Code(**row._mapping) for row in session.execute(stmt)),
+            )
+
+        os.replace(tmp_path, path)
+        logger.info(
+            "Built code snapshot of %d codes in %.1fs",
+            num_codes,
+            time.perf_counter() - start,
+        )
+
+    def _remove_stale_snapshots(self, keep: Path) -> None:
+        # processes that still map an old snapshot keep their pages
+        for path in self._directory.glob("codes-*.snapshot"):
+            if path != keep:
+                path.unlink(missing_ok=True)
+
+    def is_ready(self) -> bool:
+        return self._snapshot is not None
+
+    def get(self, code_id: int) -> Optional[d.Code]:
+        codes = self.get_all([code_id])
+        return codes[0] if codes else None
+
+    def get_all(self, code_ids: list[int]) -> list[d.Code]:
+        if self._snapshot is None:
+            return self._sql().get_all(code_ids)
+        return self._snapshot.get_all(code_ids)
+
+    def get_subtree_ids(self, code_ids: list[int]) -> list[int]:
+        if self._snapshot is None:
+            return self._sql().get_subtree_ids(code_ids)
+        return self._snapshot.subtree_ids(code_ids)
+
+    def find_codes(
+        self, codes: list[str], ontology_id: str | None = None
+    ) -> dict[str, int | None]:
+        if self._snapshot is None:
+            return self._sql().find_codes(codes, ontology_id)
+
+        ontology_ids = [ontology_id] if ontology_id else self._snapshot.ontologies
+        found = self.find_codes_by_ontology({o: codes for o in ontology_ids})
+        return _first_found(codes, ontology_ids, found)
+
+    def find_codes_by_ontology(
+        self, codes: dict[str, list[str]]
+    ) -> dict[str, dict[str, int | None]]:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self._sql().find_codes_by_ontology(codes)
+        return {o: snapshot.find_codes(o, codes_) for o, codes_ in codes.items()}
+
+    def search_codes(self, query_data: d.QueryData, ontology_id: str) -> list[d.Code]:
+        """@see CachedCodeRepository.search_codes"""
+        key = _search_key(query_data, ontology_id)
+        codes = self._search_cache.get(key)
+        if codes is None:
+            codes = self._search(query_data, ontology_id)
+            if len(codes) <= self.SEARCH_CACHE_MAX_RESULTS:
+                self._search_cache.put(key, codes)
+
+        return list(codes)
+
+    def _search(self, query_data: d.QueryData, ontology_id: str) -> list[d.Code]:
+        if self._search_index is not None:
+            code_ids = self._search_index.search(query_data, ontology_id)
+            if code_ids is not None:
+                return self.get_all(code_ids)
+
+        return self._sql().search_codes(query_data, ontology_id)
+
+    def iter_all(self, code_ids: list[int]) -> Iterator[d.Code]:
+        for start in range(0, len(code_ids), CodeRepository.STREAM_BATCH_SIZE):
+            batch = code_ids[start : start + CodeRepository.STREAM_BATCH_SIZE]
+            yield from self.get_all(batch)
+
+    def iter_search_codes(
+        self, query_data: d.QueryData, ontology_id: str
+    ) -> Iterator[d.Code]:
+        """@see CachedCodeRepository.iter_search_codes"""
+        if self._search_index is not None:
+            code_ids = self._search_index.search(query_data, ontology_id)
+            if code_ids is not None:
+                return self.iter_all(code_ids)
+
+        return self._sql().iter_search_codes(query_data, ontology_id)
+
+    def search_codes_by_ontology(
+        self, query_data: d.QueryData, ontology_ids: list[str], page_size: int = 100
+    ) -> dict[str, tuple[list[d.Code], int]]:
+        """@see CachedCodeRepository.search_codes_by_ontology"""
+        res: dict[str, tuple[list[d.Code], int]] = {}
+        if self._search_index is not None:
+            for ontology_id in ontology_ids:
+                page = self._search_index.search_page(
+                    query_data, ontology_id, page_size
+                )
+                if page is not None:
+                    res[ontology_id] = self.get_all(page[0]), page[1]
+
+        missing = [o for o in ontology_ids if o not in res]
+        if missing:
+            res |= self._sql().search_codes_by_ontology(query_data, missing, page_size)
+
+        return {o: res[o] for o in ontology_ids}
+
+    def search_codes_paged(
+        self,
+        query_data: d.QueryData,
+        ontology_id: str,
+        page_size: int = 100,
+        start_cursor: int | None = None,
+    ) -> tuple[list[d.Code], int]:
+        """@see CachedCodeRepository.search_codes_paged"""
+        if self._search_index is not None:
+            page = self._search_index.search_page(
+                query_data, ontology_id, page_size, start_cursor
+            )
+            if page is not None:
+                return self.get_all(page[0]), page[1]
+
+        return self._sql().search_codes_paged(
+            query_data, ontology_id, page_size, start_cursor
+        )
+
+    def search_cache_stats(self) -> dict[str, float]:
+        return self._search_cache.stats()
+
+    def _sql(self) -> CodeRepository:
+        assert self.session is not None
+        return CodeRepository(self.session)
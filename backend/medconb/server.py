@@ -1,26 +1,38 @@
+import json
 import os
-from typing import Callable, Sequence
+from dataclasses import asdict
+from typing import Any, Callable, Iterable, Iterator, Sequence, cast
 
 from ariadne.asgi import GraphQL
 from ariadne.asgi.handlers import GraphQLHTTPHandler, GraphQLWSHandler
+from pydantic import BaseModel, ValidationError
 from starlette.applications import Starlette
 from starlette.authentication import requires
+from starlette.concurrency import run_in_threadpool
 from starlette.exceptions import HTTPException
 from starlette.middleware import Middleware
 from starlette.middleware.authentication import AuthenticationMiddleware
 from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
-from starlette.responses import JSONResponse, Response
+from starlette.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
 from starlette.routing import Mount, Route
 from starlette.staticfiles import StaticFiles
 from starlette.types import ASGIApp
 from starlette_context import plugins
 from starlette_context.middleware import RawContextMiddleware
 
+from . import domain as d
 from .graphql import main as graphql
+from .graphql.types import CodesRequestDto, SearchCodesRequestDto
 from .log import time_me
+from .metrics import metrics as metrics_registry
 from .middleware import AuthBackend, DBSessionMiddleware
-from .types import sessionmaker
+from .types import Session, sessionmaker
 
 
 def http_exception(request: Request, exc: Exception) -> Response:
@@ -52,6 +64,120 @@ def status(version_suffix: str | None) -> Callable:
     return status_
 
 
+async def readiness(request: Request) -> Response:
+    """
+    Readiness probe: Reports whether this worker can serve requests,
+    i.e. whether the code cache is warmed up. Orchestrators should only
+    route traffic to workers that answer with 200.
+    """
+    session: Session = request.scope["db_session"]
+
+    if not session.code_repository.is_ready():
+        return JSONResponse({"status": "warming up"}, status_code=503)
+
+    return JSONResponse({"status": "ready"})
+
+
+async def metrics(_: Request) -> Response:
+    """
+    Serves the metrics of this worker (e.g. cache hit rates and
+    latencies) in the Prometheus text format.
+
+    Like the probes it does not require authentication, so it can be
+    scraped without a user token. It only exposes aggregate figures.
+    """
+    return PlainTextResponse(
+        metrics_registry.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+# number of codes per chunk of a streamed response
+NDJSON_CHUNK_SIZE = 500
+
+
+def _ndjson(codes: Iterable[d.Code]) -> Iterator[bytes]:
+    """
+    Serializes codes as newline-delimited JSON (one object per line with
+    the fields of the code) in chunks of `NDJSON_CHUNK_SIZE` codes.
+    """
+    lines: list[str] = []
+    for code in codes:
+        lines.append(json.dumps(asdict(code), separators=(",", ":")))
+        if len(lines) >= NDJSON_CHUNK_SIZE:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+async def _parse_body(
+    request: Request,
+    dto: type[BaseModel],
+    prepare: Callable[[Any], Any] | None = None,
+) -> BaseModel:
+    """Validates the JSON body against `dto`, or responds with 400."""
+    try:
+        body = await request.json()
+        if prepare is not None:
+            body = prepare(body)
+        return dto.model_validate(body)
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+
+def _code_search_type_by_name(body: Any) -> Any:
+    """Accepts the code search type by its GraphQL name, e.g. "POSIX"."""
+    query = body.get("query") if isinstance(body, dict) else None
+    code = query.get("code") if isinstance(query, dict) else None
+    if isinstance(code, dict) and code.get("type") in d.CodeSearchParamType.__members__:
+        code["type"] = d.CodeSearchParamType[code["type"]]
+    return body
+
+
+@requires("authenticated")
+async def stream_codes(request: Request) -> Response:
+    """
+    Streams the codes with the given ids (body: `{"ids": [...]}`) as
+    newline-delimited JSON. Unknown ids are skipped.
+    """
+    session: Session = request.scope["db_session"]
+    dto = cast(CodesRequestDto, await _parse_body(request, CodesRequestDto))
+
+    return StreamingResponse(
+        _ndjson(session.code_repository.iter_all(dto.ids)),
+        media_type="application/x-ndjson",
+    )
+
+
+@requires("authenticated")
+async def stream_search_codes(request: Request) -> Response:
+    """
+    Streams the results of a code search as newline-delimited JSON,
+    ordered by id. The body has the arguments of the `searchCodes` query,
+    e.g. `{"ontology_id": "ICD-10-CM", "query": {"code": {"value": "E1.*",
+    "type": "POSIX"}, "description": "diabetes"}}`.
+    """
+    session: Session = request.scope["db_session"]
+    dto = cast(
+        SearchCodesRequestDto,
+        await _parse_body(request, SearchCodesRequestDto, _code_search_type_by_name),
+    )
+
+    codes: Iterable[d.Code] = session.code_repository.iter_search_codes(
+        dto.query, dto.ontology_id
+    )
+    if dto.query.fuzzy is not None:
+        # bounded by the limit of the fuzzy search, and read before the
+        # response starts, so that an unsupported search fails with 400
+        try:
+            codes = await run_in_threadpool(list, codes)
+        except d.FuzzySearchNotSupportedException as e:
+            raise HTTPException(status_code=400, detail=repr(e)) from e
+
+    return StreamingResponse(_ndjson(codes), media_type="application/x-ndjson")
+
+
 class SecureGraphQLHTTPHandler(GraphQLHTTPHandler):
     """
     GQLHTTPHandler changes the ariadne GraphQLHTTPHandler class such
@@ -143,6 +269,10 @@ def create_app(
         },
         routes=[
             Route("/", status(config["versionSuffix"].get(None))),
+            Route("/ready", readiness),
+            Route("/metrics", metrics),
+            Route("/stream/codes", stream_codes, methods=["POST"]),
+            Route("/stream/codes/search", stream_search_codes, methods=["POST"]),
             Mount(
                 "/graphql",
                 GraphQL(
@@ -1,4 +1,4 @@
-from typing import TYPE_CHECKING, Any, ContextManager, Optional, Protocol
+from typing import TYPE_CHECKING, Any, ContextManager, Iterator, Optional, Protocol
 
 import medconb.domain as d
 
@@ -103,10 +103,84 @@ class CodeRepository(Protocol):  # pragma: no cover
         self, codes: list[str], ontology_id: str | None = None
     ) -> dict[str, int | None]: ...
 
+    def find_codes_by_ontology(
+        self, codes: dict[str, list[str]]
+    ) -> dict[str, dict[str, int | None]]:
+        """
+        Resolves the codes of several ontologies at once. `codes` maps
+        an ontology id to the codes to look up within that ontology.
+        """
+
+    def get_subtree_ids(self, code_ids: list[int]) -> list[int]:
+        """
+        Returns the ids of the codes in the subtrees of `code_ids`
+        (including themselves) ordered by id, i.e. depth-first. Unknown
+        ids are skipped.
+        """
+
     def search_codes(
         self, query_data: d.QueryData, ontology_id: str
     ) -> list[d.Code]: ...
 
+    def search_codes_paged(
+        self,
+        query_data: d.QueryData,
+        ontology_id: str,
+        page_size: int = 100,
+        start_cursor: int | None = None,
+    ) -> tuple[list[d.Code], int]:
+        """
+        Returns a page of the codes matching the search, ranked by
+        relevance (exact code matches first, then whole-word description
+        matches, then the rest, each ordered by id), and the (estimated)
+        total number of matches.
+
+        `start_cursor` is the id of the last code of the previous page.
+        """
+
+    def search_codes_by_ontology(
+        self, query_data: d.QueryData, ontology_ids: list[str], page_size: int = 100
+    ) -> dict[str, tuple[list[d.Code], int]]:
+        """
+        Runs `search_codes_paged` (first page) for each ontology
+        concurrently and returns the results by ontology id.
+        """
+
+    def iter_all(self, code_ids: list[int]) -> Iterator[d.Code]:
+        """Like get_all, but reads and yields the codes in batches."""
+
+    def iter_search_codes(
+        self, query_data: d.QueryData, ontology_id: str
+    ) -> Iterator[d.Code]:
+        """
+        Like search_codes, but yields the codes while they are read (e.g.
+        from a server-side cursor) instead of loading all of them.
+        """
+
+    def is_ready(self) -> bool:
+        """Returns whether the repository can serve requests."""
+
+
+class AsyncCodeRepository(Protocol):  # pragma: no cover
+    """asyncio variant of the lookups of CodeRepository"""
+
+    async def get(self, code_id: int) -> Optional[d.Code]: ...
+
+    async def get_all(self, code_ids: list[int]) -> list[d.Code]: ...
+
+    async def get_subtree_ids(self, code_ids: list[int]) -> list[int]: ...
+
+    async def find_codes(
+        self, codes: list[str], ontology_id: str | None = None
+    ) -> dict[str, int | None]: ...
+
+    async def find_codes_by_ontology(
+        self, codes: dict[str, list[str]]
+    ) -> dict[str, dict[str, int | None]]: ...
+
+    def caches_codes(self) -> bool:
+        """Returns whether fetched codes are kept in an in-process cache."""
+
 
 class Session(ContextManager, Protocol):  # pragma: no cover
     @property
@@ -127,6 +201,9 @@ class Session(ContextManager, Protocol):  # pragma: no cover
     @property
     def code_repository(self) -> CodeRepository: ...
 
+    @property
+    def async_code_repository(self) -> AsyncCodeRepository: ...
+
     @property
     def property_repository(self) -> PropertyRepository: ...
 
@@ -0,0 +1,9 @@
+BEGIN;
+
+
+ALTER TABLE "codelist"
+    DROP COLUMN "head_codesets",
+    DROP COLUMN "head_version";
+
+
+COMMIT;
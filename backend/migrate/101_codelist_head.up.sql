@@ -0,0 +1,74 @@
+BEGIN;
+
+
+-- materialized codesets of the head version of a codelist, as a list of
+-- [ontology_id, code_ids] pairs, so reads do not replay the commits. The
+-- defaults are the head of a codelist without commits.
+ALTER TABLE "codelist"
+    ADD COLUMN "head_codesets" jsonb NOT NULL DEFAULT '[]',
+    ADD COLUMN "head_version" integer NOT NULL DEFAULT 1;
+
+
+-- A code is part of the head if the last commit that touched it added
+-- it. Within a commit, additions are applied before removals.
+--
+-- The codesets are ordered as Codelist.codesets replays them: a codeset
+-- is appended when its ontology is first touched and dropped when it
+-- becomes empty, so it is positioned by the last commit that touched it
+-- while it was empty (ties in the order of the changesets, i.e. by
+-- ontology). Each committed addition or removal changes the codeset
+-- (adding an existing or removing a missing code is rejected), so its
+-- size after a commit is the running sum of +1 per addition and -1 per
+-- removal. helper/verify_codelist_heads.py compares the result with the
+-- replay.
+WITH op AS (
+    SELECT commit.codelist_id, commit.position, changeset.ontology_id, code_id, true AS added
+      FROM commit
+      JOIN changeset ON changeset.commit_id = commit.id
+     CROSS JOIN unnest(changeset.code_ids_added) AS code_id
+     WHERE commit.codelist_id IS NOT NULL
+    UNION ALL
+    SELECT commit.codelist_id, commit.position, changeset.ontology_id, code_id, false AS added
+      FROM commit
+      JOIN changeset ON changeset.commit_id = commit.id
+     CROSS JOIN unnest(changeset.code_ids_removed) AS code_id
+     WHERE commit.codelist_id IS NOT NULL
+), touch AS (
+    SELECT codelist_id, ontology_id, position,
+           sum(CASE WHEN added THEN 1 ELSE -1 END) AS delta,
+           sum(sum(CASE WHEN added THEN 1 ELSE -1 END)) OVER (
+               PARTITION BY codelist_id, ontology_id ORDER BY position
+           ) AS size
+      FROM op
+     GROUP BY codelist_id, ontology_id, position
+), codeset_start AS (
+    SELECT DISTINCT ON (codelist_id, ontology_id) codelist_id, ontology_id, position
+      FROM touch
+     WHERE size - delta = 0
+     ORDER BY codelist_id, ontology_id, position DESC
+), last_op AS (
+    SELECT DISTINCT ON (codelist_id, ontology_id, code_id) *
+      FROM op
+     ORDER BY codelist_id, ontology_id, code_id, position DESC, added ASC
+), codeset AS (
+    SELECT last_op.codelist_id, last_op.ontology_id, codeset_start.position,
+           array_agg(last_op.code_id ORDER BY last_op.code_id) AS code_ids
+      FROM last_op
+      JOIN codeset_start USING (codelist_id, ontology_id)
+     WHERE last_op.added
+     GROUP BY last_op.codelist_id, last_op.ontology_id, codeset_start.position
+)
+UPDATE "codelist"
+   SET "head_codesets" = COALESCE(
+           (SELECT jsonb_agg(
+                       jsonb_build_array(codeset.ontology_id, codeset.code_ids)
+                       ORDER BY codeset.position, codeset.ontology_id
+                   )
+              FROM codeset
+             WHERE codeset.codelist_id = codelist.id),
+           '[]'::jsonb
+       ),
+       "head_version" = (SELECT count(*) + 1 FROM commit WHERE commit.codelist_id = codelist.id);
+
+
+COMMIT;
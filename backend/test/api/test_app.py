@@ -1,3 +1,4 @@
+import json
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
@@ -8,3 +9,84 @@ def test_status(client: "TestClient"):
     response = client.get("/")
     body = response.json()
     assert body["status"] == "ok"
+
+
+def test_readiness(client: "TestClient"):
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+
+
+def test_metrics(client: "TestClient"):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+
+def test_stream_codes(client: "TestClient"):
+    response = client.post(
+        "/stream/codes",
+        headers={"Authorization": "Bearer FOOBAR"},
+        json={"ids": [-1, 23341, 23344, 23345]},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    codes = [json.loads(line) for line in response.text.splitlines()]
+    assert {(c["id"], c["code"]) for c in codes} == {
+        (23341, "A04.7"),
+        (23344, "A04.8"),
+        (23345, "A04.9"),
+    }
+
+
+def test_stream_search_codes(client: "TestClient"):
+    response = client.post(
+        "/stream/codes/search",
+        headers={"Authorization": "Bearer FOOBAR"},
+        json={
+            "ontology_id": "ICD-10-CM",
+            "query": {
+                "code": {"value": "Z.*", "type": "POSIX"},
+                "description": "alcohol abu",
+            },
+        },
+    )
+
+    assert response.status_code == 200
+    ids = [json.loads(line)["id"] for line in response.text.splitlines()]
+    assert ids == [118404, 118405, 118563]
+
+
+def test_stream_search_codes_invalid(client: "TestClient"):
+    response = client.post(
+        "/stream/codes/search",
+        headers={"Authorization": "Bearer FOOBAR"},
+        json={"ontology_id": "ICD-10-CM", "query": {}},
+    )
+
+    assert response.status_code == 400
+
+
+def test_stream_fuzzy_search_codes_unsupported(client: "TestClient", monkeypatch):
+    from medconb.persistence.sqlalchemy.repositories import CodeRepository
+
+    monkeypatch.setattr(CodeRepository, "fuzzy_search_supported", False)
+
+    response = client.post(
+        "/stream/codes/search",
+        headers={"Authorization": "Bearer FOOBAR"},
+        json={
+            "ontology_id": "ICD-10-CM",
+            "query": {"description": "angena", "fuzzy": {}},
+        },
+    )
+
+    assert response.status_code == 400
+    assert "pg_trgm" in response.json()["detail"]
+
+
+def test_stream_codes_unauthenticated(client: "TestClient"):
+    response = client.post("/stream/codes", json={"ids": [23341]})
+
+    assert response.status_code == 403
@@ -0,0 +1,50 @@
+from medconb.metrics import Registry
+
+
+class TestRegistry:
+    def test_counters(self):
+        registry = Registry()
+        registry.inc("requests_total", op="get")
+        registry.inc("requests_total", 2, op="get")
+        registry.inc("requests_total", op="get_all")
+
+        assert registry.value("requests_total", op="get") == 3
+        assert registry.value("requests_total", op="find_codes") == 0
+        assert 'requests_total{op="get"} 3' in registry.render()
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry(buckets=(0.1, 1.0))
+        registry.observe("latency_seconds", 0.05)
+        registry.observe("latency_seconds", 0.5)
+        registry.observe("latency_seconds", 5)
+
+        lines = registry.render().splitlines()
+
+        assert "# TYPE latency_seconds histogram" in lines
+        assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+        assert 'latency_seconds_bucket{le="1.0"} 2' in lines
+        assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+        assert "latency_seconds_count 3" in lines
+        assert "latency_seconds_sum 5.55" in lines
+
+    def test_registered_values_are_read_on_render(self):
+        registry = Registry()
+        size = [1]
+        registry.register("cache_size", lambda: size[0])
+        size[0] = 5
+
+        lines = registry.render().splitlines()
+
+        assert "# TYPE cache_size gauge" in lines
+        assert "cache_size 5" in lines
+
+    def test_large_values_keep_their_precision(self):
+        registry = Registry()
+        registry.inc("bytes_total", 1234567890)
+        registry.inc("bytes_total", 1)
+        registry.observe("latency_seconds", 1234567.125)
+
+        lines = registry.render().splitlines()
+
+        assert "bytes_total 1234567891" in lines
+        assert "latency_seconds_sum 1234567.125" in lines
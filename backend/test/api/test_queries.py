@@ -163,6 +163,29 @@ def test_search_codes(client: "TestClient"):
     assert {c["id"] for c in res} == expected_ids
 
 
+def test_search_codes_paged(client: "TestClient"):
+    response = client.post(
+        url="/graphql/",
+        headers={"Authorization": "Bearer FOOBAR"},
+        json={
+            "query": """query {
+                searchCodesPaged(
+                    ontologyID: "ICD-10-CM",
+                    query:{code: {value: "Z.*", type: POSIX}, description:"alcohol abu"}
+                    pageSize: 2
+                ) { items { id } total }
+            }"""
+        },
+    )
+
+    expected_ids = {"118404", "118405", "118563"}
+
+    res = json.loads(response.text)["data"]["searchCodesPaged"]
+    assert res["total"] == 3
+    assert len(res["items"]) == 2
+    assert {c["id"] for c in res["items"]} <= expected_ids
+
+
 def test_collection(client: "TestClient"):
     response = client.post(
         url="/graphql/",
@@ -136,6 +136,71 @@ class TestSetOfCodeIds:
         assert cl == d.SetOfCodeIds([1, 3])
 
 
+class CountingSet(frozenset):
+    """A frozenset that counts how often it is iterated."""
+
+    iterations = 0
+
+    def __iter__(self):
+        CountingSet.iterations += 1
+        return super().__iter__()
+
+
+class TestDeltaSetOfCodeIds:
+    def test_set_semantics(self):
+        cs = d.DeltaSetOfCodeIds(frozenset(range(100)))
+        got = cs.apply(d.Changeset("ICD-10-CM", [100, 101], [0, 100]))
+
+        assert got == set(range(1, 102)) - {100}
+        assert len(got) == 100
+        assert 0 not in got and 101 in got
+        assert cs == set(range(100))
+
+    def test_apply_throws_when_exists(self):
+        cs = d.DeltaSetOfCodeIds(frozenset(range(100)))
+
+        with pytest.raises(ValueError):
+            cs.apply(d.Changeset("ICD-10-CM", [1]))
+
+    def test_apply_throws_when_not_exists(self):
+        cs = d.DeltaSetOfCodeIds(frozenset(range(100)))
+        cs = cs.apply(d.Changeset("ICD-10-CM", [], [1]))
+
+        with pytest.raises(ValueError):
+            cs.apply(d.Changeset("ICD-10-CM", [], [1]))
+
+    def test_compacts(self):
+        cs = d.DeltaSetOfCodeIds(frozenset(range(4)))
+        got = cs.apply(d.Changeset("ICD-10-CM", [4, 5]))
+
+        assert got._base == {0, 1, 2, 3, 4, 5}
+        assert not got._added and not got._removed
+
+    @pytest.mark.parametrize("size", [1_000, 100_000])
+    def test_cost_per_commit_independent_of_size(self, size):
+        """
+        Small commits on a codelist only copy their changes, independent
+        of the number of codes the codelist has.
+        """
+        base = CountingSet(range(size))
+        version = d.Codesets(
+            [d.Codeset("ICD-10-CM", d.DeltaSetOfCodeIds(base))], version=1
+        )
+        CountingSet.iterations = 0
+
+        for i in range(100):
+            commit = d.Commit(
+                [d.Changeset("ICD-10-CM", [size + i], [i])], 1, datetime.now(), "c"
+            )
+            version = version + commit
+
+        code_ids = version[0].code_ids
+        assert CountingSet.iterations == 0
+        assert code_ids._base is base
+        assert len(code_ids._added) == len(code_ids._removed) == 100
+        assert len(code_ids) == size
+
+
 class TestVersion:
     def test_add_is_immutable(self):
         version = d.Codesets(
@@ -159,6 +224,37 @@ class TestVersion:
         assert id(got[0]) != id(version[0])
         assert id(got[0].code_ids) != id(version[0].code_ids)
 
+    def test_add_shares_unchanged_codesets(self):
+        version = d.Codesets(
+            [
+                d.Codeset(ontology_id="ICD-10-CM", code_ids=d.SetOfCodeIds([1])),
+                d.Codeset(ontology_id="ICD-9-CM", code_ids=d.SetOfCodeIds([2])),
+            ]
+        )
+        commit = d.Commit([d.Changeset("ICD-9-CM", [3])], 1, datetime.now(), "foo")
+
+        got = version + commit
+
+        assert got[0] is version[0]
+        assert got[1].code_ids == {2, 3}
+        assert version[1].code_ids == {2}
+
+    def test_add_changesets_of_same_ontology(self):
+        version = d.Codesets(
+            [d.Codeset(ontology_id="ICD-10-CM", code_ids=d.SetOfCodeIds([1]))]
+        )
+        commit = d.Commit(
+            [d.Changeset("ICD-10-CM", [2]), d.Changeset("ICD-10-CM", [3], [1])],
+            1,
+            datetime.now(),
+            "foo",
+        )
+
+        got = version + commit
+
+        assert got == [d.Codeset("ICD-10-CM", d.SetOfCodeIds([2, 3]))]
+        assert version[0].code_ids == {1}
+
     def test_all_changes_applied(self):
         # multiple test cases ...
         test_cases_versions = [
@@ -341,6 +437,160 @@ class TestAddCommit:
 
         assert codelist.transient_commit is None
 
+    def test_head_is_materialized(self):
+        codelist = d.Codelist(
+            id=42,
+            name="CL",
+            description="",
+            commits=[
+                d.Commit([d.Changeset("ICD-10-CM", [3, 1])], 1, datetime.now(), "1")
+            ],
+            transient_commit=None,
+            container=d.ContainerSpec(type_=d.ContainerType.Collection, id=1),
+        )
+        assert codelist.serialize_head() == [("ICD-10-CM", [1, 3])]
+        assert codelist._head_version == 2
+
+        codelist.add_commit(
+            d.Commit([d.Changeset("ICD-9-CM", [42], [])], 1, datetime.now(), "2")
+        )
+
+        assert codelist.serialize_head() == [
+            ("ICD-10-CM", [1, 3]),
+            ("ICD-9-CM", [42]),
+        ]
+        assert codelist._head_version == 3
+
+    def test_reads_head_without_replay(self):
+        codelist = d.Codelist(
+            id=42,
+            name="CL",
+            description="",
+            commits=[],
+            transient_commit=None,
+            container=d.ContainerSpec(type_=d.ContainerType.Collection, id=1),
+        )
+        # as loaded from the database, the commits are never touched
+        codelist._codesets = None
+        codelist._head_codesets = [["ICD-10-CM", [1, 3]]]
+        codelist._head_version = 5
+
+        assert codelist.version == 5
+        assert codelist.codesets == [d.Codeset("ICD-10-CM", d.SetOfCodeIds([1, 3]))]
+
+    def test_invalid_commit_keeps_head(self):
+        codelist = d.Codelist(
+            id=42,
+            name="CL",
+            description="",
+            commits=[],
+            transient_commit=None,
+            container=d.ContainerSpec(type_=d.ContainerType.Collection, id=1),
+        )
+
+        with pytest.raises(ValueError):
+            codelist.add_commit(
+                d.Commit([d.Changeset("ICD-10-CM", [], [1])], 1, datetime.now(), "1")
+            )
+
+        assert codelist.commits == []
+        assert codelist._head_version == 1
+
+
+class TestTransientCodesets:
+    @pytest.fixture
+    def codelist(self):
+        return d.Codelist(
+            id=42,
+            name="CL",
+            description="",
+            commits=[d.Commit([d.Changeset("ICD-10-CM", [1])], 1, datetime.now(), "1")],
+            transient_commit=d.Commit(
+                [d.Changeset("ICD-10-CM", [2])], 1, datetime.now(), "transient"
+            ),
+            container=d.ContainerSpec(type_=d.ContainerType.Collection, id=1),
+        )
+
+    def test_memoized(self, codelist):
+        got = codelist.transient_codesets
+
+        assert got[0].code_ids == {1, 2}
+        assert codelist.transient_codesets is got
+
+    def test_recomputed_on_new_transient_commit(self, codelist):
+        before = codelist.transient_codesets
+        codelist.transient_commit = d.Commit(
+            [d.Changeset("ICD-10-CM", [3])], 1, datetime.now(), "transient"
+        )
+
+        got = codelist.transient_codesets
+
+        assert got is not before
+        assert got[0].code_ids == {1, 3}
+
+    def test_recomputed_on_commit(self, codelist):
+        transient_commit = codelist.transient_commit
+        before = codelist.transient_codesets
+        codelist.add_commit(
+            d.Commit([d.Changeset("ICD-10-CM", [4])], 1, datetime.now(), "2")
+        )
+        codelist.transient_commit = transient_commit
+
+        got = codelist.transient_codesets
+
+        assert got is not before
+        assert got[0].code_ids == {1, 2, 4}
+
+
+class TestCodesetsOfVersion:
+    @pytest.fixture
+    def codelist(self):
+        return d.Codelist(
+            id=42,
+            name="CL",
+            description="",
+            commits=[
+                d.Commit([d.Changeset("ICD-10-CM", [1, 2])], 1, datetime.now(), "1"),
+                d.Commit([d.Changeset("ICD-10-CM", [3], [1])], 1, datetime.now(), "2"),
+            ],
+            transient_commit=None,
+            container=d.ContainerSpec(type_=d.ContainerType.Collection, id=1),
+        )
+
+    def test_version_counts_commits(self, codelist):
+        assert codelist.version == 3
+
+    def test_former_versions(self, codelist):
+        assert codelist.codesets_of_version(1) == []
+        assert codelist.codesets_of_version(2)[0].code_ids == {1, 2}
+        assert codelist.codesets_of_version(3) is codelist.codesets
+
+    @pytest.mark.parametrize("version", [0, 4])
+    def test_unknown_version(self, codelist, version):
+        with pytest.raises(ValueError):
+            codelist.codesets_of_version(version)
+
+
+class TestCountSelectedDescendants:
+    def test_counts(self):
+        codesets = d.Codesets(
+            [
+                d.Codeset("ICD-10-CM", d.SetOfCodeIds([2, 3, 5])),
+                d.Codeset("ICD-9-CM", d.SetOfCodeIds([20])),
+            ]
+        )
+        codes = [
+            d.Code(1, "", "ICD-10-CM", "", [1], [2, 4], 5),
+            d.Code(2, "", "ICD-10-CM", "", [1, 2], [3], 3),
+            d.Code(4, "", "ICD-10-CM", "", [1, 4], [5], 5),
+            d.Code(6, "", "ICD-10-CM", "", [6], [], 6),
+            d.Code(20, "", "ICD-9-CM", "", [20], [], 20),
+        ]
+
+        got = d.count_selected_descendants(codesets, codes)
+
+        assert got == [(False, 3), (True, 1), (False, 1), (False, 0), (True, 0)]
+
 
 def test_author_from_user():
     a = d.Author.from_user(d.User(id=42, external_id="ABC", name="DEF", workspace=None))
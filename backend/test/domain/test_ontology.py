@@ -1,4 +1,7 @@
+import pytest
+
 import medconb.domain as d
+from medconb.domain.ontology import CODE_FORMAT_VERSION
 
 
 class TestCodeParentId:
@@ -14,3 +17,46 @@ class TestCodeParentId:
 def test_ontology_name_is_id():
     ontology = d.Ontology("ICD-9", [])
     assert ontology.name == ontology.id
+
+
+class TestCodeSerialization:
+    def test_roundtrip(self):
+        code = d.Code(
+            43, "I20.0", "ICD-10-CM", "Unstable angína", [39, 43], [44, 45, 46], 46
+        )
+
+        data = code.serialize()
+
+        assert data[0] == CODE_FORMAT_VERSION
+        assert d.Code.deserialize(data) == code
+
+    def test_serialize_fields(self):
+        code = d.Code(43, "I20.0", "ICD-10-CM", "", [42, 43], [], 43)
+
+        data = d.Code.serialize_fields(43, "I20.0", "ICD-10-CM", "", [42, 43], [], 43)
+
+        assert data == code.serialize()
+
+    def test_reads_legacy_json(self):
+        code = d.Code(42, "I20", "ICD-10-CM", "Angina pectoris", [42], [43], 43)
+        data = (
+            '{"id":42,"code":"I20","ontology_id":"ICD-10-CM",'
+            '"description":"Angina pectoris","path":[42],"children_ids":[43],'
+            '"last_descendant_id":43}'
+        )
+
+        assert d.Code.deserialize(data) == code
+        assert d.Code.deserialize(data.encode()) == code
+
+    def test_unknown_format(self):
+        with pytest.raises(ValueError):
+            d.Code.deserialize(b"\xff")
+
+    def test_deserialize_many_skips_missing(self):
+        codes = [
+            d.Code(42, "I20", "ICD-10-CM", "", [42], [43], 43),
+            d.Code(43, "I20.0", "ICD-10-CM", "", [42, 43], [], 43),
+        ]
+        data = [codes[0].serialize(), None, codes[1].serialize()]
+
+        assert d.Code.deserialize_many(data) == codes
@@ -1,8 +1,20 @@
+import asyncio
 from unittest.mock import MagicMock, create_autospec
 
+import pytest
+from graphql import FieldNode, NameNode
+
 import medconb.domain as d
-from medconb.graphql.query import resolve_codes, resolve_ontology, resolve_parent
-from medconb.types import CodeRepository
+from medconb.graphql.query import (
+    resolve_ancestors,
+    resolve_codes,
+    resolve_descendants,
+    resolve_ontology,
+    resolve_paged_codes,
+    resolve_parent,
+)
+from medconb.graphql.types import SearchResultsResponseDto
+from medconb.types import AsyncCodeRepository, CodeRepository
 
 
 def test_resolve_ontology_on_codeset():
@@ -22,45 +34,182 @@ def test_resolve_ontology_on_codeset():
 
 def test_resolve_codes_via_repository():
     info = MagicMock()
-    repo = create_autospec(CodeRepository)
+    repo = create_autospec(AsyncCodeRepository)
     repo.get_all.return_value = []
 
-    info.context["any"].scope["any"].code_repository = repo
+    info.context["any"].scope["any"].async_code_repository = repo
     info.field_nodes = [MagicMock()]
     info.field_nodes[0].selection_set.selections = ["id", "name"]
 
     codeset = d.Codeset("ICD-9", [1, 2, 3])
 
-    got = resolve_codes(codeset, info)
+    got = asyncio.run(resolve_codes(codeset, info))
 
-    repo.get_all.assert_called_once_with(codeset.code_ids)
+    repo.get_all.assert_awaited_once_with(codeset.code_ids)
     assert got == repo.get_all.return_value
 
 
 def test_resolve_parent_via_repository():
     info = MagicMock()
-    repo = create_autospec(CodeRepository)
+    repo = create_autospec(AsyncCodeRepository)
     repo.get.return_value = ["FOO", "BAR"]
 
-    info.context["any"].scope["any"].code_repository = repo
+    info.context["any"].scope["any"].async_code_repository = repo
 
     code = d.Code(42, "", "", "", [40, 41, 42], [], 42)
 
-    got = resolve_parent(code, info)
+    got = asyncio.run(resolve_parent(code, info))
 
-    repo.get.assert_called_once_with(code.parent_id)
+    repo.get.assert_awaited_once_with(code.parent_id)
     assert got == repo.get.return_value
 
 
 def test_resolve_parent_when_root():
     info = MagicMock()
-    repo = create_autospec(CodeRepository)
+    repo = create_autospec(AsyncCodeRepository)
 
-    info.context["any"].scope["any"].code_repository = repo
+    info.context["any"].scope["any"].async_code_repository = repo
 
     code = d.Code(42, "", "", "", [42], [], 42)
 
-    got = resolve_parent(code, info)
+    got = asyncio.run(resolve_parent(code, info))
 
-    repo.get.assert_not_called()
+    repo.get.assert_not_awaited()
     assert got is None
+
+
+def test_resolve_ancestors_in_one_batch():
+    info = MagicMock()
+    repo = create_autospec(AsyncCodeRepository)
+    repo.get_all.return_value = [
+        d.Code(6, "", "", "", [1, 6], [7], 7),
+        d.Code(1, "", "", "", [1], [2, 6], 7),
+    ]
+
+    info.context["any"].scope["any"].async_code_repository = repo
+    info.field_nodes = [MagicMock()]
+    info.field_nodes[0].selection_set.selections = ["id", "code"]
+
+    results = SearchResultsResponseDto(
+        items=[
+            d.Code(5, "", "", "", [1, 2, 5], [], 5),
+            d.Code(2, "", "", "", [1, 2], [5], 5),
+            d.Code(7, "", "", "", [1, 6, 7], [], 7),
+        ],
+        total=3,
+    )
+
+    got = asyncio.run(resolve_ancestors(results, info))
+
+    repo.get_all.assert_awaited_once_with([1, 6])
+    assert [c.id for c in got] == [1, 6]
+
+
+def test_resolve_descendants_paged():
+    info = MagicMock()
+    repo = create_autospec(AsyncCodeRepository)
+    repo.get_subtree_ids.return_value = [1, 2, 3, 4, 5]
+    repo.get_all.return_value = []
+
+    info.context["any"].scope["any"].async_code_repository = repo
+    info.field_nodes = [MagicMock()]
+    info.field_nodes[0].selection_set.selections = ["id", "code"]
+
+    code = d.Code(1, "", "", "", [1], [2, 4], 5)
+
+    got = asyncio.run(resolve_descendants(code, info, page_size=2, start_cursor=3))
+
+    repo.get_subtree_ids.assert_awaited_once_with([1])
+    repo.get_all.assert_awaited_once_with([4, 5])
+    assert got == repo.get_all.return_value
+
+
+@pytest.mark.parametrize("start_cursor", [1, 6, 42])
+def test_resolve_descendants_rejects_foreign_cursor(start_cursor):
+    info = MagicMock()
+    repo = create_autospec(AsyncCodeRepository)
+    repo.get_subtree_ids.return_value = [1, 2, 3, 4, 5]
+
+    info.context["any"].scope["any"].async_code_repository = repo
+    info.field_nodes = [MagicMock()]
+    info.field_nodes[0].selection_set.selections = ["id", "code"]
+
+    code = d.Code(1, "", "", "", [1], [2, 4], 5)
+
+    with pytest.raises(ValueError):
+        asyncio.run(
+            resolve_descendants(code, info, page_size=2, start_cursor=start_cursor)
+        )
+
+    repo.get_all.assert_not_awaited()
+
+
+def test_resolve_descendants_ids_only():
+    info = MagicMock()
+    repo = create_autospec(AsyncCodeRepository)
+    repo.get_subtree_ids.return_value = [1, 2, 3]
+
+    info.context["any"].scope["any"].async_code_repository = repo
+    info.field_nodes = [MagicMock()]
+    info.field_nodes[0].selection_set.selections = [
+        FieldNode(name=NameNode(value="id"))
+    ]
+
+    code = d.Code(1, "", "", "", [1], [2, 3], 3)
+
+    got = asyncio.run(resolve_descendants(code, info, page_size=-1))
+
+    repo.get_all.assert_not_awaited()
+    assert got == [{"id": 2}, {"id": 3}]
+
+
+def test_resolve_children_prefetches_next_page():
+    info = MagicMock()
+    repo = create_autospec(AsyncCodeRepository)
+    repo.caches_codes.return_value = True
+    repo.get_all.return_value = [d.Code(i, "", "", "", [1, i], [], i) for i in [5, 7]]
+
+    info.context["any"].scope["any"].async_code_repository = repo
+    info.field_nodes = [MagicMock()]
+    info.field_nodes[0].selection_set.selections = ["id", "code"]
+
+    code = d.Code(1, "", "", "", [1], [2, 3, 5, 7, 9], 9)
+
+    got = asyncio.run(resolve_paged_codes(code, info, page_size=1, start_cursor=3))
+
+    repo.get_all.assert_awaited_once_with([5, 7])
+    assert [c.id for c in got] == [5]
+
+
+def test_resolve_children_without_code_cache():
+    info = MagicMock()
+    repo = create_autospec(AsyncCodeRepository)
+    repo.caches_codes.return_value = False
+    repo.get_all.return_value = [d.Code(5, "", "", "", [1, 5], [], 5)]
+
+    info.context["any"].scope["any"].async_code_repository = repo
+    info.field_nodes = [MagicMock()]
+    info.field_nodes[0].selection_set.selections = ["id", "code"]
+
+    code = d.Code(1, "", "", "", [1], [2, 3, 5, 7, 9], 9)
+
+    got = asyncio.run(resolve_paged_codes(code, info, page_size=1, start_cursor=3))
+
+    repo.get_all.assert_awaited_once_with([5])
+    assert [c.id for c in got] == [5]
+
+
+def test_resolve_children_rejects_foreign_cursor():
+    info = MagicMock()
+    repo = create_autospec(AsyncCodeRepository)
+
+    info.context["any"].scope["any"].async_code_repository = repo
+    info.field_nodes = [MagicMock()]
+    info.field_nodes[0].selection_set.selections = ["id", "code"]
+
+    code = d.Code(1, "", "", "", [1], [2, 3, 5], 5)
+
+    with pytest.raises(ValueError):
+        asyncio.run(resolve_paged_codes(code, info, page_size=1, start_cursor=4))
+
+    repo.get_all.assert_not_awaited()
@@ -201,3 +201,24 @@ class MockSession:
                 if code.code in codes:
                     res[code.code] = code.id
             return res
+
+        def find_codes_by_ontology(
+            self, codes: dict[str, list[str]]
+        ) -> dict[str, dict[str, int | None]]:
+            return {o: self.find_codes(codes_, o) for o, codes_ in codes.items()}
+
+        def search_codes_by_ontology(
+            self, query_data: d.QueryData, ontology_ids: list[str], page_size: int = 100
+        ) -> dict[str, tuple[list[d.Code], int]]:
+            # only the description is supported (as substring)
+            assert query_data.description
+            res = {}
+            for ontology_id in ontology_ids:
+                codes = [
+                    c
+                    for c in self.get_all()
+                    if c.ontology_id == ontology_id
+                    and query_data.description.lower() in c.description.lower()
+                ]
+                res[ontology_id] = codes[:page_size], len(codes)
+            return res
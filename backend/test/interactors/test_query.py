@@ -1,8 +1,19 @@
+from datetime import datetime
+
 import pytest
 
 import medconb.domain as d
 import medconb.graphql.types as gql
-from medconb.interactors import Codelist, Collection, CollectionNotExistsException
+from medconb.interactors import (
+    Codelist,
+    CodelistDescendantCounts,
+    CodelistNotExistsException,
+    Collection,
+    CollectionNotExistsException,
+    FuzzySearchNotAvailableException,
+    SearchCodesByOntology,
+    SearchCodesPaged,
+)
 
 from ..helper import _c_id, _cl_id, _cl_ids, _u_id
 from .helper import MockSession, create_Codelist, create_Collection
@@ -101,3 +112,113 @@ class TestCodelist:
         got = i8r(dto)
 
         assert got.id == dto.codelist_id
+
+
+class TestCodelistDescendantCounts:
+    @pytest.fixture
+    def session(self, session: MockSession):
+        session.add(d.Code(1, "E11", "ICD-10-CM", "", [1], [2, 3], 3))
+        session.add(d.Code(2, "E11.8", "ICD-10-CM", "", [1, 2], [], 2))
+        session.add(d.Code(3, "E11.9", "ICD-10-CM", "", [1, 3], [], 3))
+
+        codelist: d.Codelist = session.get(d.Codelist, _cl_id(1))
+        codelist.add_commit(
+            d.Commit([d.Changeset("ICD-10-CM", [2])], _u_id(1), datetime.now(), "1")
+        )
+        codelist.add_commit(
+            d.Commit([d.Changeset("ICD-10-CM", [3])], _u_id(1), datetime.now(), "2")
+        )
+        codelist.transient_commit = d.Commit(
+            [d.Changeset("ICD-10-CM", [1])], _u_id(1), datetime.now(), "transient"
+        )
+        return session
+
+    @pytest.mark.parametrize(
+        "version, transient, want",
+        [
+            (None, False, [(1, False, 2, 2), (3, True, 0, 0)]),
+            (2, False, [(1, False, 2, 1), (3, False, 0, 0)]),
+            (None, True, [(1, True, 2, 2), (3, True, 0, 0)]),
+        ],
+    )
+    def test_counts(self, session, user, version, transient, want):
+        dto = gql.CodelistDescendantCountsRequestDto(
+            codelist_id=_cl_id(1),
+            code_ids=[1, 3, 42],
+            version=version,
+            transient=transient,
+        )
+
+        got = CodelistDescendantCounts(session, user)(dto)
+
+        assert [
+            (
+                c.code_id,
+                c.selected,
+                c.number_of_descendants,
+                c.number_of_selected_descendants,
+            )
+            for c in got
+        ] == want
+
+    def test_unknown_codelist(self, session, user):
+        dto = gql.CodelistDescendantCountsRequestDto(
+            codelist_id=_cl_id(99), code_ids=[1]
+        )
+
+        with pytest.raises(CodelistNotExistsException):
+            CodelistDescendantCounts(session, user)(dto)
+
+
+class TestSearchCodesByOntology:
+    @pytest.fixture
+    def session(self, session: MockSession):
+        session.add(d.Ontology(id="ICD-9-CM", root_code_ids=[1]))
+        session.add(d.Ontology(id="ICD-10-CM", root_code_ids=[2]))
+        session.add(d.Code(1, "250", "ICD-9-CM", "Diabetes mellitus", [1], [], 1))
+        session.add(d.Code(2, "E11", "ICD-10-CM", "Type 2 diabetes", [2], [3], 3))
+        session.add(
+            d.Code(3, "E11.9", "ICD-10-CM", "Diabetes w/o compl.", [2, 3], [], 3)
+        )
+        return session
+
+    def test_all_ontologies(self, session: MockSession, user: d.User):
+        dto = gql.SearchCodesByOntologyRequestDto(
+            query=gql.QueryData(description="diabetes"), page_size=1
+        )
+
+        got = SearchCodesByOntology(session, user)(dto)
+
+        assert [(r.ontology_id, [c.id for c in r.items], r.total) for r in got] == [
+            ("ICD-9-CM", [1], 1),
+            ("ICD-10-CM", [2], 2),
+        ]
+
+    def test_given_ontologies(self, session: MockSession, user: d.User):
+        dto = gql.SearchCodesByOntologyRequestDto(
+            ontology_ids=["ICD-10-CM"], query=gql.QueryData(description="diabetes")
+        )
+
+        got = SearchCodesByOntology(session, user)(dto)
+
+        assert [(r.ontology_id, r.total) for r in got] == [("ICD-10-CM", 2)]
+
+
+class TestFuzzySearchNotSupported:
+    def test_rejected(self, session: MockSession, user: d.User, monkeypatch):
+        def search_codes_paged(*args, **kwargs):
+            raise d.FuzzySearchNotSupportedException()
+
+        monkeypatch.setattr(
+            MockSession.CodeRepository,
+            "search_codes_paged",
+            search_codes_paged,
+            raising=False,
+        )
+        dto = gql.SearchCodesPagedRequestDto(
+            ontology_id="ICD-10-CM",
+            query=gql.QueryData(description="angena", fuzzy=gql.FuzzySearchParam()),
+        )
+
+        with pytest.raises(FuzzySearchNotAvailableException):
+            SearchCodesPaged(session, user)(dto)
@@ -0,0 +1,311 @@
+import asyncio
+import threading
+from collections import namedtuple
+from unittest.mock import MagicMock, call, patch
+
+from sqlalchemy.exc import DBAPIError
+
+import medconb.domain as d
+import medconb.graphql.types as gql
+from medconb.persistence.sqlalchemy import cache
+from medconb.persistence.sqlalchemy.cache import (
+    CachedCodeRepository,
+    LRUCache,
+    _search_key,
+    _subtree_ids,
+    ontology_content_hash,
+    ontology_data_version,
+)
+
+Row = namedtuple(
+    "Row",
+    [
+        "id",
+        "code",
+        "ontology_id",
+        "description",
+        "path",
+        "children_ids",
+        "last_descendant_id",
+    ],
+)
+
+
+class TestLRUCache:
+    def test_evicts_least_recently_used(self):
+        cache: LRUCache[int, str] = LRUCache(maxsize=2)
+        cache.put(1, "a")
+        cache.put(2, "b")
+        cache.get(1)
+        cache.put(3, "c")
+
+        assert len(cache) == 2
+        assert cache.get(1) == "a"
+        assert cache.get(2) is None
+        assert cache.get(3) == "c"
+
+    def test_counts_hits_and_misses(self):
+        cache: LRUCache[int, str] = LRUCache(maxsize=10)
+        cache.put_many({1: "a", 2: "b"})
+
+        got = cache.get_many([1, 2, 3])
+
+        assert got == {1: "a", 2: "b"}
+        assert (cache.hits, cache.misses) == (2, 1)
+
+    def test_clear(self):
+        cache: LRUCache[int, str] = LRUCache(maxsize=10)
+        cache.put(1, "a")
+        cache.clear()
+
+        assert len(cache) == 0
+        assert cache.get(1) is None
+
+    def test_zero_size_disables_cache(self):
+        cache: LRUCache[int, str] = LRUCache(maxsize=0)
+        cache.put(1, "a")
+
+        assert cache.get(1) is None
+
+    def test_entries_expire_after_ttl(self):
+        cache: LRUCache[int, str] = LRUCache(maxsize=10, ttl=0)
+        cache.put(1, "a")
+
+        assert cache.get(1) is None
+        assert len(cache) == 0
+
+    def test_stats(self):
+        cache: LRUCache[int, str] = LRUCache(maxsize=10)
+        cache.put(1, "a")
+        cache.get_many([1, 1, 1, 2])
+
+        assert cache.stats() == {"size": 1, "hits": 3, "misses": 1, "hit_rate": 0.75}
+
+
+class TestSearchKey:
+    def test_ilike_is_case_insensitive(self):
+        a = gql.QueryData(
+            description="Diabetes", code=gql.CodeSearchParam(value="E11%")
+        )
+        b = gql.QueryData(
+            description="diabetes", code=gql.CodeSearchParam(value="e11%")
+        )
+
+        assert _search_key(a, "ICD-10-CM") == _search_key(b, "ICD-10-CM")
+        assert _search_key(a, "ICD-10-CM") != _search_key(a, "ICD-9-CM")
+        assert _search_key(a, "ICD-10-CM", "v1") != _search_key(a, "ICD-10-CM", "v2")
+
+    def test_posix_is_case_sensitive(self):
+        a = gql.QueryData(
+            code=gql.CodeSearchParam(value="^E11", type=d.CodeSearchParamType.POSIX)
+        )
+        b = gql.QueryData(
+            code=gql.CodeSearchParam(value="^e11", type=d.CodeSearchParamType.POSIX)
+        )
+        c = gql.QueryData(code=gql.CodeSearchParam(value="^E11"))
+
+        assert _search_key(a, "ICD-10-CM") != _search_key(b, "ICD-10-CM")
+        assert _search_key(a, "ICD-10-CM") != _search_key(c, "ICD-10-CM")
+
+    def test_fuzzy_is_part_of_the_key(self):
+        a = gql.QueryData(description="diabetis")
+        b = gql.QueryData(description="diabetis", fuzzy=gql.FuzzySearchParam())
+        c = gql.QueryData(
+            description="diabetis", fuzzy=gql.FuzzySearchParam(threshold=0.5)
+        )
+
+        assert _search_key(a, "ICD-10-CM") != _search_key(b, "ICD-10-CM")
+        assert _search_key(b, "ICD-10-CM") != _search_key(c, "ICD-10-CM")
+
+    def test_root_code_is_part_of_the_key(self):
+        a = gql.QueryData(description="unspecified")
+        b = gql.QueryData(description="unspecified", root_code_id=42)
+
+        assert _search_key(a, "ICD-10-CM") != _search_key(b, "ICD-10-CM")
+
+
+class TestSubtreeIds:
+    def test_intervals_of_the_roots(self):
+        roots = [
+            d.Code(10, "", "", "", [10], [11, 14], 15),
+            d.Code(2, "", "", "", [2], [], 2),
+        ]
+
+        assert _subtree_ids(roots) == [2, 10, 11, 12, 13, 14, 15]
+
+    def test_nested_roots(self):
+        roots = [
+            d.Code(11, "", "", "", [10, 11], [12], 12),
+            d.Code(10, "", "", "", [10], [11, 14], 15),
+            d.Code(14, "", "", "", [10, 14], [], 14),
+        ]
+
+        assert _subtree_ids(roots) == [10, 11, 12, 13, 14, 15]
+
+
+class TestWarmupCache:
+    @staticmethod
+    def repository(checkpoint=None):
+        client = MagicMock()
+        client.get.return_value = checkpoint
+        return CachedCodeRepository(MagicMock(), client), client
+
+    @staticmethod
+    def session(*batches):
+        session = MagicMock()
+        session.execute.return_value.partitions.return_value = batches
+        return session
+
+    def test_streams_rows_in_batches(self):
+        repository, client = self.repository()
+        rows = [
+            Row(1, "E11", "ICD-10-CM", "Type 2 diabetes", [1], [2], 2),
+            Row(2, "E11.9", "ICD-10-CM", "", [1, 2], [], 2),
+            Row(3, "250", "ICD-9-CM", "Diabetes", [3], [], 3),
+        ]
+
+        repository._warmup_cache(self.session(rows[:2], rows[2:]), "v1")
+
+        pipe = client.pipeline.return_value
+        assert pipe.mset.call_args_list == [
+            call(
+                {
+                    "v|v1|c|1": d.Code(*rows[0]).serialize(),
+                    "v|v1|c|2": d.Code(*rows[1]).serialize(),
+                }
+            ),
+            call({"v|v1|l|ICD-10-CM|e11": 1, "v|v1|l|ICD-10-CM|e11.9": 2}),
+            call({"v|v1|c|3": d.Code(*rows[2]).serialize()}),
+            call({"v|v1|l|ICD-9-CM|250": 3}),
+        ]
+        assert pipe.set.call_args_list == [
+            call("v|v1|checkpoint", 2),
+            call("v|v1|checkpoint", 3),
+        ]
+        client.delete.assert_called_once_with("v|v1|checkpoint")
+
+    def test_resumes_after_checkpoint(self):
+        repository, client = self.repository(checkpoint=b"2")
+        session = self.session([Row(3, "250", "ICD-9-CM", "", [3], [], 3)])
+
+        repository._warmup_cache(session, "v1")
+
+        stmt = session.execute.call_args.args[0]
+        assert "code.id > 2" in str(
+            stmt.compile(compile_kwargs={"literal_binds": True})
+        )
+        client.get.assert_called_once_with("v|v1|checkpoint")
+
+
+class TestWarmup:
+    def test_retries_after_failure(self):
+        client = MagicMock()
+        client.get.return_value = b"v1"
+        repository = CachedCodeRepository(MagicMock(), client)
+        repository.WARMUP_POLL_INTERVAL = 0
+
+        with patch.object(
+            repository, "_data_version", side_effect=[RuntimeError("down"), "v1"]
+        ):
+            asyncio.run(repository._warmup())
+
+        assert repository._is_warm
+        client.lock.return_value.acquire.assert_not_called()
+
+
+class TestOntologyDataVersion:
+    def test_uses_stamp(self):
+        session = MagicMock()
+        session.scalar.side_effect = ["a", "a", "b"]
+
+        got = [ontology_data_version(session, 1) for _ in range(3)]
+
+        assert got[0] == got[1]
+        assert got[0] != got[2]
+        assert got[0] != ontology_data_version(MagicMock(scalar=lambda _: "a"), 2)
+        session.execute.assert_not_called()
+
+    def test_content_hash(self):
+        session = MagicMock()
+        session.execute.side_effect = [
+            [(1, "E11", "ICD-10-CM", "", [1], [], 1)],
+            [("ICD-10-CM", [1])],
+            [(1, "E11", "ICD-10-CM", "Diabetes", [1], [], 1)],
+            [("ICD-10-CM", [1])],
+        ]
+
+        assert ontology_content_hash(session) != ontology_content_hash(session)
+
+    @patch(f"{cache.__name__}.ontology_content_hash", return_value="h")
+    def test_stamps_unstamped_data(self, content_hash):
+        session = MagicMock()
+        session.scalar.return_value = None
+
+        got = ontology_data_version(session)
+
+        assert got == ontology_data_version(MagicMock(scalar=lambda _: "h"))
+        content_hash.assert_called_once_with(session)
+        insert = session.execute.call_args_list[-1].args[0]
+        assert insert.compile().params == {"key": "data_version", "value": "h"}
+        session.commit.assert_called_once()
+
+    @patch(f"{cache.__name__}.ontology_content_hash", return_value="h")
+    def test_stamped_by_another_process(self, content_hash):
+        session = MagicMock()
+        # stamped while waiting for the lock
+        session.scalar.side_effect = [None, "a"]
+
+        got = ontology_data_version(session)
+
+        assert got == ontology_data_version(MagicMock(scalar=lambda _: "a"))
+        content_hash.assert_not_called()
+
+    @patch(f"{cache.__name__}.ontology_content_hash", return_value="h")
+    def test_hashes_if_stamp_cannot_be_written(self, content_hash):
+        session = MagicMock()
+        session.scalar.return_value = None
+        session.execute.side_effect = DBAPIError(
+            "SELECT pg_advisory_xact_lock", {}, Exception()
+        )
+
+        got = ontology_data_version(session)
+
+        assert got == ontology_data_version(MagicMock(scalar=lambda _: "h"))
+        session.rollback.assert_called_once()
+        session.commit.assert_not_called()
+
+
+class TestBuildSearchIndex:
+    @staticmethod
+    def repository(version):
+        repository = CachedCodeRepository(MagicMock(), MagicMock())
+        repository._version = version
+        return repository
+
+    def test_waits_for_running_build(self):
+        repository = self.repository("v2")
+
+        with repository._search_index_lock:
+            build = threading.Thread(
+                target=repository._build_search_index, args=("v2",)
+            )
+            build.start()
+        build.join()
+
+        assert repository._search_index[0] == "v2"
+
+    def test_skips_inactive_version(self):
+        repository = self.repository("v2")
+
+        repository._build_search_index("v1")
+
+        assert repository._search_index is None
+
+    def test_skips_built_version(self):
+        repository = self.repository("v2")
+        repository._build_search_index("v2")
+        index = repository._search_index
+
+        repository._build_search_index("v2")
+
+        assert repository._search_index is index
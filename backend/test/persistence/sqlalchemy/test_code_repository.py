@@ -1,12 +1,21 @@
 import json
 from collections import namedtuple
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
 
 from medconb import domain as d
-from medconb.graphql.types import CodeSearchParam
+from medconb.graphql.types import CodeSearchParam, FuzzySearchParam
+from medconb.persistence.sqlalchemy import ontology_orm as t_o
+from medconb.persistence.sqlalchemy.repositories import CodeRepository
 from medconb.types import Session
 
 # not using gql type to get around validation and use invalid values
-QueryData = namedtuple("QueryData", "code description")
+QueryData = namedtuple(
+    "QueryData", "code description fuzzy root_code_id", defaults=[None, None]
+)
 
 
 class TestSearchCodes:
@@ -164,3 +173,218 @@ class TestSearchCodes:
         for test in tests:
             got = session.code_repository.search_codes(**test["params"])
             assert [c.id for c in got] == test["want"]
+
+
+class TestSearchCodesPaged:
+    def test_pages_cover_all_results(self, session: Session):
+        query_data = QueryData(code=None, description="alcohol abuse")
+        want = session.code_repository.search_codes(query_data, "ICD-10-CM")
+
+        got: list[d.Code] = []
+        cursor = None
+        while True:
+            page, total = session.code_repository.search_codes_paged(
+                query_data, "ICD-10-CM", page_size=10, start_cursor=cursor
+            )
+            assert total == len(want)
+            if not page:
+                break
+            assert len(page) <= 10
+            got.extend(page)
+            cursor = page[-1].id
+
+        assert sorted(c.id for c in got) == [c.id for c in want]
+
+    def test_exact_code_first(self, session: Session):
+        query_data = QueryData(code=CodeSearchParam(value="%F10.1%"), description=None)
+
+        page, total = session.code_repository.search_codes_paged(
+            query_data, "ICD-10-CM", page_size=1
+        )
+
+        assert total > 1
+        assert [c.code for c in page] == ["F10.1"]
+
+    def test_empty_filters(self, session: Session):
+        query_data = QueryData(code=None, description=None)
+
+        assert session.code_repository.search_codes_paged(query_data, "ICD-10-CM") == (
+            [],
+            0,
+        )
+
+    def test_no_results(self, session: Session):
+        # the estimate is run on the ontology database as well
+        query_data = QueryData(code=None, description="no code describes this")
+
+        assert session.code_repository.search_codes_paged(query_data, "ICD-10-CM") == (
+            [],
+            0,
+        )
+
+
+class TestFuzzySearchCodes:
+    def test_misspelled(self, session: Session):
+        query_data = QueryData(
+            code=None,
+            description="atherosclerosys",
+            fuzzy=FuzzySearchParam(threshold=0.5, limit=10),
+        )
+
+        got = session.code_repository.search_codes(query_data, "ICD-10-CM")
+
+        assert 0 < len(got) <= 10
+        assert "atherosclero" in got[0].description.lower()
+
+    def test_paged(self, session: Session):
+        query_data = QueryData(
+            code=None, description="angena", fuzzy=FuzzySearchParam(limit=5)
+        )
+        want = session.code_repository.search_codes(query_data, "ICD-10-CM")
+
+        page, total = session.code_repository.search_codes_paged(
+            query_data, "ICD-10-CM", page_size=2, start_cursor=want[0].id
+        )
+
+        assert total == len(want)
+        assert page == want[1:3]
+
+    @staticmethod
+    def failing_session(pgcode):
+        session = MagicMock()
+        error = OperationalError("SELECT", {}, MagicMock(pgcode=pgcode))
+        # the settings succeed, the search fails
+        session.execute.side_effect = [None, None, error]
+        return session
+
+    def test_timeout_finds_nothing(self):
+        session = self.failing_session("57014")
+        query_data = QueryData(
+            code=None, description="angena", fuzzy=FuzzySearchParam()
+        )
+
+        got = CodeRepository(session)._fuzzy_search(
+            select(t_o.code), query_data, query_data.fuzzy
+        )
+
+        assert got == []
+        session.begin_nested.return_value.rollback.assert_called_once()
+
+    def test_other_errors_are_raised(self):
+        session = self.failing_session("42P01")
+        query_data = QueryData(
+            code=None, description="angena", fuzzy=FuzzySearchParam()
+        )
+
+        with pytest.raises(OperationalError):
+            CodeRepository(session)._fuzzy_search(
+                select(t_o.code), query_data, query_data.fuzzy
+            )
+
+        session.begin_nested.return_value.rollback.assert_called_once()
+
+    def test_rejected_without_pg_trgm(self, monkeypatch):
+        monkeypatch.setattr(CodeRepository, "fuzzy_search_supported", False)
+        session = MagicMock()
+        query_data = QueryData(
+            code=None, description="angena", fuzzy=FuzzySearchParam()
+        )
+
+        with pytest.raises(d.FuzzySearchNotSupportedException):
+            CodeRepository(session)._fuzzy_search(
+                select(t_o.code), query_data, query_data.fuzzy
+            )
+
+        session.execute.assert_not_called()
+
+    @pytest.mark.parametrize("installed", [True, False])
+    def test_check_fuzzy_search_support(self, monkeypatch, installed):
+        monkeypatch.setattr(CodeRepository, "fuzzy_search_supported", not installed)
+        session = MagicMock()
+        session.__enter__.return_value = session
+        session.scalar.return_value = installed
+
+        CodeRepository.check_fuzzy_search_support(MagicMock(return_value=session))
+
+        assert CodeRepository.fuzzy_search_supported is installed
+
+
+class TestSubtreeSearchCodes:
+    def test_only_codes_of_the_subtree(self, session: Session):
+        root_id = session.code_repository.find_codes(["I25"], "ICD-10-CM")["I25"]
+        query_data = QueryData(code=None, description="unspecified")
+        subtree_query_data = QueryData(
+            code=None, description="unspecified", root_code_id=root_id
+        )
+
+        everywhere = session.code_repository.search_codes(query_data, "ICD-10-CM")
+        got = session.code_repository.search_codes(subtree_query_data, "ICD-10-CM")
+
+        assert 0 < len(got) < len(everywhere)
+        assert all(root_id in c.path for c in got)
+        assert [c for c in everywhere if root_id in c.path] == got
+
+    def test_unknown_root(self, session: Session):
+        query_data = QueryData(code=None, description="unspecified", root_code_id=-1)
+
+        assert session.code_repository.search_codes(query_data, "ICD-10-CM") == []
+
+
+class TestSearchCodesByOntology:
+    def test_same_as_single_searches(self, session: Session):
+        query_data = QueryData(code=None, description="diabetes")
+        ontology_ids = ["ICD-10-CM", "ICD-9-CM"]
+
+        got = session.code_repository.search_codes_by_ontology(
+            query_data, ontology_ids, page_size=5
+        )
+
+        assert list(got) == ontology_ids
+        for ontology_id in ontology_ids:
+            assert got[ontology_id] == session.code_repository.search_codes_paged(
+                query_data, ontology_id, page_size=5
+            )
+
+
+class TestGetSubtreeIds:
+    def test_subtree(self, session: Session):
+        root_id = session.code_repository.find_codes(["I25"], "ICD-10-CM")["I25"]
+        root = session.code_repository.get(root_id)
+
+        got = session.code_repository.get_subtree_ids([root_id])
+
+        assert got == list(range(root.id, root.last_descendant_id + 1))
+        assert all(root_id in c.path for c in session.code_repository.get_all(got))
+
+    def test_nested_and_unknown(self, session: Session):
+        ids = session.code_repository.find_codes(["I25", "I25.1"], "ICD-10-CM")
+
+        assert session.code_repository.get_subtree_ids(
+            [ids["I25.1"], ids["I25"], -1]
+        ) == session.code_repository.get_subtree_ids([ids["I25"]])
+
+    def test_empty(self, session: Session):
+        assert session.code_repository.get_subtree_ids([]) == []
+
+
+class TestFindCodes:
+    def test_find_codes_by_ontology(self, session: Session):
+        icd10_codes = ["I20", "I20.0", "I20.9", "NOT-A-CODE"]
+        icd9_codes = ["413.0", "413.9"]
+
+        got = session.code_repository.find_codes_by_ontology(
+            {"ICD-10-CM": icd10_codes, "ICD-9-CM": icd9_codes}
+        )
+
+        assert got["ICD-10-CM"] == session.code_repository.find_codes(
+            icd10_codes, "ICD-10-CM"
+        )
+        assert got["ICD-9-CM"] == session.code_repository.find_codes(
+            icd9_codes, "ICD-9-CM"
+        )
+        assert got["ICD-10-CM"]["NOT-A-CODE"] is None
+        assert all(got["ICD-9-CM"].values())
+
+    def test_find_codes_by_ontology_empty(self, session: Session):
+        got = session.code_repository.find_codes_by_ontology({"ICD-10-CM": []})
+        assert got == {"ICD-10-CM": {}}
@@ -1,6 +1,12 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.orm.exc import StaleDataError
+
+from medconb import domain as d
 from medconb.types import Session
 
-from ...helper import _cl_id
+from ...helper import _cl_id, _u_id
 
 
 class TestGetBy:
@@ -25,3 +31,33 @@ class TestGetBy:
         for test in tests:
             got = session.codelist_repository.get_by(**test["params"])
             assert {o.id for o in got} == test["want"]
+
+
+class TestConcurrentCommits:
+    @staticmethod
+    def commit(code_id: int) -> d.Commit:
+        return d.Commit(
+            [d.Changeset("ICD-10-CM", [code_id])], _u_id(1), datetime.now(), "msg"
+        )
+
+    def test_stale_head_is_rejected(self, sessionmaker):
+        sm, _ = sessionmaker
+
+        with sm() as first, sm() as second:
+            codelist = first.codelist_repository.get(_cl_id(3))
+            stale = second.codelist_repository.get(_cl_id(3))
+
+            codelist.add_commit(self.commit(9002))
+            first.commit()
+
+            stale.add_commit(self.commit(9003))
+            with pytest.raises(StaleDataError):
+                second.commit()
+
+        with sm() as session:
+            codelist = session.codelist_repository.get(_cl_id(3))
+            code_ids = {id_ for cs in codelist.codesets for id_ in cs.code_ids}
+
+            assert codelist.version == len(codelist.commits) + 1
+            assert 9002 in code_ids
+            assert 9003 not in code_ids
@@ -0,0 +1,252 @@
+import pytest
+from sqlalchemy import insert, text
+
+import medconb.domain as d
+import medconb.graphql.types as gql
+from medconb.persistence.sqlalchemy import ontology_orm as t_o
+from medconb.persistence.sqlalchemy.repositories import CodeRepository
+from medconb.persistence.sqlalchemy.search_index import CodeSearchIndex
+
+CODES = [
+    (1, "ICD-10-CM", "E11", "Type 2 diabetes mellitus", 2),
+    (2, "ICD-10-CM", "E11.9", "Type 2 diabetes mellitus without complications", 2),
+    (3, "ICD-10-CM", "E10", "Type 1 diabetes mellitus", 3),
+    (4, "ICD-10-CM", "I25.10", "Atherosclerotic heart disease of native artery", 4),
+    (5, "ICD-10-CM", "I50.9", "Heart failure, unspecified", 5),
+    (6, "ICD-10-CM", "S72.001A", "Fracture of unspecified part of neck of femur", 6),
+    (7, "ICD-9-CM", "250.00", "Diabetes mellitus without mention of complication", 7),
+    (8, "ICD-10-CM", "Z99_1", "100% dependence on respirator", 8),
+]
+
+
+def ilike(value):
+    return gql.CodeSearchParam(value=value)
+
+
+def posix(value):
+    return gql.CodeSearchParam(value=value, type=d.CodeSearchParamType.POSIX)
+
+
+@pytest.fixture(scope="module")
+def index():
+    return CodeSearchIndex.build(CODES)
+
+
+class TestCodeSearchIndex:
+    @pytest.mark.parametrize(
+        "query, want",
+        [
+            (gql.QueryData(description="diabetes"), [1, 2, 3]),
+            (gql.QueryData(description="DIABETES MELL"), [1, 2, 3]),
+            (gql.QueryData(description="abetes mell"), [1, 2, 3]),
+            (gql.QueryData(description="heart"), [4, 5]),
+            (gql.QueryData(description="failure, unsp"), [5]),
+            (gql.QueryData(description="type 2 diabetes"), [1, 2]),
+            (gql.QueryData(description="fracture of%femur"), [6]),
+            (gql.QueryData(description="fracture of%"), [6]),
+            (gql.QueryData(description="of%femur"), []),
+            (gql.QueryData(description="100%"), [8]),
+            (gql.QueryData(description="cancer"), []),
+            (gql.QueryData(code=ilike("E11")), [1]),
+            (gql.QueryData(code=ilike("e11.9")), [2]),
+            (gql.QueryData(code=ilike("E1%")), [1, 2, 3]),
+            (gql.QueryData(code=ilike("E1_")), [1, 3]),
+            (gql.QueryData(code=ilike("%.9")), [2, 5]),
+            (gql.QueryData(code=ilike("Z99\\_1")), [8]),
+            (gql.QueryData(code=posix("^E1[01]$")), [1, 3]),
+            (gql.QueryData(code=posix("^e1")), []),
+            (gql.QueryData(code=posix("\\.9")), [2, 5]),
+            (gql.QueryData(description="diabetes", code=ilike("E11%")), [1, 2]),
+            (gql.QueryData(description="heart", code=posix("^I5")), [5]),
+        ],
+    )
+    def test_search(self, index, query, want):
+        assert index.search(query, "ICD-10-CM") == want
+
+    def test_search_other_ontology(self, index):
+        query = gql.QueryData(description="diabetes")
+
+        assert index.search(query, "ICD-9-CM") == [7]
+        assert index.search(query, "unknown") == []
+
+    def test_unsupported_regex(self, index):
+        query = gql.QueryData(code=posix("^E[[:digit:]]"))
+
+        assert index.search(query, "ICD-10-CM") is None
+
+
+class TestSubtreeSearch:
+    @pytest.mark.parametrize(
+        "root_code_id, want",
+        [
+            (1, [1, 2]),
+            (2, [2]),
+            (3, [3]),
+            (4, []),
+            (7, []),
+            (42, []),
+        ],
+    )
+    def test_search(self, index, root_code_id, want):
+        query = gql.QueryData(description="diabetes", root_code_id=root_code_id)
+
+        assert index.search(query, "ICD-10-CM") == want
+
+    def test_with_code(self, index):
+        query = gql.QueryData(code=ilike("E1%"), root_code_id=1)
+
+        assert index.search(query, "ICD-10-CM") == [1, 2]
+
+    def test_other_ontology(self, index):
+        query = gql.QueryData(description="diabetes", root_code_id=7)
+
+        assert index.search(query, "ICD-9-CM") == [7]
+
+    def test_fuzzy(self, index):
+        query = fuzzy("diabetis", root_code_id=1)
+
+        assert index.search(query, "ICD-10-CM") == [1, 2]
+
+    def test_search_page(self, index):
+        query = gql.QueryData(description="diabetes", root_code_id=1)
+
+        assert index.search_page(query, "ICD-10-CM", 1) == ([1], 2)
+        assert index.search_page(query, "ICD-10-CM", 1, 1) == ([2], 2)
+
+
+class TestSearchPage:
+    @pytest.fixture
+    def index(self):
+        return CodeSearchIndex.build(
+            [
+                (1, "ICD-10-CM", "I50", "Heart failure", 4),
+                (2, "ICD-10-CM", "I50.1", "Left ventricular failure", 2),
+                (3, "ICD-10-CM", "I50.2", "Systolic (congestive) heart failure", 3),
+                (4, "ICD-10-CM", "I50.9", "Heart failures, unspecified", 4),
+                (5, "ICD-10-CM", "Z50.9", "Heart failure, unspecified", 5),
+                (6, "ICD-10-CM", "I50.9X", "Heart failure due to I50.9", 6),
+            ]
+        )
+
+    def test_exact_code_first(self, index):
+        query = gql.QueryData(code=ilike("%I50.9%"))
+
+        assert index.search_page(query, "ICD-10-CM", 10) == ([4, 6], 2)
+
+    def test_whole_words_first(self, index):
+        query = gql.QueryData(description="heart failure")
+
+        assert index.search_page(query, "ICD-10-CM", 10) == ([1, 3, 5, 6, 4], 5)
+
+    def test_exact_code_before_whole_words(self, index):
+        query = gql.QueryData(description="heart failure", code=ilike("I50.9%"))
+
+        assert index.search_page(query, "ICD-10-CM", 10) == ([4, 6], 2)
+
+    def test_paging(self, index):
+        query = gql.QueryData(description="heart failure")
+
+        assert index.search_page(query, "ICD-10-CM", 2) == ([1, 3], 5)
+        assert index.search_page(query, "ICD-10-CM", 2, 3) == ([5, 6], 5)
+        assert index.search_page(query, "ICD-10-CM", 2, 6) == ([4], 5)
+        assert index.search_page(query, "ICD-10-CM", 2, 4) == ([], 5)
+
+    def test_unknown_cursor(self, index):
+        query = gql.QueryData(description="heart failure")
+
+        assert index.search_page(query, "ICD-10-CM", 2, 2) == ([], 5)
+
+    def test_unsupported_regex(self, index):
+        query = gql.QueryData(code=posix("^I[[:digit:]]"))
+
+        assert index.search_page(query, "ICD-10-CM", 2) is None
+
+
+def fuzzy(description, threshold=0.3, limit=50, code=None, root_code_id=None):
+    return gql.QueryData(
+        description=description,
+        code=code,
+        fuzzy=gql.FuzzySearchParam(threshold=threshold, limit=limit),
+        root_code_id=root_code_id,
+    )
+
+
+FUZZY_SEARCHES = [
+    (fuzzy("diabetis"), [1, 2, 3]),
+    (fuzzy("diabetis melitus tipe"), [1, 2, 3]),
+    (fuzzy("atherosclerotik"), [4]),
+    (fuzzy("hart failur"), [5]),
+    (fuzzy("hart failur", threshold=0.6), [5]),
+    (fuzzy("hart failur", threshold=0.7), []),
+    (fuzzy("fractur femr neck"), [6]),
+    (fuzzy("diabetis", limit=2), [1, 2]),
+    (fuzzy("diabetis", code=ilike("E11%")), [1, 2]),
+    (fuzzy("diabetis", code=posix("^E1[0]")), [3]),
+    (fuzzy("diabetis", root_code_id=3), [3]),
+    (fuzzy("of", limit=3), [4, 6, 8]),
+    (fuzzy("of", limit=2), [4, 6]),
+    (fuzzy("unspecifed neck"), [6, 5]),
+    (fuzzy("cancer"), []),
+]
+
+
+class TestFuzzySearch:
+    @pytest.mark.parametrize("query, want", FUZZY_SEARCHES)
+    def test_search(self, index, query, want):
+        assert index.search(query, "ICD-10-CM") == want
+
+    def test_best_first(self, index):
+        query = fuzzy("type 1 diabetis")
+
+        assert index.search(query, "ICD-10-CM")[0] == 3
+
+    def test_search_page(self, index):
+        query = fuzzy("diabetis")
+
+        assert index.search_page(query, "ICD-10-CM", 2) == ([1, 2], 3)
+        assert index.search_page(query, "ICD-10-CM", 2, 2) == ([3], 3)
+
+    def test_unsupported_regex(self, index):
+        query = fuzzy("diabetis", code=posix("^E[[:digit:]]"))
+
+        assert index.search(query, "ICD-10-CM") is None
+
+
+class TestFuzzySearchParity:
+    """
+    Runs the fuzzy searches in SQL (pg_trgm's `<%` and `word_similarity`)
+    on the same codes, which replace the code table within the
+    transaction of the test.
+    """
+
+    @pytest.fixture
+    def repository(self, session):
+        bind_arguments = {"mapper": d.Code}
+        session.execute(
+            text("CREATE TEMP TABLE code (LIKE public.code) ON COMMIT DROP"),
+            bind_arguments=bind_arguments,
+        )
+        session.execute(
+            insert(t_o.code),
+            [
+                {
+                    "id": id_,
+                    "code": code,
+                    "ontology_id": ontology_id,
+                    "description": description,
+                    "path": [id_],
+                    "children_ids": [],
+                    "last_descendant_id": last_descendant_id,
+                }
+                for id_, ontology_id, code, description, last_descendant_id in CODES
+            ],
+            bind_arguments=bind_arguments,
+        )
+        yield CodeRepository(session)
+        session.rollback()
+
+    @pytest.mark.parametrize("query, want", FUZZY_SEARCHES)
+    def test_same_as_sql(self, repository, index, query, want):
+        got = [c.id for c in repository.search_codes(query, "ICD-10-CM")]
+
+        assert got == index.search(query, "ICD-10-CM") == want
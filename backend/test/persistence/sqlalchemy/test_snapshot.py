@@ -0,0 +1,83 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import medconb.domain as d
+from medconb.persistence.sqlalchemy.snapshot import (
+    CodeSnapshot,
+    SnapshotCodeRepository,
+    write_snapshot,
+)
+
+CODES = [
+    d.Code(1, "A00", "ICD-10-CM", "Cholera", [1], [2, 3], 3),
+    d.Code(2, "A00.0", "ICD-10-CM", "Cholera due to Vibrio", [1, 2], [], 2),
+    d.Code(3, "A00.1", "ICD-10-CM", "Cholera, biovar eltor, ärger", [1, 3], [], 3),
+    d.Code(7, "A00", "ICD-9-CM", "Same code in another ontology", [7], [], 7),
+]
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = tmp_path / "codes.snapshot"
+    assert write_snapshot(path, CODES) == len(CODES)
+    return CodeSnapshot(path)
+
+
+class TestCodeSnapshot:
+    def test_roundtrip(self, snapshot):
+        assert len(snapshot) == len(CODES)
+        assert snapshot.get_all([c.id for c in CODES]) == CODES
+
+    def test_get_all_keeps_order_and_skips_unknown(self, snapshot):
+        got = snapshot.get_all([3, 42, 1, 0, 7])
+
+        assert [c.id for c in got] == [3, 1, 7]
+
+    def test_find_codes(self, snapshot):
+        assert snapshot.find_codes("ICD-10-CM", ["A00.1", "a00", "B99"]) == {
+            "A00.1": 3,
+            "a00": 1,
+            "B99": None,
+        }
+        assert snapshot.find_codes("ICD-9-CM", ["A00"]) == {"A00": 7}
+        assert snapshot.find_codes("unknown", ["A00"]) == {"A00": None}
+
+    def test_subtree_ids(self, snapshot):
+        assert snapshot.subtree_ids([1]) == [1, 2, 3]
+        assert snapshot.subtree_ids([3]) == [3]
+        assert snapshot.subtree_ids([2, 1, 3]) == [1, 2, 3]
+        assert snapshot.subtree_ids([7, 2, 42]) == [2, 7]
+        assert snapshot.subtree_ids([]) == []
+
+    def test_empty(self, tmp_path):
+        path = tmp_path / "codes.snapshot"
+        write_snapshot(path, [])
+        snapshot = CodeSnapshot(path)
+
+        assert snapshot.get_all([1]) == []
+        assert snapshot.find_codes("ICD-10-CM", ["A00"]) == {"A00": None}
+        assert snapshot.subtree_ids([1]) == []
+
+    def test_rejects_other_files(self, tmp_path):
+        path = tmp_path / "codes.snapshot"
+        path.write_bytes(b"not a snapshot")
+
+        with pytest.raises(ValueError):
+            CodeSnapshot(path)
+
+
+class TestWarmup:
+    def test_retries_after_failure(self, snapshot, tmp_path):
+        repository = SnapshotCodeRepository(MagicMock(), tmp_path)
+        repository.WARMUP_RETRY_DELAY = 0
+
+        with patch.object(
+            repository, "_load", side_effect=[RuntimeError("down"), snapshot]
+        ) as load:
+            asyncio.run(repository._warmup())
+
+        assert load.call_count == 2
+        assert repository.is_ready()
+        assert repository.get_all([2]) == [CODES[1]]